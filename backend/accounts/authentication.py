@@ -1,7 +1,10 @@
 from rest_framework_simplejwt.authentication import JWTAuthentication
-from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken, TokenError
+from rest_framework_simplejwt.settings import api_settings
 from django.conf import settings
 
+from .users import cached_user, claim_user, claims_current
+
 
 class CookieJWTAuthentication(JWTAuthentication):
     def authenticate(self, request):
@@ -16,3 +19,22 @@ class CookieJWTAuthentication(JWTAuthentication):
 
         # Fall back to header-based authentication
         return super().authenticate(request)
+
+    def get_user(self, validated_token):
+        """
+        With JWT_CLAIM_USERS, build the user from the token claims while they
+        are current and fall back to the cached full user otherwise.
+        """
+        if not settings.JWT_CLAIM_USERS:
+            return super().get_user(validated_token)
+        if api_settings.USER_ID_CLAIM not in validated_token:
+            raise InvalidToken('Token contained no recognizable user identification')
+        if claims_current(validated_token):
+            return claim_user(validated_token)
+
+        user = cached_user(validated_token[api_settings.USER_ID_CLAIM])
+        if user is None:
+            raise AuthenticationFailed('User not found', code='user_not_found')
+        if not user.is_active:
+            raise AuthenticationFailed('User is inactive', code='user_inactive')
+        return user
@@ -2,6 +2,8 @@ from rest_framework import serializers
 from django.contrib.auth import get_user_model
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 
+from .users import token_claims
+
 User = get_user_model()
 
 class UserSerializer(serializers.ModelSerializer):
@@ -32,5 +34,6 @@ class LoginSerializer(TokenObtainPairSerializer):
     @classmethod
     def get_token(cls, user):
         token = super().get_token(user)
-        token['role'] = user.role
+        for claim, value in token_claims(user).items():
+            token[claim] = value
         return token
@@ -1,9 +1,13 @@
-from django.test import TestCase
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.test import TestCase, override_settings
 from django.contrib.auth import get_user_model
 from rest_framework.test import APITestCase
 from rest_framework import status
 from django.urls import reverse
-from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+
+from .users import check_cache
 
 User = get_user_model()
 
@@ -106,3 +110,98 @@ class AuthTests(APITestCase):
         self.assertIsNotNone(refresh_cookie)
         self.assertEqual(access_cookie.value, '')
         self.assertEqual(refresh_cookie.value, '')
+
+
+@override_settings(JWT_CLAIM_USERS=True)
+class ClaimUserTests(APITestCase):
+    """Test request users built from token claims"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            username='claimuser',
+            email='claim@example.com',
+            password='testpass123',
+            role='staff',
+            organization_type='hospital'
+        )
+
+    def login(self):
+        response = self.client.post(
+            reverse('login'), {'username': 'claimuser', 'password': 'testpass123'}, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_login_token_carries_profile_claims(self):
+        """Test the login cookie holds the role and profile claims"""
+        self.login()
+        token = AccessToken(self.client.cookies['access_token'].value)
+        self.assertEqual(token['role'], 'staff')
+        self.assertEqual(token['email'], 'claim@example.com')
+        self.assertEqual(token['organization_type'], 'hospital')
+
+    def test_profile_without_queries(self):
+        """Test the profile is answered from the token alone"""
+        self.login()
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('profile'))
+        self.assertEqual(response.data, {
+            'id': self.user.id,
+            'username': 'claimuser',
+            'email': 'claim@example.com',
+            'role': 'staff',
+            'organization_type': 'hospital',
+        })
+
+    def test_changed_account_is_loaded_once_then_cached(self):
+        """Test a change makes older claims fall back to the cached full user"""
+        self.login()
+        self.user.role = 'customer'
+        self.user.save()
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(reverse('profile')).data['role'], 'customer')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(reverse('profile')).data['role'], 'customer')
+
+    def test_role_change_revokes_existing_token(self):
+        """Test a demoted user's existing access token loses the staff role"""
+        self.login()
+        data = {'name': 'Claim Branch', 'location': 'Main Street'}
+        self.assertEqual(self.client.post(reverse('create_service_point'), data).status_code, status.HTTP_201_CREATED)
+        self.user.role = 'customer'
+        self.user.save()
+        self.assertEqual(self.client.post(reverse('create_service_point'), data).status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_evicted_marker_does_not_restore_old_claims(self):
+        """Test claims are not trusted once the account's marker is gone from the cache"""
+        self.login()
+        self.user.role = 'customer'
+        self.user.save()
+        cache.clear()
+        self.assertEqual(self.client.get(reverse('profile')).data['role'], 'customer')
+
+    def test_claim_users_need_a_shared_cache(self):
+        """Test JWT_CLAIM_USERS is refused with a per-process cache"""
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}):
+            with self.assertRaises(ImproperlyConfigured):
+                check_cache()
+        with override_settings(CACHES={'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': 'redis://localhost:6379'
+        }}):
+            check_cache()
+
+    def test_deleted_and_inactive_users_are_rejected(self):
+        """Test tokens of deleted or deactivated accounts stop working"""
+        self.login()
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get(reverse('profile')).status_code, status.HTTP_401_UNAUTHORIZED)
+
+        self.user.delete()
+        self.assertEqual(self.client.get(reverse('profile')).status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_tokens_without_claims_load_the_user(self):
+        """Test tokens issued without profile claims still authenticate"""
+        self.client.cookies['access_token'] = str(RefreshToken.for_user(self.user).access_token)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(reverse('profile')).data['email'], 'claim@example.com')
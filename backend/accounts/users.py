@@ -0,0 +1,124 @@
+"""
+Request users rebuilt from JWT claims.
+
+With ``JWT_CLAIM_USERS`` on, ``CookieJWTAuthentication`` does not read the
+user row on every request. Tokens carry the fields in ``CLAIM_FIELDS`` and
+the request user is a ``User`` built from them, with every other field
+deferred: it only loads from the database if something reads it.
+
+Claims go stale when the account changes. Each user has a marker in the
+cache holding the time since which its claims are current: issuing tokens
+adds it, and saving or deleting the user moves it to the time of the change.
+Claims are only trusted while the marker is there and older than them;
+tokens with older claims, or without a marker because it expired or was
+evicted, fall back to a full load of the user, cached for
+``USER_CACHE_TIMEOUT`` seconds. The full load is also what turns away
+deleted and inactive accounts.
+
+Every worker has to see the markers, so the default cache must be shared
+(``CACHE_URL``); ``check_cache`` refuses a per-process one.
+"""
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import router, transaction
+from rest_framework_simplejwt.settings import api_settings
+
+CLAIM_FIELDS = ('username', 'email', 'role', 'organization_type')
+# When the claims were read from the user; copied into refreshed access tokens
+CLAIMS_AT = 'claims_at'
+
+
+# Caches whose entries other workers never see
+LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+def check_cache():
+    """
+    Raise ``ImproperlyConfigured`` when ``JWT_CLAIM_USERS`` is on without a
+    cache shared by every worker.
+    """
+    if settings.JWT_CLAIM_USERS and settings.CACHES['default']['BACKEND'] in LOCAL_CACHES:
+        raise ImproperlyConfigured(
+            'JWT_CLAIM_USERS needs a shared default cache (set CACHE_URL); with a per-process '
+            'cache, changed or deleted accounts keep their old claims in other workers.'
+        )
+
+
+def _valid_key(user_id):
+    return f'user_claims_since_{user_id}'
+
+
+def _marker_timeout():
+    return int(api_settings.REFRESH_TOKEN_LIFETIME.total_seconds())
+
+
+def _user_key(user_id):
+    return f'user_{user_id}'
+
+
+def token_claims(user):
+    """
+    Return the claims to embed in the tokens of ``user``.
+    """
+    claims = {field: getattr(user, field) for field in CLAIM_FIELDS}
+    claims[CLAIMS_AT] = time.time()
+    # Keeps a later change of the account, if one is marked, in force
+    if not cache.add(_valid_key(user.pk), claims[CLAIMS_AT], timeout=_marker_timeout()):
+        cache.touch(_valid_key(user.pk), timeout=_marker_timeout())
+    return claims
+
+
+def claims_current(token):
+    """
+    Whether the account has not changed since the claims of ``token`` were
+    read.
+    """
+    if CLAIMS_AT not in token or any(field not in token for field in CLAIM_FIELDS):
+        return False
+    since = cache.get(_valid_key(token[api_settings.USER_ID_CLAIM]))
+    return since is not None and token[CLAIMS_AT] >= since
+
+
+def claim_user(token):
+    """
+    Build the user of ``token`` from its claims without a query.
+    """
+    User = get_user_model()
+    loaded = {field: token[field] for field in CLAIM_FIELDS}
+    loaded[User._meta.pk.attname] = User._meta.pk.to_python(token[api_settings.USER_ID_CLAIM])
+    fields = [field.attname for field in User._meta.concrete_fields if field.attname in loaded]
+    return User.from_db(router.db_for_read(User), fields, [loaded[name] for name in fields])
+
+
+def cached_user(user_id):
+    """
+    Return the full user with id ``user_id``, or ``None`` if there is none.
+    """
+    user = cache.get(_user_key(user_id))
+    if user is None:
+        user = get_user_model().objects.filter(pk=user_id).first()
+        if user is not None:
+            cache.set(_user_key(user_id), user, timeout=settings.USER_CACHE_TIMEOUT)
+    return user
+
+
+def _forget(user_id):
+    # Slightly ahead, so claims read in the same instant count as older
+    cache.set(_valid_key(user_id), time.time() + 1e-6, timeout=_marker_timeout())
+    cache.delete(_user_key(user_id))
+
+
+def invalidate_user(user_id):
+    """
+    Mark the claims and cached copy of a user as stale, straight away and
+    again once the transaction commits.
+    """
+    _forget(user_id)
+    transaction.on_commit(lambda: _forget(user_id))
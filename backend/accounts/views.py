@@ -9,9 +9,10 @@ from .serializers import RegisterSerializer
 from rest_framework_simplejwt.views import TokenObtainPairView
 from rest_framework_simplejwt.tokens import RefreshToken
 from .serializers import LoginSerializer
-from queues.models import ServicePoint
-from asgiref.sync import async_to_sync
-from channels.layers import get_channel_layer
+from queues.engine import get_queue_engine, ACTIVE_STATUSES
+from queues.models import ServicePoint, QueueEntry
+from queues.outbox import enqueue_group_send, enqueue_queue_update
+from django.db import transaction
 
 
 
@@ -28,7 +29,7 @@ def register(request):
     serializer = RegisterSerializer(data=request.data)
     if serializer.is_valid():
         user = serializer.save()
-        refresh = RefreshToken.for_user(user)
+        refresh = LoginSerializer.get_token(user)
         return Response({
             'user': {
                 'id': user.id,
@@ -57,7 +58,8 @@ class CustomLoginView(TokenObtainPairView):
             serializer = self.get_serializer(data=request.data)
             serializer.is_valid(raise_exception=True)
             user = serializer.user
-            refresh = RefreshToken.for_user(user)
+            # get_token adds the role and profile claims that for_user leaves out
+            refresh = LoginSerializer.get_token(user)
             access_token = refresh.access_token
 
             logger.info(f"Login successful - IP: {ip_address}, User-Agent: {user_agent}, Method: {method}, Path: {path}, Username: {user.username}")
@@ -159,19 +161,24 @@ def delete_user(request):
     Allow authenticated user to delete their own account.
     """
     user = request.user
-    # Deactivate all service points owned by the user
-    service_points = ServicePoint.objects.filter(creator=user)
-    for sp in service_points:
-        sp.is_active = False
-        sp.save()
-        # Notify connected clients
-        channel_layer = get_channel_layer()
-        async_to_sync(channel_layer.group_send)(
-            f'queue_{sp.id}',
-            {
-                'type': 'queue_update',
-                'data': {'deleted': True}
-            }
-        )
-    user.delete()
+    with transaction.atomic():
+        # Deactivate all service points owned by the user
+        service_points = ServicePoint.objects.filter(creator=user)
+        for sp in service_points:
+            sp.is_active = False
+            sp.save()
+            # Notify connected clients once the deletion has committed
+            enqueue_group_send(
+                f'queue_{sp.id}',
+                {
+                    'type': 'queue_update',
+                    'data': {'deleted': True}
+                }
+            )
+        # Take the user out of any queue they are still waiting in
+        engine = get_queue_engine()
+        for entry in QueueEntry.objects.filter(user=user, status__in=ACTIVE_STATUSES):
+            engine.abandon(entry)
+            enqueue_queue_update(entry.service_point_id)
+        user.delete()
     return Response({'message': 'Account deleted successfully.'}, status=status.HTTP_204_NO_CONTENT)
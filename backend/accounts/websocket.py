@@ -0,0 +1,35 @@
+from channels.auth import AuthMiddlewareStack
+from channels.db import database_sync_to_async
+from channels.middleware import BaseMiddleware
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken, TokenError
+
+from .authentication import CookieJWTAuthentication
+
+
+@database_sync_to_async
+def get_token_user(raw_token):
+    authentication = CookieJWTAuthentication()
+    try:
+        return authentication.get_user(authentication.get_validated_token(raw_token))
+    except (AuthenticationFailed, InvalidToken, TokenError):
+        return None
+
+
+class JWTAuthMiddleware(BaseMiddleware):
+    """
+    Authenticate WebSocket connections from the ``access_token`` cookie, the
+    same way CookieJWTAuthentication does for API requests. Without a valid
+    token the session user set by AuthMiddlewareStack is kept.
+    """
+
+    async def __call__(self, scope, receive, send):
+        raw_token = scope.get('cookies', {}).get('access_token')
+        if raw_token:
+            user = await get_token_user(raw_token)
+            if user is not None:
+                scope = dict(scope, user=user)
+        return await super().__call__(scope, receive, send)
+
+
+def JWTAuthMiddlewareStack(inner):
+    return AuthMiddlewareStack(JWTAuthMiddleware(inner))
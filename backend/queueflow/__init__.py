@@ -8,7 +8,11 @@ try:
     try:
         celery_app = importlib.import_module('queueflow.celery_app').app
     except Exception:
-        from .celery_app import app as celery_app
+        try:
+            # celery_app.py lives next to manage.py
+            celery_app = importlib.import_module('celery_app').app
+        except Exception:
+            from .celery_app import app as celery_app
 except Exception:
     celery_app = None
 
@@ -10,15 +10,22 @@ https://docs.djangoproject.com/en/5.2/howto/deploy/asgi/
 import os
 
 from django.core.asgi import get_asgi_application
-from channels.routing import ProtocolTypeRouter, URLRouter
-from channels.auth import AuthMiddlewareStack
-import queues.routing
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'queueflow.settings')
 
+# Set up Django before importing consumers, which import models
+django_asgi_app = get_asgi_application()
+
+from channels.routing import ProtocolTypeRouter, URLRouter  # noqa: E402
+from django.urls import re_path  # noqa: E402
+from accounts.websocket import JWTAuthMiddlewareStack  # noqa: E402
+import queues.routing  # noqa: E402
+
 application = ProtocolTypeRouter({
-    "http": get_asgi_application(),
-    "websocket": AuthMiddlewareStack(
+    "http": URLRouter(
+        queues.routing.http_urlpatterns + [re_path(r'', django_asgi_app)]
+    ),
+    "websocket": JWTAuthMiddlewareStack(
         URLRouter(
             queues.routing.websocket_urlpatterns
         )
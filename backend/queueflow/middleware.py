@@ -1,43 +1,38 @@
-import logging
-from django.utils import timezone
-from django.contrib.auth.models import AnonymousUser
-from accounts.models import User
-from queues.models import AuditLog
+from django.conf import settings
 
-logger = logging.getLogger(__name__)
+from queues.audit import METHOD_ACTIONS, get_audit_buffer
 
 
 class AuditLogMiddleware:
     """
     Middleware to log user actions for security and compliance.
+
+    The event is recorded after the response, once DRF has authenticated
+    the user, and only handed to the asynchronous audit buffer
+    (``queues.audit``); the database write happens in the background.
     """
 
     def __init__(self, get_response):
         self.get_response = get_response
 
     def __call__(self, request):
-        # Log the request
-        if hasattr(request, 'user') and not isinstance(request.user, AnonymousUser):
-            action = f"{request.method} {request.path}"
-            details = {
-                'method': request.method,
-                'path': request.path,
-                'user_agent': request.META.get('HTTP_USER_AGENT', ''),
-                'ip_address': self.get_client_ip(request),
-                'query_params': dict(request.GET),
-                'post_data': dict(request.POST) if request.method == 'POST' else {},
-            }
+        response = self.get_response(request)
 
-            # Create audit log entry
-            AuditLog.objects.create(
-                user=request.user,
-                action=action,
-                details=str(details),
-                timestamp=timezone.now(),
-                ip_address=self.get_client_ip(request)
+        user = getattr(request, 'user', None)
+        if settings.AUDIT_LOG_ENABLED and user is not None and user.is_authenticated:
+            match = request.resolver_match
+            session = getattr(request, 'session', None)
+            get_audit_buffer().record(
+                user_id=user.pk,
+                action=METHOD_ACTIONS.get(request.method, 'view'),
+                resource_type=(match.url_name or '')[:50] if match else '',
+                resource_id=str(next(iter(match.kwargs.values()), ''))[:100] if match else '',
+                description=f"{request.method} {request.path} -> {response.status_code}",
+                ip_address=self.get_client_ip(request),
+                user_agent=request.META.get('HTTP_USER_AGENT', ''),
+                session_id=(session.session_key or '') if session is not None else '',
             )
 
-        response = self.get_response(request)
         return response
 
     def get_client_ip(self, request):
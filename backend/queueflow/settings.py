@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
 import os
+import sys
 from pathlib import Path
 from dotenv import load_dotenv
 
@@ -60,6 +61,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'queueflow.middleware.AuditLogMiddleware',
 ]
 
 ROOT_URLCONF = 'queueflow.urls'
@@ -129,6 +131,12 @@ REST_FRAMEWORK = {
     ],
 }
 
+# Build request users from the JWT claims instead of reading the user row on
+# every request (see accounts.users). Full user loads are cached for
+# USER_CACHE_TIMEOUT seconds. Needs a shared cache (CACHE_URL).
+JWT_CLAIM_USERS = os.getenv('JWT_CLAIM_USERS', 'False') == 'True'
+USER_CACHE_TIMEOUT = int(os.getenv('USER_CACHE_TIMEOUT', '60'))
+
 
 # Custom User Model
 AUTH_USER_MODEL = 'accounts.User'
@@ -174,13 +182,142 @@ STATIC_URL = 'static/'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Cache shared by all workers when CACHE_URL (a Redis URL) is set
+if os.getenv('CACHE_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('CACHE_URL'),
+        }
+    }
+
 # Channels configuration
-CHANNEL_LAYERS = {
-    "default": {
-        "BACKEND": "channels.layers.InMemoryChannelLayer"
+# CHANNEL_LAYER=redis shares groups between ASGI workers (and the Celery
+# workers relaying the outbox). Several comma separated URLs in
+# CHANNEL_REDIS_URLS shard channels and groups across Redis instances by name.
+CHANNEL_LAYER = os.getenv('CHANNEL_LAYER', 'memory')
+if CHANNEL_LAYER == 'redis':
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "channels_redis.core.RedisChannelLayer",
+            "CONFIG": {
+                "hosts": [url.strip() for url in os.getenv('CHANNEL_REDIS_URLS', 'redis://localhost:6379/2').split(',')],
+                "prefix": os.getenv('CHANNEL_REDIS_PREFIX', 'queueflow'),
+                "capacity": int(os.getenv('CHANNEL_CAPACITY', '1000')),
+                "expiry": 60,
+                "group_expiry": 86400,
+            },
+        }
     }
+else:
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "channels.layers.InMemoryChannelLayer"
+        }
+    }
+
+# Live queue engine (see queues/engine/__init__.py)
+QUEUE_ENGINE = os.getenv('QUEUE_ENGINE', 'queues.engine.orm.ORMQueueEngine')
+QUEUE_ENGINE_REDIS_URL = os.getenv('QUEUE_ENGINE_REDIS_URL', 'redis://localhost:6379/1')
+QUEUE_ENGINE_KEY_PREFIX = os.getenv('QUEUE_ENGINE_KEY_PREFIX', 'queueflow')
+# Seconds after which an entry taken off the queue by a call that never
+# committed (it was rolled back) can be called again
+QUEUE_ENGINE_CLAIM_TIMEOUT = int(os.getenv('QUEUE_ENGINE_CLAIM_TIMEOUT', '30'))
+
+# Who is connected to which service point. Sockets renew their entry with a
+# heartbeat; entries not renewed within PRESENCE_TTL seconds expire. Set
+# PRESENCE_REDIS_URL to share the registry between ASGI workers.
+PRESENCE_REDIS_URL = os.getenv('PRESENCE_REDIS_URL')
+PRESENCE_TTL = int(os.getenv('PRESENCE_TTL', '60'))
+
+# Celery configuration
+CELERY_BROKER_URL = os.getenv('CELERY_BROKER_URL', 'redis://localhost:6379/0')
+CELERY_TASK_ALWAYS_EAGER = os.getenv('CELERY_TASK_ALWAYS_EAGER', 'False') == 'True'
+CELERY_BEAT_SCHEDULE = {
+    # Safety net for outbox messages whose on-commit relay never ran
+    'relay-outbox': {
+        'task': 'queues.tasks.relay_outbox',
+        'schedule': 5.0,
+    },
+    # Wait-time reminders missed by the event-driven path
+    'wait-time-notifications': {
+        'task': 'queues.tasks.send_wait_time_notifications',
+        'schedule': 60.0,
+    },
+    # Retries and emails held back by the provider rate limit
+    'dispatch-emails': {
+        'task': 'queues.tasks.dispatch_emails',
+        'schedule': 5.0,
+    },
+    # Audit log partitions for the coming months
+    'audit-partitions': {
+        'task': 'queues.tasks.ensure_audit_partitions',
+        'schedule': 24 * 60 * 60.0,
+    },
 }
 
+# Transactional outbox (see queues/outbox.py)
+OUTBOX_BATCH_SIZE = int(os.getenv('OUTBOX_BATCH_SIZE', '100'))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', '5'))
+OUTBOX_RELAY_ON_COMMIT = os.getenv('OUTBOX_RELAY_ON_COMMIT', 'True') == 'True'
+
+# Minutes per customer assumed before a service point has served anyone
+DEFAULT_SERVICE_DURATION = int(os.getenv('DEFAULT_SERVICE_DURATION', '5'))
+# Weight of the newest service time in the running average (see queues/estimator.py)
+ETA_EWMA_ALPHA = float(os.getenv('ETA_EWMA_ALPHA', '0.2'))
+
+# Staffing forecasts (see queues/staffing.py): mean wait to staff for, in
+# minutes, and how much history to learn from
+STAFFING_TARGET_WAIT = float(os.getenv('STAFFING_TARGET_WAIT', '5'))
+STAFFING_HISTORY_WEEKS = int(os.getenv('STAFFING_HISTORY_WEEKS', '52'))
+
+# Audit log (see queues/audit.py): events are buffered in memory and written
+# in batches by a background thread every AUDIT_BATCH_SIZE events or
+# AUDIT_FLUSH_INTERVAL milliseconds. A request waits at most
+# AUDIT_FULL_TIMEOUT milliseconds for room in a full buffer before its event
+# is dropped.
+AUDIT_LOG_ENABLED = os.getenv('AUDIT_LOG_ENABLED', 'True') == 'True'
+# Off under `manage.py test`, where a second connection cannot see the data
+# of the test's open transaction; full batches are then written inline
+RUNNING_TESTS = sys.argv[1:2] == ['test']
+AUDIT_BACKGROUND_WRITER = os.getenv('AUDIT_BACKGROUND_WRITER', str(not RUNNING_TESTS)) == 'True'
+AUDIT_BUFFER_SIZE = int(os.getenv('AUDIT_BUFFER_SIZE', '10000'))
+AUDIT_BATCH_SIZE = int(os.getenv('AUDIT_BATCH_SIZE', '500'))
+AUDIT_FLUSH_INTERVAL = int(os.getenv('AUDIT_FLUSH_INTERVAL', '200'))
+AUDIT_FULL_TIMEOUT = int(os.getenv('AUDIT_FULL_TIMEOUT', '5'))
+# Monthly audit log partitions (see queues/partitions.py): how many future
+# months to create ahead, how many past months to keep besides the current
+# one, and where archive_audit_logs writes the months it retires
+AUDIT_PARTITIONS_AHEAD = int(os.getenv('AUDIT_PARTITIONS_AHEAD', '3'))
+AUDIT_RETENTION_MONTHS = int(os.getenv('AUDIT_RETENTION_MONTHS', '12'))
+AUDIT_ARCHIVE_DIR = os.getenv('AUDIT_ARCHIVE_DIR', str(BASE_DIR / 'audit-archive'))
+
+# Queue broadcasts of a service point are coalesced (see queues/coalesce.py):
+# a burst of changes is sent as one update once QUEUE_UPDATE_WINDOW
+# milliseconds pass without a change, and at most QUEUE_UPDATE_MAX_DELAY
+# milliseconds after its first change. 0 broadcasts every change at once,
+# the default under tests, where no worker runs the delayed flush, and
+# without CACHE_URL: the window lives in the cache, and a flush task run by
+# another process would not find a per-process one.
+QUEUE_UPDATE_WINDOW = int(os.getenv(
+    'QUEUE_UPDATE_WINDOW', '150' if os.getenv('CACHE_URL') and not RUNNING_TESTS else '0'
+))
+QUEUE_UPDATE_MAX_DELAY = int(os.getenv('QUEUE_UPDATE_MAX_DELAY', '500'))
+
+# Public display screens (see queues/display.py): tickets shown per list and
+# how many deltas are kept for screens resuming after a reconnect
+DISPLAY_NEXT_COUNT = int(os.getenv('DISPLAY_NEXT_COUNT', '10'))
+DISPLAY_DELTA_HISTORY = int(os.getenv('DISPLAY_DELTA_HISTORY', '100'))
+
+# Ticket numbers a process claims at once per service point and day (see
+# queues/tickets.py). Larger blocks mean fewer writes to the shared counter
+# row. Parallel workers then issue numbers out of order; the queue order does
+# not depend on them.
+TICKET_BLOCK_SIZE = int(os.getenv('TICKET_BLOCK_SIZE', '20'))
+
+# Rows deleted per transaction when closed service points are removed
+CLOSURE_CHUNK_SIZE = int(os.getenv('CLOSURE_CHUNK_SIZE', '500'))
+
 # Email configuration
 EMAIL_BACKEND = "anymail.backends.mailgun.EmailBackend"
 ANYMAIL = {
@@ -189,6 +326,15 @@ ANYMAIL = {
 }
 DEFAULT_FROM_EMAIL = os.getenv("DEFAULT_FROM_EMAIL", "noreply@queueflow.com")
 
+# Email dispatch worker (see queues/mailer.py)
+EMAIL_DISPATCH_BATCH_SIZE = int(os.getenv('EMAIL_DISPATCH_BATCH_SIZE', '100'))
+EMAIL_MAX_ATTEMPTS = int(os.getenv('EMAIL_MAX_ATTEMPTS', '5'))
+EMAIL_RETRY_BACKOFF = int(os.getenv('EMAIL_RETRY_BACKOFF', '30'))  # seconds, doubled per attempt
+# Messages per second allowed per email backend
+EMAIL_RATE_LIMITS = {
+    'anymail.backends.mailgun.EmailBackend': int(os.getenv('MAILGUN_RATE_LIMIT', '50')),
+}
+
 # Logging configuration
 LOGGING = {
     'version': 1,
@@ -0,0 +1,209 @@
+"""
+Asynchronous, batched audit logging.
+
+Requests only put a small tuple on a bounded in-process buffer, which costs a
+few microseconds. A background thread turns the buffered events into
+``AuditLog`` rows with ``bulk_create`` every ``AUDIT_BATCH_SIZE`` events or
+``AUDIT_FLUSH_INTERVAL`` milliseconds, whichever comes first.
+
+When the buffer is full the request waits up to ``AUDIT_FULL_TIMEOUT``
+milliseconds for the writer to catch up (backpressure), then drops the event
+and counts it in ``AuditBuffer.dropped`` rather than holding the request any
+longer.
+
+A batch the database refuses is retried once on a fresh connection (or after
+creating a missing month partition), then written row by row so that only
+the rows that fail, counted in ``AuditBuffer.failed``, are lost.
+"""
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections, connection, transaction
+from django.utils import timezone
+
+from .models import AuditLog
+from .partitions import ensure_partitions
+
+logger = logging.getLogger(__name__)
+
+# HTTP methods to AuditLog actions
+METHOD_ACTIONS = {
+    'GET': 'view',
+    'HEAD': 'view',
+    'POST': 'create',
+    'PUT': 'update',
+    'PATCH': 'update',
+    'DELETE': 'delete',
+}
+
+
+class AuditBuffer:
+    """
+    Bounded buffer of audit events, drained into the database by a daemon
+    thread. Without ``background``, a full batch is written inline by the
+    request that completes it.
+    """
+
+    def __init__(self, capacity, batch_size, interval, full_timeout, background=True):
+        self.capacity = capacity
+        self.batch_size = batch_size
+        self.interval = interval / 1000
+        self.full_timeout = full_timeout / 1000
+        self.background = background
+        self.dropped = 0
+        self.failed = 0
+        self._start_lock = threading.Lock()
+        self._pid = None
+        self._queue = queue.Queue(maxsize=capacity)
+
+    def record(self, user_id, action, resource_type, resource_id='', description='', ip_address=None,
+               user_agent='', session_id=''):
+        """
+        Buffer one event. Never raises; events that do not fit are dropped.
+        """
+        if self.background and self._pid != os.getpid():
+            self._start()
+        event = (
+            user_id, action, resource_type, resource_id, description, ip_address, user_agent,
+            session_id, timezone.now()
+        )
+        if not self.background and self._queue.qsize() >= self.batch_size:
+            self.flush()
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            try:
+                self._queue.put(event, timeout=self.full_timeout)
+            except queue.Full:
+                self.dropped += 1
+
+    def flush(self):
+        """
+        Write every buffered event now, in the calling thread, and return
+        how many were written.
+        """
+        events = []
+        while True:
+            try:
+                events.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        for start in range(0, len(events), self.batch_size):
+            self._write(events[start:start + self.batch_size])
+        return len(events)
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def _start(self):
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            if self._pid is not None:
+                # Forked: the parent's writer thread did not come along
+                self._queue = queue.Queue(maxsize=self.capacity)
+            self._pid = os.getpid()
+            threading.Thread(target=self._run, name='audit-log-writer', daemon=True).start()
+            atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._write(batch)
+            # This thread lives as long as the process: drop a connection
+            # that broke or outlived CONN_MAX_AGE before the next batch
+            close_old_connections()
+
+    def _insert(self, events):
+        # A savepoint, so a refused batch written inline leaves the
+        # request's transaction usable
+        with transaction.atomic():
+            AuditLog.objects.bulk_create([
+                AuditLog(
+                    user_id=user_id, action=action, resource_type=resource_type, resource_id=resource_id,
+                    description=description, ip_address=ip_address, user_agent=user_agent,
+                    session_id=session_id, timestamp=timestamp
+                )
+                for (user_id, action, resource_type, resource_id, description, ip_address, user_agent,
+                     session_id, timestamp) in events
+            ])
+
+    def _recover(self):
+        """
+        Repair what most likely made a batch fail and return whether it is
+        worth trying again.
+        """
+        if not connection.in_atomic_block and not connection.is_usable():
+            connection.close()
+            return True
+        # No partition for this month yet when the daily task has not run
+        return bool(ensure_partitions())
+
+    def _write(self, events, retry=True):
+        try:
+            self._insert(events)
+        except DatabaseError as e:
+            if retry and self._recover():
+                self._write(events, retry=False)
+                return
+            logger.warning('Audit batch of %s entries failed, writing them one by one: %s', len(events), e)
+            self._write_rows(events)
+        except Exception:
+            # Auditing must never take the writer thread down
+            self.failed += len(events)
+            logger.exception('Could not write %s audit log entries', len(events))
+
+    def _write_rows(self, events):
+        # One bad row, say of a user deleted meanwhile, must not cost the rest
+        for event in events:
+            try:
+                self._insert([event])
+            except DatabaseError as e:
+                self.failed += 1
+                logger.warning('Dropped audit log entry %s: %s', event[1:4], e)
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_audit_buffer():
+    """
+    Return this process's audit buffer, configured from settings.
+    """
+    global _buffer
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                _buffer = AuditBuffer(
+                    capacity=settings.AUDIT_BUFFER_SIZE,
+                    batch_size=settings.AUDIT_BATCH_SIZE,
+                    interval=settings.AUDIT_FLUSH_INTERVAL,
+                    full_timeout=settings.AUDIT_FULL_TIMEOUT,
+                    background=settings.AUDIT_BACKGROUND_WRITER,
+                )
+    return _buffer
+
+
+def reset_audit_buffer():
+    """
+    Drop the current buffer (and its pending events) so the next use picks
+    up changed settings. Used by tests.
+    """
+    global _buffer
+    with _buffer_lock:
+        _buffer = None
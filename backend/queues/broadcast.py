@@ -0,0 +1,57 @@
+"""
+Queue update messages broadcast to the ``queue_<id>`` channel group.
+
+One message per change carries the whole queue order; every ``QueueConsumer``
+in the group picks its own user's position out of it. The order is encoded
+once as a JSON string so the channel layer copies a single string per
+subscriber instead of a nested list.
+"""
+import json
+
+from django.core.cache import cache
+
+
+def next_queue_version(service_point_id):
+    """
+    Return an increasing version number for the queue of a service point.
+    """
+    key = f'queue_version_{service_point_id}'
+    cache.add(key, 0, timeout=None)
+    return cache.incr(key)
+
+
+def queue_update_message(service_point_id, ordered_entries, version):
+    """
+    Build the group message for a queue whose active entries, in position
+    order, are given as ``(entry_id, user_id, eta_seconds)`` triples.
+    """
+    return {
+        'type': 'queue_update',
+        'data': {
+            'service_point_id': service_point_id,
+            'version': version,
+            'queue_length': len(ordered_entries),
+            'queue': json.dumps([list(entry) for entry in ordered_entries], separators=(',', ':')),
+        }
+    }
+
+
+def personalise_queue_update(data, user_id=None):
+    """
+    Reduce a broadcast queue update to what one subscriber needs: the queue
+    length, plus its own position and ETA when ``user_id`` is waiting in the
+    queue.
+    """
+    update = {
+        'service_point_id': data['service_point_id'],
+        'version': data['version'],
+        'queue_length': data['queue_length'],
+    }
+    if user_id is not None:
+        for index, (entry_id, entry_user_id, eta_seconds) in enumerate(json.loads(data['queue'])):
+            if entry_user_id == user_id:
+                update['queue_entry_id'] = entry_id
+                update['position'] = index + 1
+                update['eta_seconds'] = eta_seconds
+                break
+    return update
@@ -0,0 +1,65 @@
+"""
+Versioned cache of the public service point listing.
+
+The rendered JSON body is stored under a key that includes a listing
+version. Any change to a service point, its service types or its queue
+counters bumps the version, so stale bodies are never read again and simply
+expire. Each cached body carries an ``ETag`` and ``Last-Modified`` value so
+repeat visitors can be answered with ``304 Not Modified``.
+"""
+import hashlib
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+
+VERSION_KEY = 'public_service_points_version'
+CHANGED_AT_KEY = 'public_service_points_changed_at'
+BODY_TIMEOUT = 60 * 60
+
+
+def listing_version():
+    """
+    Return the current version of the public listing.
+    """
+    cache.add(VERSION_KEY, 1, timeout=None)
+    return cache.get(VERSION_KEY) or 1
+
+
+def _bump():
+    cache.add(VERSION_KEY, 1, timeout=None)
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        # Evicted between add() and incr()
+        cache.add(VERSION_KEY, 1, timeout=None)
+    cache.set(CHANGED_AT_KEY, time.time(), timeout=None)
+
+
+def invalidate_public_listing():
+    """
+    Mark the cached listing as stale.
+
+    The version is bumped straight away and again once the transaction
+    commits, so a request that rebuilt the listing before the commit cannot
+    leave pre-commit data cached under the current version.
+    """
+    _bump()
+    transaction.on_commit(_bump)
+
+
+def public_listing(build):
+    """
+    Return ``(body, etag, last_modified)`` for the current listing version,
+    rendering ``build()`` to JSON on a cache miss.
+    """
+    key = f'public_service_points:{listing_version()}'
+    entry = cache.get(key)
+    if entry is None:
+        body = JSONRenderer().render(build())
+        etag = '"%s"' % hashlib.md5(body).hexdigest()
+        last_modified = cache.get(CHANGED_AT_KEY) or time.time()
+        entry = (body, etag, last_modified)
+        cache.set(key, entry, timeout=BODY_TIMEOUT)
+    return entry
@@ -0,0 +1,138 @@
+"""
+Bulk closure of service points.
+
+Closing happens in the request, in one transaction and a fixed number of
+statements whatever the queue length. The service points are deactivated,
+their active entries abandoned with a single ``UPDATE``, the customers
+notified with ``bulk_create``, and one batched email and socket message per
+service point are put on the outbox. Deleting the closed points, their queue
+history and rollups is left to ``run_closure_job``, which removes rows in small
+chunks with a short transaction each, so locks are never held for long.
+"""
+import logging
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from . import counters, rollups
+from .caching import invalidate_public_listing
+from .engine import get_queue_engine
+from .models import ClosureJob, DailySketch, HourlyRollup, Notification, QueueEntry, ServicePoint, TicketCounter, ACTIVE_STATUSES
+from .outbox import enqueue_display_update, enqueue_email_batch, enqueue_group_send, enqueue_notifications
+
+logger = logging.getLogger(__name__)
+
+EMAIL_BATCH_SIZE = 100
+
+
+def close_service_points(user, service_point_ids):
+    """
+    Close the given service points and return the ``ClosureJob`` that will
+    delete them in the background.
+    """
+    with transaction.atomic():
+        # Joins take no lock on their service point, but on PostgreSQL the
+        # foreign key of a new entry holds a share lock on it until the join
+        # commits. This lock waits for joins already inserting, whose entries
+        # are abandoned below; joins inserting meanwhile wait for the closure
+        # and then find the point closed (see join_queue). Databases without
+        # row locks rely on join_queue rechecking the point alone, so a join
+        # committing between that check and this closure keeps an entry in a
+        # closed point until the closure job deletes it.
+        service_points = list(
+            ServicePoint.objects.select_for_update().filter(pk__in=service_point_ids).only('id', 'name')
+        )
+        service_point_ids = [service_point.id for service_point in service_points]
+        ServicePoint.objects.filter(pk__in=service_point_ids).update(is_active=False)
+
+        active_entries = QueueEntry.objects.filter(service_point_id__in=service_point_ids, status__in=ACTIVE_STATUSES)
+        entries = list(active_entries.values_list('service_point_id', 'user_id', 'user__email'))
+        active_entries.update(status='abandoned')
+        counters.recount(service_point_ids)
+        closed_at = timezone.now()
+        abandoned = {}
+        for service_point_id, _, _ in entries:
+            abandoned[service_point_id] = abandoned.get(service_point_id, 0) + 1
+        for service_point_id, count in abandoned.items():
+            rollups.record(service_point_id, closed_at, abandoned=count)
+
+        engine = get_queue_engine()
+        names = {service_point.id: service_point.name for service_point in service_points}
+        notifications = []
+        emails = {}
+        for service_point_id, user_id, user_email in entries:
+            message = f'The service point {names[service_point_id]} has been closed. Your queue entry has been cancelled.'
+            notifications.append(Notification(user_id=user_id, message=message))
+            emails.setdefault(message, []).append(user_email)
+        Notification.objects.bulk_create(notifications, batch_size=500)
+        enqueue_notifications(notifications)
+        for message, user_emails in emails.items():
+            for start in range(0, len(user_emails), EMAIL_BATCH_SIZE):
+                enqueue_email_batch(user_emails[start:start + EMAIL_BATCH_SIZE], message)
+
+        for service_point_id in service_point_ids:
+            transaction.on_commit(lambda service_point_id=service_point_id: engine.reset(service_point_id))
+            enqueue_group_send(f'queue_{service_point_id}', {'type': 'queue_update', 'data': {'deleted': True}})
+            enqueue_display_update(service_point_id)
+        invalidate_public_listing()
+
+        job = ClosureJob.objects.create(
+            created_by=user,
+            service_point_ids=service_point_ids,
+            entries_closed=len(entries)
+        )
+        transaction.on_commit(lambda: _schedule(job.id))
+    return job
+
+
+def _schedule(job_id):
+    from .tasks import run_closure_job
+
+    try:
+        run_closure_job.delay(job_id)
+    except Exception as e:
+        # The job stays pending and can be run again later
+        logger.warning('Could not schedule closure job %s: %s', job_id, e)
+
+
+def run_job(job_id, chunk_size=None):
+    """
+    Delete the service points of a closure job with their queue entries,
+    analytics rollups, sketches and ticket counters, one chunk per
+    transaction, recording progress on the job as it goes.
+    """
+    chunk_size = chunk_size or settings.CLOSURE_CHUNK_SIZE
+    job = ClosureJob.objects.get(pk=job_id)
+    if job.status == 'completed':
+        return job
+
+    job.status = 'running'
+    job.started_at = timezone.now()
+    job.save(update_fields=['status', 'started_at'])
+
+    try:
+        for service_point_id in job.service_point_ids:
+            for model in (QueueEntry, HourlyRollup, DailySketch, TicketCounter):
+                rows = model.objects.filter(service_point_id=service_point_id)
+                while True:
+                    with transaction.atomic():
+                        chunk = list(rows.order_by('id').values_list('id', flat=True)[:chunk_size])
+                        if not chunk:
+                            break
+                        deleted, _ = model.objects.filter(pk__in=chunk).delete()
+                    job.rows_deleted += deleted
+                    job.save(update_fields=['rows_deleted'])
+
+            with transaction.atomic():
+                deleted, _ = ServicePoint.objects.filter(pk=service_point_id, is_active=False).delete()
+            job.rows_deleted += deleted
+            job.save(update_fields=['rows_deleted'])
+    except Exception as e:
+        job.status = 'failed'
+        job.error = str(e)
+    else:
+        job.status = 'completed'
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'error', 'finished_at'])
+    return job
@@ -0,0 +1,89 @@
+"""
+Coalescing of queue broadcasts for busy service points.
+
+Every join, call or leave asks for a queue update of its service point.
+Instead of broadcasting each one, the first request opens a window of
+``QUEUE_UPDATE_WINDOW`` milliseconds and schedules a flush. Requests that
+arrive while the window is open only push its end back, debouncing a burst,
+but never past ``QUEUE_UPDATE_MAX_DELAY`` milliseconds after the window
+opened. The flush then sends one broadcast, built from the queue as it is at
+that moment with a new version, so it covers every change of the burst.
+
+The window lives in the default cache. Only a shared cache (``CACHE_URL``)
+lets the worker that flushes see the window opened by another process, so
+``QUEUE_UPDATE_WINDOW`` defaults to 0, no coalescing, without one.
+"""
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+
+def _window_key(service_point_id):
+    return f'queue_update_window_{service_point_id}'
+
+
+def _last_key(service_point_id):
+    return f'queue_update_last_{service_point_id}'
+
+
+def _timeout():
+    # A window whose flush was lost (a dead worker) expires on its own
+    return int(settings.QUEUE_UPDATE_MAX_DELAY / 1000) + 5
+
+
+def note_update(service_point_id, now=None):
+    """
+    Record a change of the queue of a service point. Returns ``True`` when
+    this opened a new window, whose flush the caller has to schedule.
+    """
+    now = time.time() if now is None else now
+    cache.set(_last_key(service_point_id), now, timeout=_timeout())
+    return cache.add(_window_key(service_point_id), now, timeout=_timeout())
+
+
+def due_in(service_point_id, now=None):
+    """
+    Return the seconds until the open window of a service point should be
+    flushed (zero or less when due), or ``None`` without an open window.
+    """
+    now = time.time() if now is None else now
+    values = cache.get_many([_window_key(service_point_id), _last_key(service_point_id)])
+    opened = values.get(_window_key(service_point_id))
+    if opened is None:
+        return None
+    last = max(values.get(_last_key(service_point_id)) or opened, opened)
+    due = min(last + settings.QUEUE_UPDATE_WINDOW / 1000, opened + settings.QUEUE_UPDATE_MAX_DELAY / 1000)
+    return due - now
+
+
+def close(service_point_id):
+    """
+    Close the window of a service point. Changes noted after this open a new
+    one, so the broadcast sent next must read the queue afterwards.
+    """
+    cache.delete(_window_key(service_point_id))
+
+
+def request_queue_update(service_point_id):
+    """
+    Broadcast the queue of a service point, coalesced with the other changes
+    of the current window.
+    """
+    from .tasks import flush_queue_update, send_queue_update
+
+    if settings.QUEUE_UPDATE_WINDOW <= 0 or settings.CELERY_TASK_ALWAYS_EAGER:
+        send_queue_update(service_point_id)
+        return
+    if not note_update(service_point_id):
+        return
+    try:
+        flush_queue_update.apply_async((service_point_id,), countdown=settings.QUEUE_UPDATE_WINDOW / 1000)
+    except Exception as e:
+        # Without a worker to flush later, broadcast now
+        logger.warning('Could not schedule queue update: %s', e)
+        close(service_point_id)
+        send_queue_update(service_point_id)
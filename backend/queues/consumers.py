@@ -1,7 +1,12 @@
 import json
+from urllib.parse import parse_qs
+from asgiref.sync import sync_to_async
+from channels.generic.http import AsyncHttpConsumer
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
-from django.core.cache import cache
+from .broadcast import personalise_queue_update
+from .display import catch_up, display_group
+from .presence import get_presence
 from .serializers import QueueEntrySerializer, ServicePointSerializer
 from .models import QueueEntry, ServicePoint
 
@@ -10,12 +15,20 @@ class QueueConsumer(AsyncWebsocketConsumer):
     async def connect(self):
         self.service_point_id = self.scope['url_route']['kwargs']['service_point_id']
         self.service_point_group_name = f'queue_{self.service_point_id}'
+        self.user = self.scope.get('user')
+        if self.user is not None and not self.user.is_authenticated:
+            self.user = None
 
         # Join room group
         await self.channel_layer.group_add(
             self.service_point_group_name,
             self.channel_name
         )
+        if self.user is not None:
+            # Notifications for this user, whichever queue the socket watches
+            self.user_group_name = f'user_{self.user.id}'
+            await self.channel_layer.group_add(self.user_group_name, self.channel_name)
+            await self.heartbeat()
         await self.accept()
 
     async def disconnect(self, close_code):
@@ -24,14 +37,21 @@ class QueueConsumer(AsyncWebsocketConsumer):
             self.service_point_group_name,
             self.channel_name
         )
+        if self.user is not None:
+            await self.channel_layer.group_discard(self.user_group_name, self.channel_name)
+            await sync_to_async(get_presence().leave)(self.service_point_id, self.user.id, self.channel_name)
 
-        # Remove channel name from cache
-        if hasattr(self, 'user') and self.user.is_authenticated:
-            cache_key = f'queue_channel_{self.service_point_id}_{self.user.id}'
-            cache.delete(cache_key)
+    async def heartbeat(self):
+        if self.user is not None:
+            await sync_to_async(get_presence().touch)(self.service_point_id, self.user.id, self.channel_name)
 
     async def receive(self, text_data):
         text_data_json = json.loads(text_data)
+        if text_data_json.get('type') == 'heartbeat':
+            # Clients send one every PRESENCE_TTL / 2 seconds to stay listed
+            await self.heartbeat()
+            await self.send(text_data=json.dumps({'type': 'heartbeat'}))
+            return
         message = text_data_json['message']
 
         # Send message to room group
@@ -52,9 +72,96 @@ class QueueConsumer(AsyncWebsocketConsumer):
         }))
 
     async def queue_update(self, event):
-        # Broadcast queue updates
-        await self.send(text_data=json.dumps(event))
+        # Queue order broadcasts are cut down to this subscriber's position
+        data = event['data']
+        if 'queue' in data:
+            user_id = self.user.id if self.user is not None and self.user.is_authenticated else None
+            data = personalise_queue_update(data, user_id)
+        await self.send(text_data=json.dumps({'type': 'queue_update', 'data': data}))
 
     async def notification(self, event):
-        # Broadcast notification to all connected clients in the group
-        await self.send(text_data=json.dumps(event['data']))
+        # A new Notification row of this user, sent to its user_<id> group
+        await self.send(text_data=json.dumps({'type': 'notification', 'data': event['data']}))
+
+
+def _display_version(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class DisplayConsumer(AsyncWebsocketConsumer):
+    """
+    Read-only display feed of a service point for public screens; no login.
+    Screens pass ``?version=N`` when reconnecting to be sent only what they
+    missed.
+    """
+
+    async def connect(self):
+        self.service_point_id = int(self.scope['url_route']['kwargs']['service_point_id'])
+        self.group_name = display_group(self.service_point_id)
+        query = parse_qs(self.scope.get('query_string', b'').decode())
+        version = _display_version(query.get('version', [None])[0])
+
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
+        await self.accept()
+        _, messages = await database_sync_to_async(catch_up)(self.service_point_id, version)
+        for _, text in messages:
+            await self.send(text_data=text)
+
+    async def disconnect(self, close_code):
+        await self.channel_layer.group_discard(self.group_name, self.channel_name)
+
+    async def receive(self, text_data=None, bytes_data=None):
+        # Screens only listen
+        pass
+
+    async def display_message(self, event):
+        # Serialized once by queues.display.publish for every screen
+        await self.send(text_data=event['text'])
+
+
+class DisplayEventsConsumer(AsyncHttpConsumer):
+    """
+    The display feed as Server-Sent Events, for screens without WebSockets.
+    Browsers resume from the ``Last-Event-ID`` header on reconnect.
+    """
+
+    async def http_request(self, message):
+        # Unlike the base class, the response stays open after handle() so
+        # the group keeps delivering display_message events; the stream ends
+        # on http.disconnect
+        if 'body' in message:
+            self.body.append(message['body'])
+        if not message.get('more_body'):
+            await self.handle(b''.join(self.body))
+
+    async def handle(self, body):
+        self.service_point_id = int(self.scope['url_route']['kwargs']['service_point_id'])
+        self.group_name = display_group(self.service_point_id)
+        headers = dict(self.scope.get('headers', []))
+        query = parse_qs(self.scope.get('query_string', b'').decode())
+        version = _display_version(
+            headers.get(b'last-event-id', b'').decode() or query.get('version', [None])[0]
+        )
+
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
+        await self.send_headers(headers=[
+            (b'Content-Type', b'text/event-stream'),
+            (b'Cache-Control', b'no-cache'),
+            (b'X-Accel-Buffering', b'no'),
+        ])
+        _, messages = await database_sync_to_async(catch_up)(self.service_point_id, version)
+        body = ''.join(self._event(message_version, text) for message_version, text in messages)
+        await self.send_body(body.encode(), more_body=True)
+
+    @staticmethod
+    def _event(version, text):
+        return f'id: {version}\ndata: {text}\n\n'
+
+    async def display_message(self, event):
+        await self.send_body(self._event(event['version'], event['text']).encode(), more_body=True)
+
+    async def disconnect(self):
+        await self.channel_layer.group_discard(self.group_name, self.channel_name)
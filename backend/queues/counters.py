@@ -0,0 +1,92 @@
+"""
+Denormalised live queue counters on ``ServicePoint``.
+
+``active_count``, ``waiting_count`` and ``called_count`` are moved with
+``F()`` expressions once the ``QueueEntry`` change commits, so listings can
+show queue lengths without counting entries. Each move is a single statement
+of its own: a join or call holds no lock on the service point row for the
+rest of its transaction. ``recount`` is the repair path when rows were
+changed behind the engine's back or a move was lost with its process.
+"""
+from django.db import transaction
+from django.db.models import Count, F, Q
+from django.db.models.functions import Greatest
+
+from .caching import invalidate_public_listing
+from .models import ServicePoint, QueueEntry, ACTIVE_STATUSES, WAITING_STATUSES
+
+
+def status_deltas(status):
+    """
+    Return the ``(waiting, called)`` contribution of an entry in ``status``.
+    """
+    if status in WAITING_STATUSES:
+        return 1, 0
+    if status == 'called':
+        return 0, 1
+    return 0, 0
+
+
+def adjust(service_point_id, waiting=0, called=0):
+    """
+    Atomically move the counters of a service point by the given deltas once
+    the current transaction commits.
+    """
+    if not waiting and not called:
+        return
+    transaction.on_commit(lambda: _apply(service_point_id, waiting, called))
+
+
+def _apply(service_point_id, waiting, called):
+    # Clamped at zero: rows written behind the engine's back (admin, fixtures)
+    # must not make a later transition fail; repair_queue_counters fixes drift
+    ServicePoint.objects.filter(pk=service_point_id).update(
+        active_count=Greatest(F('active_count') + waiting + called, 0),
+        waiting_count=Greatest(F('waiting_count') + waiting, 0),
+        called_count=Greatest(F('called_count') + called, 0),
+    )
+    # Queue lengths are part of the public listing
+    invalidate_public_listing()
+
+
+def transition(service_point_id, old_status, new_status):
+    """
+    Update the counters for one entry moving from ``old_status`` to ``new_status``.
+    """
+    old_waiting, old_called = status_deltas(old_status)
+    new_waiting, new_called = status_deltas(new_status)
+    adjust(service_point_id, new_waiting - old_waiting, new_called - old_called)
+
+
+def recount(service_point_ids=None):
+    """
+    Recompute the counters from ``QueueEntry`` and return the service points
+    whose stored values were wrong.
+    """
+    service_points = ServicePoint.objects.all()
+    if service_point_ids is not None:
+        service_points = service_points.filter(pk__in=service_point_ids)
+
+    actual = {
+        row['service_point_id']: row
+        for row in QueueEntry.objects.filter(
+            service_point__in=service_points,
+            status__in=ACTIVE_STATUSES
+        ).values('service_point_id').annotate(
+            waiting=Count('id', filter=Q(status__in=WAITING_STATUSES)),
+            called=Count('id', filter=Q(status='called')),
+        ).order_by()
+    }
+
+    fixed = []
+    for service_point in service_points.only('id', 'name', 'active_count', 'waiting_count', 'called_count'):
+        row = actual.get(service_point.id, {'waiting': 0, 'called': 0})
+        counts = (row['waiting'] + row['called'], row['waiting'], row['called'])
+        if counts != (service_point.active_count, service_point.waiting_count, service_point.called_count):
+            service_point.active_count, service_point.waiting_count, service_point.called_count = counts
+            fixed.append(service_point)
+
+    ServicePoint.objects.bulk_update(fixed, ['active_count', 'waiting_count', 'called_count'], batch_size=500)
+    if fixed:
+        invalidate_public_listing()
+    return fixed
@@ -0,0 +1,143 @@
+"""
+Snapshot and delta feed for public display screens.
+
+A screen shows, per service point, the tickets now being served (with their
+counter), the next ``DISPLAY_NEXT_COUNT`` tickets and the active
+announcements. ``publish`` rebuilds that state after each (coalesced) queue
+broadcast or announcement change and, when it differs from the last one,
+stores it with a new version and a delta holding only the parts that
+changed. Both are serialized to JSON once and stored in a ``DisplayState``
+row, which the ASGI servers and the Celery workers publishing updates all
+read; every screen connected to the ``display_<id>`` group is sent the same
+string, so no connection serializes anything itself.
+
+Screens reconnect with the last version they applied and are sent the
+deltas after it, as long as the last ``DISPLAY_DELTA_HISTORY`` deltas still
+cover it, or a fresh snapshot otherwise. A delta whose ``base`` is not the
+screen's version means it missed something and should reconnect.
+"""
+import json
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Announcement, DisplayState, QueueEntry, ServicePoint, WAITING_STATUSES
+
+
+def display_group(service_point_id):
+    return f'display_{service_point_id}'
+
+
+def build(service_point_id):
+    """
+    Return the current display state of a service point as plain data.
+    """
+    service_point = ServicePoint.objects.filter(id=service_point_id).values('name', 'is_active', 'is_paused').first()
+    if service_point is None:
+        return {'closed': True}
+    entries = QueueEntry.objects.filter(service_point_id=service_point_id).order_by()
+    serving = entries.filter(status='called').order_by('-called_at', '-id').values_list('ticket_number', 'counter')
+    waiting = entries.filter(status__in=WAITING_STATUSES).order_by('sequence').values_list('ticket_number', flat=True)
+    announcements = Announcement.objects.filter(
+        Q(expires_at__isnull=True) | Q(expires_at__gt=timezone.now()),
+        service_point_id=service_point_id,
+        is_active=True
+    ).order_by('-created_at').values_list('id', 'title', 'message', 'priority')
+    return {
+        'name': service_point['name'],
+        'closed': not service_point['is_active'],
+        'paused': service_point['is_paused'],
+        'serving': [[ticket, counter] for ticket, counter in serving[:settings.DISPLAY_NEXT_COUNT]],
+        'next': list(waiting[:settings.DISPLAY_NEXT_COUNT]),
+        'announcements': [list(announcement) for announcement in announcements],
+    }
+
+
+def _encode(message):
+    return json.dumps(message, separators=(',', ':'))
+
+
+def _stored(service_point_id):
+    row = DisplayState.objects.filter(service_point_id=service_point_id).first()
+    if row is None:
+        return None
+    return {
+        'version': row.version, 'data': row.data, 'snapshot': row.snapshot,
+        'deltas': [tuple(delta) for delta in row.deltas],
+    }
+
+
+def publish(service_point_id, send=True):
+    """
+    Store the current display state of a service point if it changed and
+    send it to the connected screens: as a delta, or as a snapshot when
+    there was no previous state. Returns the stored state.
+    """
+    while True:
+        state = _stored(service_point_id)
+        data = build(service_point_id)
+        if state is not None and state['data'] == data:
+            return state
+
+        version = state['version'] + 1 if state is not None else 1
+        snapshot = _encode({'type': 'snapshot', 'service_point_id': service_point_id, 'version': version, 'data': data})
+        if state is None:
+            deltas = []
+            message = snapshot
+        else:
+            changes = {key: value for key, value in data.items() if state['data'].get(key) != value}
+            message = _encode({
+                'type': 'delta', 'service_point_id': service_point_id, 'version': version,
+                'base': state['version'], 'changes': changes,
+            })
+            deltas = (state['deltas'] + [(version, message)])[-settings.DISPLAY_DELTA_HISTORY:]
+        fields = {'version': version, 'data': data, 'snapshot': snapshot, 'deltas': deltas}
+
+        # Publishers of one service point take turns through the version:
+        # of those that read the same one, only the first writes the next,
+        # and the others start over from its state
+        if state is not None:
+            stored = DisplayState.objects.filter(
+                service_point_id=service_point_id, version=state['version']
+            ).update(**fields)
+        elif 'name' in data:
+            try:
+                with transaction.atomic():
+                    DisplayState.objects.create(service_point_id=service_point_id, **fields)
+                stored = True
+            except IntegrityError:
+                stored = False
+        else:
+            # The service point is gone; there is nothing to store
+            stored = True
+        if stored:
+            break
+
+    if send:
+        async_to_sync(get_channel_layer().group_send)(
+            display_group(service_point_id),
+            {'type': 'display_message', 'version': version, 'text': message}
+        )
+    return fields
+
+
+def catch_up(service_point_id, version=None):
+    """
+    Return ``(version, messages)``: the current version of a service point's
+    display and the ``(version, text)`` messages that bring a screen at
+    ``version`` up to it.
+    """
+    state = _stored(service_point_id)
+    if state is None:
+        state = publish(service_point_id, send=False)
+    if version == state['version']:
+        return state['version'], []
+    if version is not None and version < state['version']:
+        missed = [(delta_version, text) for delta_version, text in state['deltas'] if delta_version > version]
+        if len(missed) == state['version'] - version:
+            return state['version'], missed
+    return state['version'], [(state['version'], state['snapshot'])]
@@ -0,0 +1,41 @@
+"""
+Pluggable live queue engines.
+
+The engine used by the views is selected with the ``QUEUE_ENGINE`` setting:
+
+- ``queues.engine.orm.ORMQueueEngine`` (default) works directly on the
+  database, one query per step.
+- ``queues.engine.memory.InMemoryQueueEngine`` keeps queues in the current
+  process; handy for tests and single worker setups.
+- ``queues.engine.redis.RedisQueueEngine`` keeps queues in Redis sorted sets
+  and mutates them with Lua scripts.
+"""
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+from ..models import ACTIVE_STATUSES, WAITING_STATUSES
+from .base import QueueEngine
+
+_engine = None
+
+
+def get_queue_engine():
+    """
+    Return the process-wide engine instance configured by ``QUEUE_ENGINE``.
+    """
+    global _engine
+    if _engine is None:
+        _engine = import_string(settings.QUEUE_ENGINE)()
+    return _engine
+
+
+@receiver(setting_changed)
+def _reset_queue_engine(setting, **kwargs):
+    global _engine
+    if setting.startswith('QUEUE_ENGINE'):
+        _engine = None
+
+
+__all__ = ('QueueEngine', 'ACTIVE_STATUSES', 'WAITING_STATUSES', 'get_queue_engine')
@@ -0,0 +1,114 @@
+from django.utils import timezone
+
+from .. import counters, estimator, rollups
+from ..models import QueueEntry, WAITING_STATUSES
+
+
+class QueueEngine:
+    """
+    Base class for live queue engines.
+
+    An engine owns the ordering of the people waiting at each service point
+    and performs the join / call / serve / abandon transitions. Subclasses
+    implement the ordering structure; the row-level persistence of each
+    transition is shared here so every backend leaves ``QueueEntry`` in the
+    same state.
+
+    Transitions run inside the caller's transaction. State an engine keeps
+    outside the database must not keep the changes of a transaction that
+    rolls back.
+    """
+
+    def join(self, service_point, user, **fields):
+        """
+        Add ``user`` to the queue of ``service_point`` and return the new
+        ``QueueEntry`` with its live ``position`` set.
+        """
+        raise NotImplementedError
+
+    def call_next(self, service_point_ids, counter=''):
+        """
+        Atomically take the next waiting entry from any of the given service
+        points, mark it as called to ``counter`` and return it (or ``None``
+        if nobody waits). Concurrent callers never get the same entry.
+        """
+        raise NotImplementedError
+
+    def serve(self, queue_entry):
+        """
+        Mark a called entry as served.
+        """
+        raise NotImplementedError
+
+    def abandon(self, queue_entry):
+        """
+        Remove an active entry from its queue and mark it as abandoned.
+        """
+        raise NotImplementedError
+
+    def position(self, queue_entry):
+        """
+        Return the live position of an active entry.
+        """
+        raise NotImplementedError
+
+    def positions(self, service_point_id):
+        """
+        Return a ``{entry_id: position}`` mapping for every active entry of a
+        service point.
+        """
+        raise NotImplementedError
+
+    def reset(self, service_point_id=None):
+        """
+        Drop cached state so that it is rebuilt from the database on next use.
+        """
+
+    # Shared persistence of transitions. Each one also moves the service
+    # point's live counters and hourly analytics rollups, guarded on the previous status so that a
+    # transition raced by another worker is only counted once.
+
+    def _create_entry(self, service_point, user, **fields):
+        queue_entry = QueueEntry.objects.create(
+            service_point=service_point,
+            user=user,
+            **fields
+        )
+        counters.transition(queue_entry.service_point_id, None, queue_entry.status)
+        rollups.record(queue_entry.service_point_id, queue_entry.joined_at, joins=1)
+        return queue_entry
+
+    def _mark_called(self, entry_id, counter=''):
+        # Returns None when another caller got to the entry first
+        called_at = timezone.now()
+        updated = QueueEntry.objects.filter(pk=entry_id, status__in=WAITING_STATUSES).update(
+            status='called',
+            called_at=called_at,
+            counter=counter
+        )
+        if not updated:
+            return None
+        queue_entry = QueueEntry.objects.select_related('service_point', 'user').get(pk=entry_id)
+        counters.adjust(queue_entry.service_point_id, waiting=-1, called=1)
+        return queue_entry
+
+    def _mark_served(self, queue_entry):
+        previous = queue_entry.status
+        queue_entry.status = 'served'
+        queue_entry.served_at = timezone.now()
+        updated = QueueEntry.objects.filter(pk=queue_entry.pk, status=previous).update(
+            status=queue_entry.status,
+            served_at=queue_entry.served_at
+        )
+        if updated:
+            counters.transition(queue_entry.service_point_id, previous, queue_entry.status)
+            estimator.record_service(queue_entry)
+            rollups.record_served(queue_entry)
+
+    def _mark_abandoned(self, queue_entry):
+        previous = queue_entry.status
+        queue_entry.status = 'abandoned'
+        updated = QueueEntry.objects.filter(pk=queue_entry.pk, status=previous).update(status=queue_entry.status)
+        if updated:
+            counters.transition(queue_entry.service_point_id, previous, queue_entry.status)
+            rollups.record(queue_entry.service_point_id, timezone.now(), abandoned=1)
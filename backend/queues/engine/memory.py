@@ -0,0 +1,180 @@
+import threading
+import time
+from bisect import bisect_left
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max
+
+from ..models import QueueEntry, ACTIVE_STATUSES, WAITING_STATUSES
+from .base import QueueEngine
+
+
+class _Line:
+    """
+    Live state of one service point: entries are kept as sorted
+    ``(sequence, id)`` keys.
+    """
+
+    def __init__(self, last_sequence=0):
+        self.last_sequence = last_sequence
+        self.active = []   # keys of joined, waiting and called entries
+        self.waiting = []  # keys of entries that have not been called
+        self.claimed = {}  # key -> deadline of entries taken by uncommitted calls
+
+    @staticmethod
+    def _discard(keys, key):
+        index = bisect_left(keys, key)
+        if index < len(keys) and keys[index] == key:
+            del keys[index]
+            return True
+        return False
+
+    @staticmethod
+    def _insert(keys, key):
+        index = bisect_left(keys, key)
+        if index == len(keys) or keys[index] != key:
+            keys.insert(index, key)
+
+    def add(self, key):
+        # The line may have been rebuilt with the key since it was committed
+        self._insert(self.active, key)
+        self._insert(self.waiting, key)
+
+    def remove(self, key):
+        self.claimed.pop(key, None)
+        self._discard(self.waiting, key)
+        return self._discard(self.active, key)
+
+    def claim(self, deadline):
+        """
+        Take the head of the waiting list until ``deadline`` and return it.
+        """
+        key = self.waiting.pop(0)
+        self.claimed[key] = deadline
+        return key
+
+    def requeue_expired(self, now):
+        # Calls that never committed give their entries back
+        for key, deadline in list(self.claimed.items()):
+            if deadline <= now:
+                del self.claimed[key]
+                if self.rank(key) is not None:
+                    self._insert(self.waiting, key)
+
+    def rank(self, key):
+        index = bisect_left(self.active, key)
+        if index < len(self.active) and self.active[index] == key:
+            return index + 1
+        return None
+
+
+class InMemoryQueueEngine(QueueEngine):
+    """
+    Pure-Python engine keeping each queue in sorted lists inside the current
+    process, so joins, calls and position lookups are ``O(log n)``
+    bisections instead of database scans.
+
+    The state is per process, so this backend is meant for tests and single
+    worker deployments; use the Redis engine when running several workers.
+
+    Joins and departures change the lists once their transaction commits. A
+    call takes its entry off the waiting list at once, so concurrent callers
+    never get the same one, and gives it back if the call has not committed
+    within ``QUEUE_ENGINE_CLAIM_TIMEOUT`` seconds.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._lines = {}
+
+    def _line(self, service_point_id):
+        line = self._lines.get(service_point_id)
+        if line is None:
+            entries = QueueEntry.objects.filter(service_point_id=service_point_id)
+            line = _Line(entries.aggregate(last=Max('sequence'))['last'] or 0)
+            active = entries.filter(status__in=ACTIVE_STATUSES).values_list('sequence', 'id', 'status')
+            for sequence, entry_id, status in active:
+                line.active.append((sequence, entry_id))
+                if status in WAITING_STATUSES:
+                    line.waiting.append((sequence, entry_id))
+            line.active.sort()
+            line.waiting.sort()
+            self._lines[service_point_id] = line
+        return line
+
+    def join(self, service_point, user, **fields):
+        with self._lock:
+            line = self._line(service_point.id)
+            line.last_sequence += 1
+            queue_entry = self._create_entry(service_point, user, sequence=line.last_sequence, **fields)
+            key = (queue_entry.sequence, queue_entry.id)
+            # Entries before this one, including itself once committed
+            queue_entry.position = bisect_left(line.active, key) + 1
+        transaction.on_commit(lambda: self._add(service_point.id, key))
+        return queue_entry
+
+    def _add(self, service_point_id, key):
+        with self._lock:
+            self._line(service_point_id).add(key)
+
+    def _remove(self, service_point_id, key):
+        with self._lock:
+            line = self._lines.get(service_point_id)
+            if line is not None:
+                line.remove(key)
+
+    def _release(self, service_point_id, key):
+        with self._lock:
+            line = self._lines.get(service_point_id)
+            if line is not None:
+                line.claimed.pop(key, None)
+
+    def call_next(self, service_point_ids, counter=''):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                best = None
+                for service_point_id in service_point_ids:
+                    line = self._line(service_point_id)
+                    line.requeue_expired(now)
+                    if line.waiting and (best is None or line.waiting[0] < best[0]):
+                        best = (line.waiting[0], service_point_id, line)
+                if best is None:
+                    return None
+                _, service_point_id, line = best
+                key = line.claim(now + settings.QUEUE_ENGINE_CLAIM_TIMEOUT)
+            queue_entry = self._mark_called(key[1], counter)
+            # A stale entry (left through another process) is skipped
+            if queue_entry is None:
+                self._release(service_point_id, key)
+            else:
+                transaction.on_commit(lambda: self._release(service_point_id, key))
+                return queue_entry
+
+    def serve(self, queue_entry):
+        self._mark_served(queue_entry)
+        key = (queue_entry.sequence, queue_entry.id)
+        transaction.on_commit(lambda: self._remove(queue_entry.service_point_id, key))
+
+    def abandon(self, queue_entry):
+        self._mark_abandoned(queue_entry)
+        key = (queue_entry.sequence, queue_entry.id)
+        transaction.on_commit(lambda: self._remove(queue_entry.service_point_id, key))
+
+    def position(self, queue_entry):
+        with self._lock:
+            line = self._line(queue_entry.service_point_id)
+            return line.rank((queue_entry.sequence, queue_entry.id))
+
+    def positions(self, service_point_id):
+        with self._lock:
+            line = self._line(service_point_id)
+            return {entry_id: index + 1 for index, (_, entry_id) in enumerate(line.active)}
+
+    def reset(self, service_point_id=None):
+        with self._lock:
+            if service_point_id is None:
+                self._lines.clear()
+            else:
+                self._lines.pop(service_point_id, None)
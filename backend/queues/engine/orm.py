@@ -0,0 +1,54 @@
+from django.db import transaction
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+
+from ..models import QueueEntry, ACTIVE_STATUSES, WAITING_STATUSES
+from .base import QueueEngine
+
+
+class ORMQueueEngine(QueueEngine):
+    """
+    Default engine: every operation goes straight to the database. Positions
+    are not stored; they are counted from the entries' sequence numbers when
+    read.
+    """
+
+    def join(self, service_point, user, **fields):
+        # QueueEntry.save allocates the next sequence number
+        return self._create_entry(service_point, user, **fields)
+
+    def call_next(self, service_point_ids, counter=''):
+        # SKIP LOCKED lets each concurrent caller lock a different head of
+        # the queue instead of waiting on (or both taking) the same one.
+        # Databases without row locks fall back on the conditional update in
+        # _mark_called and simply try the next entry.
+        while True:
+            with transaction.atomic():
+                entry_id = QueueEntry.objects.select_for_update(skip_locked=True).filter(
+                    service_point_id__in=service_point_ids,
+                    status__in=WAITING_STATUSES
+                ).order_by('sequence', 'id').values_list('id', flat=True).first()
+
+                if entry_id is None:
+                    return None
+
+                queue_entry = self._mark_called(entry_id, counter)
+            if queue_entry is not None:
+                return queue_entry
+
+    def serve(self, queue_entry):
+        self._mark_served(queue_entry)
+
+    def abandon(self, queue_entry):
+        self._mark_abandoned(queue_entry)
+
+    def position(self, queue_entry):
+        return queue_entry.position
+
+    def positions(self, service_point_id):
+        return dict(QueueEntry.objects.filter(
+            service_point_id=service_point_id,
+            status__in=ACTIVE_STATUSES
+        ).annotate(
+            rank=Window(RowNumber(), order_by=[F('sequence').asc(), F('id').asc()])
+        ).order_by().values_list('id', 'rank'))
@@ -0,0 +1,174 @@
+import time
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.db.models import Max
+
+from ..models import QueueEntry, ACTIVE_STATUSES, WAITING_STATUSES
+from .base import QueueEngine
+
+try:
+    import redis
+except ImportError:  # pragma: no cover - optional dependency
+    redis = None
+
+
+# KEYS: active, waiting  ARGV: sequence, entry id
+JOIN_SCRIPT = """
+redis.call('ZADD', KEYS[1], ARGV[1], ARGV[2])
+redis.call('ZADD', KEYS[2], ARGV[1], ARGV[2])
+return redis.call('ZRANK', KEYS[1], ARGV[2]) + 1
+"""
+
+# KEYS: waiting, active and claimed set of each service point
+# ARGV: now, claim deadline
+# Returns the taken entry id and the index of its service point
+CALL_SCRIPT = """
+local best, best_index, best_score = nil, nil, nil
+for i = 1, #KEYS, 3 do
+    -- Entries of calls that never committed go back to the queue
+    local expired = redis.call('ZRANGEBYSCORE', KEYS[i + 2], '-inf', ARGV[1])
+    for _, id in ipairs(expired) do
+        redis.call('ZREM', KEYS[i + 2], id)
+        local score = redis.call('ZSCORE', KEYS[i + 1], id)
+        if score then
+            redis.call('ZADD', KEYS[i], score, id)
+        end
+    end
+    local head = redis.call('ZRANGE', KEYS[i], 0, 0, 'WITHSCORES')
+    if head[1] and (best_score == nil or tonumber(head[2]) < best_score) then
+        best, best_index, best_score = head[1], i, tonumber(head[2])
+    end
+end
+if not best then
+    return false
+end
+redis.call('ZREM', KEYS[best_index], best)
+redis.call('ZADD', KEYS[best_index + 2], ARGV[2], best)
+return {best, (best_index - 1) / 3}
+"""
+
+# KEYS: active, waiting, claimed  ARGV: entry id
+REMOVE_SCRIPT = """
+redis.call('ZREM', KEYS[3], ARGV[1])
+redis.call('ZREM', KEYS[2], ARGV[1])
+return redis.call('ZREM', KEYS[1], ARGV[1])
+"""
+
+
+class RedisQueueEngine(QueueEngine):
+    """
+    Engine keeping each queue in Redis sorted sets scored by sequence
+    number, with the sequence itself allocated by ``INCR``.
+
+    Every transition is a single Lua script, so concurrent workers see
+    atomic ``O(log n)`` joins, calls and removals. Joins and departures are
+    applied once their transaction commits. A call moves its entry to a
+    claimed set at once, so concurrent callers never get the same one, and
+    the entry goes back to the queue if the call has not committed within
+    ``QUEUE_ENGINE_CLAIM_TIMEOUT`` seconds.
+    """
+
+    def __init__(self, url=None, prefix=None):
+        if redis is None:
+            raise ImproperlyConfigured('RedisQueueEngine requires the "redis" package.')
+        self.client = redis.Redis.from_url(url or settings.QUEUE_ENGINE_REDIS_URL)
+        self.prefix = prefix or settings.QUEUE_ENGINE_KEY_PREFIX
+        self._join = self.client.register_script(JOIN_SCRIPT)
+        self._call = self.client.register_script(CALL_SCRIPT)
+        self._remove_script = self.client.register_script(REMOVE_SCRIPT)
+
+    def _key(self, service_point_id, name):
+        return f'{self.prefix}:sp:{service_point_id}:{name}'
+
+    def _ensure_loaded(self, service_point_id):
+        loaded_key = self._key(service_point_id, 'loaded')
+        if self.client.exists(loaded_key):
+            return
+        entries = QueueEntry.objects.filter(service_point_id=service_point_id)
+        last_sequence = entries.aggregate(last=Max('sequence'))['last'] or 0
+        active = entries.filter(status__in=ACTIVE_STATUSES).values_list('sequence', 'id', 'status')
+        pipe = self.client.pipeline()
+        pipe.set(self._key(service_point_id, 'sequence'), last_sequence, nx=True)
+        for sequence, entry_id, status in active:
+            pipe.zadd(self._key(service_point_id, 'active'), {entry_id: sequence}, nx=True)
+            if status in WAITING_STATUSES:
+                pipe.zadd(self._key(service_point_id, 'waiting'), {entry_id: sequence}, nx=True)
+        pipe.set(loaded_key, 1)
+        pipe.execute()
+
+    def _keys(self, service_point_id):
+        return [
+            self._key(service_point_id, 'active'),
+            self._key(service_point_id, 'waiting'),
+        ]
+
+    def join(self, service_point, user, **fields):
+        self._ensure_loaded(service_point.id)
+        sequence = self.client.incr(self._key(service_point.id, 'sequence'))
+        queue_entry = self._create_entry(service_point, user, sequence=sequence, **fields)
+        # Entries before this one, including itself once committed
+        queue_entry.position = self.client.zcount(
+            self._key(service_point.id, 'active'), '-inf', f'({sequence}'
+        ) + 1
+        transaction.on_commit(lambda: self._join(
+            keys=self._keys(service_point.id),
+            args=[sequence, queue_entry.id]
+        ))
+        return queue_entry
+
+    def _release(self, service_point_id, entry_id):
+        self.client.zrem(self._key(service_point_id, 'claimed'), entry_id)
+
+    def call_next(self, service_point_ids, counter=''):
+        if not service_point_ids:
+            return None
+        keys = []
+        for service_point_id in service_point_ids:
+            self._ensure_loaded(service_point_id)
+            keys.extend(self._key(service_point_id, name) for name in ('waiting', 'active', 'claimed'))
+        while True:
+            now = time.time()
+            taken = self._call(keys=keys, args=[now, now + settings.QUEUE_ENGINE_CLAIM_TIMEOUT])
+            if taken is None:
+                return None
+            entry_id, service_point_id = int(taken[0]), service_point_ids[taken[1]]
+            queue_entry = self._mark_called(entry_id, counter)
+            # A stale entry (left through another process) is skipped
+            if queue_entry is None:
+                self._release(service_point_id, entry_id)
+            else:
+                transaction.on_commit(lambda: self._release(service_point_id, entry_id))
+                return queue_entry
+
+    def _remove(self, queue_entry):
+        self._ensure_loaded(queue_entry.service_point_id)
+        keys = self._keys(queue_entry.service_point_id) + [self._key(queue_entry.service_point_id, 'claimed')]
+        transaction.on_commit(lambda: self._remove_script(keys=keys, args=[queue_entry.id]))
+
+    def serve(self, queue_entry):
+        self._mark_served(queue_entry)
+        self._remove(queue_entry)
+
+    def abandon(self, queue_entry):
+        self._mark_abandoned(queue_entry)
+        self._remove(queue_entry)
+
+    def position(self, queue_entry):
+        self._ensure_loaded(queue_entry.service_point_id)
+        rank = self.client.zrank(self._key(queue_entry.service_point_id, 'active'), queue_entry.id)
+        return None if rank is None else rank + 1
+
+    def positions(self, service_point_id):
+        self._ensure_loaded(service_point_id)
+        active = self.client.zrange(self._key(service_point_id, 'active'), 0, -1)
+        return {int(entry_id): index + 1 for index, entry_id in enumerate(active)}
+
+    def reset(self, service_point_id=None):
+        if service_point_id is None:
+            keys = list(self.client.scan_iter(f'{self.prefix}:*'))
+        else:
+            keys = [self._key(service_point_id, name) for name in ('active', 'waiting', 'claimed', 'sequence', 'loaded')]
+        if keys:
+            self.client.delete(*keys)
@@ -0,0 +1,171 @@
+"""
+Online service-time estimator and queue ETAs.
+
+Every served entry updates two ``ServiceStats`` rows: one for its service
+point and one for its service point and service type. Each row keeps an
+exponentially weighted moving average (EWMA) of the service time and a
+small log-bucket quantile sketch, and is updated in O(1) without reading
+old entries.
+
+``queue_etas`` turns those statistics into the wait of every active entry
+of a queue with a single cumulative sum over the expected service times in
+queue order.
+"""
+import math
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+
+from .models import QueueEntry, ServiceStats, ACTIVE_STATUSES
+
+# Relative accuracy of the sketch's quantiles
+SKETCH_ACCURACY = 0.02
+SKETCH_GAMMA = (1 + SKETCH_ACCURACY) / (1 - SKETCH_ACCURACY)
+# Below this many samples a service type falls back to its service point
+MIN_TYPE_SAMPLES = 5
+
+
+class QuantileSketch:
+    """
+    Log-bucket quantile sketch: values are counted in buckets whose bounds
+    grow by ``SKETCH_GAMMA``, so any quantile is returned within
+    ``SKETCH_ACCURACY`` relative error using a few dozen buckets for
+    service times between seconds and hours.
+    """
+
+    def __init__(self, buckets=None, count=0):
+        self.buckets = buckets or {}
+        self.count = count
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls({int(index): n for index, n in data.get('buckets', {}).items()}, data.get('count', 0))
+
+    def to_dict(self):
+        return {'buckets': {str(index): n for index, n in self.buckets.items()}, 'count': self.count}
+
+    def add(self, value):
+        index = math.ceil(math.log(max(value, 1e-3), SKETCH_GAMMA))
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+
+    def merge(self, other):
+        """
+        Add the values of ``other`` to this sketch; merging is exact, so a
+        sketch of several days answers like one built from all their values.
+        """
+        for index, n in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + n
+        self.count += other.count
+        return self
+
+    def quantile(self, q):
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen > rank:
+                return 2 * SKETCH_GAMMA ** index / (SKETCH_GAMMA + 1)
+        return None
+
+
+def observe(stats, seconds):
+    """
+    Fold one service time into ``stats`` (not saved).
+    """
+    alpha = settings.ETA_EWMA_ALPHA
+    if stats.samples:
+        stats.ewma_seconds += alpha * (seconds - stats.ewma_seconds)
+    else:
+        stats.ewma_seconds = seconds
+    stats.samples += 1
+    sketch = QuantileSketch.from_dict(stats.sketch)
+    sketch.add(seconds)
+    stats.sketch = sketch.to_dict()
+
+
+def record_service(queue_entry):
+    """
+    Update the statistics with a served entry. Runs inside the transaction
+    that marks the entry served.
+    """
+    if queue_entry.called_at is None or queue_entry.served_at is None:
+        return
+    seconds = (queue_entry.served_at - queue_entry.called_at).total_seconds()
+    if seconds <= 0:
+        return
+    service_type_ids = [None]
+    if queue_entry.service_type_id is not None:
+        service_type_ids.append(queue_entry.service_type_id)
+    for service_type_id in service_type_ids:
+        stats, _ = ServiceStats.objects.select_for_update().get_or_create(
+            service_point_id=queue_entry.service_point_id,
+            service_type_id=service_type_id
+        )
+        observe(stats, seconds)
+        stats.save()
+
+
+def quantiles(service_point_id, qs=(0.5, 0.9), service_type_id=None):
+    """
+    Return service time quantiles (seconds) of a service point, or ``None``
+    for each when nothing was served yet.
+    """
+    stats = ServiceStats.objects.filter(
+        service_point_id=service_point_id, service_type_id=service_type_id
+    ).first()
+    sketch = QuantileSketch.from_dict(stats.sketch if stats else {})
+    return [sketch.quantile(q) for q in qs]
+
+
+def queue_etas(service_point_id, positions=None, now=None):
+    """
+    Return ``{entry_id: timedelta}`` with the expected wait of every active
+    entry of a service point.
+
+    An entry waits for the expected service time of everyone ahead of it;
+    someone already called only counts for the part of their service not
+    yet elapsed.
+    """
+    from .engine import get_queue_engine
+
+    if positions is None:
+        positions = get_queue_engine().positions(service_point_id)
+    if not positions:
+        return {}
+    now = now or timezone.now()
+
+    entries = QueueEntry.objects.filter(
+        service_point_id=service_point_id,
+        status__in=ACTIVE_STATUSES
+    ).values_list('id', 'service_type_id', 'status', 'called_at')
+    entries = sorted((row for row in entries if row[0] in positions), key=lambda row: positions[row[0]])
+    if not entries:
+        return {}
+
+    stats = {
+        service_type_id: (samples, ewma)
+        for service_type_id, samples, ewma in ServiceStats.objects.filter(
+            service_point_id=service_point_id
+        ).values_list('service_type_id', 'samples', 'ewma_seconds')
+    }
+    samples, ewma = stats.get(None, (0, 0))
+    default = ewma if samples else settings.DEFAULT_SERVICE_DURATION * 60
+
+    expected = np.full(len(entries), default, dtype=float)
+    elapsed = np.zeros(len(entries), dtype=float)
+    for i, (_, service_type_id, status, called_at) in enumerate(entries):
+        type_samples, type_ewma = stats.get(service_type_id, (0, 0)) if service_type_id else (0, 0)
+        if type_samples >= MIN_TYPE_SAMPLES:
+            expected[i] = type_ewma
+        if status == 'called' and called_at is not None:
+            elapsed[i] = (now - called_at).total_seconds()
+
+    remaining = np.maximum(expected - elapsed, 0)
+    # Everyone ahead in the queue, excluding the entry itself
+    waits = np.cumsum(remaining) - remaining
+    return {row[0]: timedelta(seconds=float(wait)) for row, wait in zip(entries, waits)}
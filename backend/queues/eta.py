@@ -0,0 +1,112 @@
+"""
+Estimated wait times and the 15/10/5 minute reminders.
+
+ETAs are recomputed for a whole service point whenever its queue update is
+broadcast. Crossing a threshold
+is detected against ``QueueEntry.last_eta_threshold``, the smallest
+threshold already notified, so each reminder goes out once per entry,
+without matching on notification text. The notifications are bulk-inserted.
+"""
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Q
+
+from .engine import get_queue_engine
+from .estimator import queue_etas
+from .mailer import queue_emails
+from .models import Notification, QueueEntry, WAITING_STATUSES
+from .outbox import enqueue_notifications
+
+# Reminder thresholds in minutes, most distant first
+THRESHOLDS = (15, 10, 5)
+
+
+def crossed_threshold(eta):
+    """
+    Return the most urgent threshold (in minutes) that ``eta`` is within,
+    or ``None``. Entries with no wait left, at the head of the queue, get no
+    reminder.
+    """
+    if eta <= timedelta(0):
+        return None
+    crossed = None
+    for minutes in THRESHOLDS:
+        if eta <= timedelta(minutes=minutes):
+            crossed = minutes
+    return crossed
+
+
+def threshold_message(minutes):
+    return f'You will be called in approximately {minutes} minutes.'
+
+
+def refresh_etas(service_point_id, positions=None, etas=None):
+    """
+    Store the ETA of every waiting entry of a service point, as computed by
+    ``queues.estimator.queue_etas``, and send the reminders for newly
+    crossed thresholds. Returns the number of reminders sent.
+    """
+    if positions is None:
+        positions = get_queue_engine().positions(service_point_id)
+    if etas is None:
+        etas = queue_etas(service_point_id, positions)
+    if not etas:
+        return 0
+
+    entries = list(QueueEntry.objects.filter(
+        service_point_id=service_point_id,
+        status__in=WAITING_STATUSES
+    ).select_related('user').only(
+        'id', 'service_point_id', 'estimated_wait_time', 'last_eta_threshold', 'user__id', 'user__email'
+    ))
+
+    changed = []
+    reminders = {}
+    for entry in entries:
+        eta = etas.get(entry.id)
+        if eta is None:
+            continue
+        # Whole seconds keep unchanged ETAs from being rewritten
+        eta = timedelta(seconds=round(eta.total_seconds()))
+        dirty = eta != entry.estimated_wait_time
+        entry.estimated_wait_time = eta
+
+        threshold = crossed_threshold(eta)
+        if threshold is not None and (entry.last_eta_threshold is None or threshold < entry.last_eta_threshold):
+            entry.last_eta_threshold = threshold
+            reminders.setdefault(threshold, []).append(entry.user)
+            dirty = True
+        if dirty:
+            changed.append(entry)
+
+    with transaction.atomic():
+        QueueEntry.objects.bulk_update(changed, ['estimated_wait_time', 'last_eta_threshold'], batch_size=500)
+        notifications = Notification.objects.bulk_create([
+            Notification(user=user, message=threshold_message(minutes))
+            for minutes, users in reminders.items() for user in users
+        ], batch_size=500)
+        enqueue_notifications(notifications)
+        for minutes, users in reminders.items():
+            queue_emails([user.email for user in users], threshold_message(minutes))
+
+    return sum(len(users) for users in reminders.values())
+
+
+def due_service_points():
+    """
+    Service points with a waiting entry inside a threshold it was not yet
+    reminded of. Used by the periodic safety sweep; answered from the
+    partial ``queueentry_eta_idx`` index.
+    """
+    missed = Q()
+    for minutes in THRESHOLDS:
+        missed |= Q(estimated_wait_time__lte=timedelta(minutes=minutes)) & (
+            Q(last_eta_threshold__isnull=True) | Q(last_eta_threshold__gt=minutes)
+        )
+    return QueueEntry.objects.filter(
+        missed,
+        status__in=WAITING_STATUSES,
+        estimated_wait_time__gt=timedelta(0),
+        estimated_wait_time__lte=timedelta(minutes=THRESHOLDS[0])
+    ).order_by().values_list('service_point_id', flat=True).distinct()
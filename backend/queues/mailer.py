@@ -0,0 +1,193 @@
+"""
+Pooled, batched delivery of queue notification emails.
+
+Emails are recorded as ``EmailDelivery`` rows in the transaction that
+produced them and sent by the ``dispatch_emails`` task. Each dispatch run:
+
+- opens one backend connection for the whole batch;
+- with an Anymail backend, sends every recipient of the same text in one
+  provider call using Anymail batch sending; otherwise it sends one message
+  per recipient over the shared connection;
+- stays under ``EMAIL_RATE_LIMITS`` (messages per second per backend);
+- retries failures with exponential backoff, up to ``EMAIL_MAX_ATTEMPTS``;
+- records the provider's message id and status on each row.
+"""
+import logging
+import time
+from datetime import timedelta
+from itertools import groupby
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.utils import timezone
+
+from .models import EmailDelivery
+
+try:
+    from anymail.backends.base import AnymailBaseBackend
+except ImportError:  # pragma: no cover - optional dependency
+    AnymailBaseBackend = None
+
+logger = logging.getLogger(__name__)
+
+# Anymail recipient statuses that mean the provider took the message
+ACCEPTED_STATUSES = ('sent', 'queued', 'unknown')
+
+
+def queue_emails(user_emails, message, subject='Queue Notification'):
+    """
+    Record an email to each address, to be sent once the transaction commits.
+    """
+    deliveries = EmailDelivery.objects.bulk_create([
+        EmailDelivery(recipient=user_email, subject=subject, message=message)
+        for user_email in user_emails if user_email
+    ])
+    if deliveries and settings.OUTBOX_RELAY_ON_COMMIT:
+        transaction.on_commit(_kick_dispatch)
+    return deliveries
+
+
+def queue_email(user_email, message, subject='Queue Notification'):
+    return queue_emails([user_email], message, subject)
+
+
+def _kick_dispatch():
+    from .tasks import dispatch_emails
+
+    try:
+        dispatch_emails.delay()
+    except Exception as e:
+        # The periodic dispatch will pick the emails up
+        logger.warning('Could not schedule email dispatch: %s', e)
+
+
+def acquire(provider, wanted):
+    """
+    Take up to ``wanted`` sends from the provider's budget for the current
+    second and return how many were granted.
+    """
+    limit = settings.EMAIL_RATE_LIMITS.get(provider)
+    if not limit:
+        return wanted
+    key = f'email_rate:{provider}:{int(time.time())}'
+    cache.add(key, 0, timeout=2)
+    used = cache.incr(key, wanted)
+    granted = max(0, min(wanted, limit - (used - wanted)))
+    if granted < wanted:
+        cache.decr(key, wanted - granted)
+    return granted
+
+
+def backoff(attempts):
+    """
+    Delay before the next attempt after ``attempts`` failed ones.
+    """
+    return timedelta(seconds=settings.EMAIL_RETRY_BACKOFF * 2 ** (attempts - 1))
+
+
+def _failed(delivery, error, now):
+    delivery.attempts += 1
+    delivery.last_error = str(error)
+    if delivery.attempts >= settings.EMAIL_MAX_ATTEMPTS:
+        delivery.status = 'failed'
+    else:
+        delivery.next_attempt_at = now + backoff(delivery.attempts)
+
+
+def _sent(delivery, now, message_id='', provider_status=''):
+    delivery.attempts += 1
+    delivery.status = 'sent'
+    delivery.sent_at = now
+    delivery.provider_message_id = message_id or ''
+    delivery.provider_status = provider_status or ''
+    delivery.last_error = ''
+
+
+def _send_anymail_batches(connection, deliveries, now):
+    # Group recipients of the same email into one batch send
+    key = lambda delivery: (delivery.subject, delivery.message)  # noqa: E731
+    for (subject, body), group in groupby(sorted(deliveries, key=key), key=key):
+        group = list(group)
+        message = EmailMessage(subject, body, settings.DEFAULT_FROM_EMAIL, [d.recipient for d in group])
+        # An empty merge_data makes Anymail send each recipient a separate copy
+        message.merge_data = {}
+        try:
+            connection.send_messages([message])
+        except Exception as e:
+            for delivery in group:
+                _failed(delivery, e, now)
+            continue
+        recipients = message.anymail_status.recipients
+        for delivery in group:
+            status = recipients.get(delivery.recipient)
+            if status is None or status.status in ACCEPTED_STATUSES:
+                _sent(delivery, now, status and status.message_id, status and status.status)
+            else:
+                delivery.provider_status = status.status
+                _failed(delivery, f'Rejected by provider: {status.status}', now)
+
+
+def _send_individually(connection, deliveries, now):
+    for delivery in deliveries:
+        message = EmailMessage(delivery.subject, delivery.message, settings.DEFAULT_FROM_EMAIL, [delivery.recipient])
+        try:
+            connection.send_messages([message])
+        except Exception as e:
+            _failed(delivery, e, now)
+        else:
+            _sent(delivery, now)
+
+
+def send(deliveries):
+    """
+    Send the given deliveries over a single backend connection and update
+    them in memory with the outcome.
+    """
+    now = timezone.now()
+    connection = get_connection(fail_silently=False)
+    provider = settings.EMAIL_BACKEND
+    for delivery in deliveries:
+        delivery.provider = provider
+    try:
+        connection.open()
+    except Exception as e:
+        for delivery in deliveries:
+            _failed(delivery, e, now)
+        return
+    try:
+        if AnymailBaseBackend is not None and isinstance(connection, AnymailBaseBackend):
+            _send_anymail_batches(connection, deliveries, now)
+        else:
+            _send_individually(connection, deliveries, now)
+    finally:
+        connection.close()
+
+
+def dispatch(batch_size=None):
+    """
+    Send one batch of due emails and return how many were attempted.
+
+    Rows are claimed with ``SKIP LOCKED`` so several workers can dispatch at
+    once. Rows beyond the provider's rate budget are left for the next run.
+    """
+    batch_size = batch_size or settings.EMAIL_DISPATCH_BATCH_SIZE
+
+    with transaction.atomic():
+        due = list(
+            EmailDelivery.objects.select_for_update(skip_locked=True).filter(
+                status='pending',
+                next_attempt_at__lte=timezone.now()
+            ).order_by('next_attempt_at', 'id')[:batch_size]
+        )
+        due = due[:acquire(settings.EMAIL_BACKEND, len(due))]
+        if not due:
+            return 0
+
+        send(due)
+        EmailDelivery.objects.bulk_update(due, [
+            'status', 'attempts', 'next_attempt_at', 'provider', 'provider_message_id',
+            'provider_status', 'last_error', 'sent_at'
+        ])
+    return len(due)
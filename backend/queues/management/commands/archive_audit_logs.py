@@ -0,0 +1,40 @@
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from queues import partitions
+
+
+class Command(BaseCommand):
+    help = (
+        'Stream audit log months older than the retention policy to gzip compressed '
+        'JSON Lines files, then drop them.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--before', help='Archive months before this one, as YYYY-MM (default: keep AUDIT_RETENTION_MONTHS)'
+        )
+        parser.add_argument('--output-dir', default=settings.AUDIT_ARCHIVE_DIR)
+        parser.add_argument('--dry-run', action='store_true', help='Only report what would be archived')
+
+    def handle(self, *args, **options):
+        cutoff = None
+        if options['before']:
+            try:
+                cutoff = datetime.strptime(options['before'], '%Y-%m').replace(tzinfo=timezone.utc)
+            except ValueError:
+                raise CommandError('--before must look like YYYY-MM.')
+
+        created = partitions.ensure_partitions()
+        for name in created:
+            self.stdout.write(f'Created partition {name}')
+
+        archived = partitions.archive(cutoff, options['output_dir'], dry_run=options['dry_run'])
+        for month, rows, path in archived:
+            if path is None:
+                self.stdout.write(f'{month:%Y-%m}: {rows} row(s) would be archived')
+            else:
+                self.stdout.write(f'{month:%Y-%m}: {rows} row(s) archived to {path}')
+        self.stdout.write(self.style.SUCCESS(f'Archived {len(archived)} month(s).'))
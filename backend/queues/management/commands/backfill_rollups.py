@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from queues import rollups
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the hourly analytics rollups and daily duration sketches of service points from their queue entries.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'service_point_ids', type=int, nargs='*',
+            help='Only rebuild these service points (default: all)'
+        )
+
+    def handle(self, *args, **options):
+        written = rollups.backfill(options['service_point_ids'] or None)
+        self.stdout.write(self.style.SUCCESS(f'Wrote {written} rollup and sketch row(s).'))
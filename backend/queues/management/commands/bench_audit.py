@@ -0,0 +1,51 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from accounts.models import User
+from queues.audit import AuditBuffer
+from queues.models import AuditLog
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare the per-request cost of auditing: one synchronous AuditLog insert '
+        'against handing the event to the buffered writer. Runs inside a rolled back transaction.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--events', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        events = options['events']
+        with transaction.atomic():
+            user = User.objects.create(username='bench-audit', role='staff')
+            fields = {
+                'action': 'view', 'resource_type': 'service_points',
+                'description': 'GET /api/queues/service-points/ -> 200', 'ip_address': '127.0.0.1',
+                'user_agent': 'bench',
+            }
+
+            started = time.perf_counter()
+            for _ in range(events):
+                AuditLog.objects.create(user=user, **fields)
+            synchronous = (time.perf_counter() - started) / events * 1e6
+
+            # No writer thread, and batches larger than the run, so nothing
+            # is written until the explicit flush below
+            buffer = AuditBuffer(capacity=events, batch_size=events + 1, interval=200, full_timeout=5, background=False)
+            started = time.perf_counter()
+            for _ in range(events):
+                buffer.record(user_id=user.id, **fields)
+            buffered = (time.perf_counter() - started) / events * 1e6
+
+            started = time.perf_counter()
+            buffer.flush()
+            flushed = (time.perf_counter() - started) / events * 1e6
+            transaction.set_rollback(True)
+
+        self.stdout.write(f'events: {events}')
+        self.stdout.write(f'synchronous insert per request: {synchronous:8.1f} us')
+        self.stdout.write(f'buffered record per request:    {buffered:8.1f} us')
+        self.stdout.write(f'batched write per event:        {flushed:8.1f} us (off the request path)')
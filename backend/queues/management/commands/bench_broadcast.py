@@ -0,0 +1,109 @@
+import heapq
+import json
+import random
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+
+from queues import coalesce
+from queues.broadcast import personalise_queue_update, queue_update_message
+
+
+class Command(BaseCommand):
+    help = (
+        'Replay a synthetic burst of queue changes on one service point through the '
+        'broadcast coalescing window and measure the messages and consumer CPU it costs.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rate', type=float, default=20, help='Queue changes per second during the burst')
+        parser.add_argument('--duration', type=float, default=10, help='Burst length in seconds')
+        parser.add_argument('--subscribers', type=int, default=500)
+        parser.add_argument('--queue-length', type=int, default=100)
+        parser.add_argument('--windows', type=int, nargs='+', default=[0, 100, 150, 250],
+                            help='Coalescing windows to compare, in milliseconds (0 = no coalescing)')
+        parser.add_argument('--max-delay', type=int, default=settings.QUEUE_UPDATE_MAX_DELAY)
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        changes = []
+        moment = 0.0
+        while True:
+            moment += rng.expovariate(options['rate'])
+            if moment >= options['duration']:
+                break
+            changes.append(moment)
+
+        entries = [(entry_id, entry_id, entry_id * 60) for entry_id in range(1, options['queue_length'] + 1)]
+        # Subscribers are spread over the queue, plus onlookers not in it
+        user_ids = [rng.randint(1, options['queue_length'] * 2) for _ in range(options['subscribers'])]
+
+        self.stdout.write(
+            f"{len(changes)} changes in {options['duration']:.0f}s to {options['subscribers']} subscribers, "
+            f"max delay {options['max_delay']}ms"
+        )
+        self.stdout.write(
+            f"{'window (ms)':>11} {'broadcasts/s':>13} {'socket msgs/s':>14} "
+            f"{'consumer CPU':>13} {'mean delay (ms)':>16} {'max delay (ms)':>15}"
+        )
+        for window in options['windows']:
+            with override_settings(QUEUE_UPDATE_WINDOW=window, QUEUE_UPDATE_MAX_DELAY=options['max_delay']):
+                broadcasts, delays = self._replay(f'bench-{window}', changes, window / 1000)
+            cpu = self._consume(broadcasts, entries, user_ids)
+            duration = options['duration']
+            self.stdout.write(
+                f'{window:>11} {len(broadcasts) / duration:>13.1f} '
+                f'{len(broadcasts) * len(user_ids) / duration:>14.0f} '
+                f'{cpu / duration:>12.1%} '
+                f'{1000 * sum(delays) / max(len(delays), 1):>16.0f} {1000 * max(delays, default=0):>15.0f}'
+            )
+
+    def _replay(self, service_point_id, changes, window):
+        """
+        Run the changes through queues.coalesce on a simulated clock and
+        return the broadcast times and how long each change waited.
+        """
+        coalesce.close(service_point_id)
+        flushes = []
+        broadcasts = []
+        delays = []
+        unsent = []
+        for change in changes + [float('inf')]:
+            # Flushes scheduled before this change run first
+            while flushes and flushes[0] <= change:
+                now = heapq.heappop(flushes)
+                delay = coalesce.due_in(service_point_id, now=now)
+                if delay is None:
+                    continue
+                if delay > 1e-9:
+                    heapq.heappush(flushes, now + delay)
+                    continue
+                coalesce.close(service_point_id)
+                broadcasts.append(now)
+                delays.extend(now - moment for moment in unsent)
+                unsent = []
+            if change == float('inf'):
+                break
+            if window <= 0:
+                broadcasts.append(change)
+                delays.append(0.0)
+                continue
+            unsent.append(change)
+            if coalesce.note_update(service_point_id, now=change):
+                heapq.heappush(flushes, change + window)
+        return broadcasts, delays
+
+    def _consume(self, broadcasts, entries, user_ids):
+        """
+        Return the CPU seconds every subscriber's consumer spends turning the
+        broadcasts into the messages it sends down its socket.
+        """
+        started = time.process_time()
+        for version, _ in enumerate(broadcasts, 1):
+            data = queue_update_message(1, entries, version)['data']
+            for user_id in user_ids:
+                json.dumps({'type': 'queue_update', 'data': personalise_queue_update(data, user_id)})
+        return time.process_time() - started
@@ -0,0 +1,121 @@
+import asyncio
+import gc
+import time
+
+from asgiref.sync import async_to_sync
+from channels.layers import InMemoryChannelLayer
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management.base import BaseCommand
+
+from queues.broadcast import personalise_queue_update, queue_update_message
+
+
+class RoundTripChannelLayer(InMemoryChannelLayer):
+    """
+    In-memory layer that waits a fixed network round trip on every send and
+    group send, the way a call to a Redis channel layer would.
+    """
+
+    def __init__(self, round_trip, **kwargs):
+        super().__init__(**kwargs)
+        self.round_trip = round_trip
+
+    async def send(self, channel, message):
+        await asyncio.sleep(self.round_trip)
+        await super().send(channel, message)
+
+    async def group_send(self, group, message):
+        await asyncio.sleep(self.round_trip)
+        # Redis delivers to the group members server side in one call
+        await asyncio.gather(*(
+            InMemoryChannelLayer.send(self, channel, message)
+            for channel in self.groups.get(group, {})
+        ))
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare the old per-user queue update fan-out (one cache lookup and one '
+        'channel send per user) with a single group broadcast.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--subscribers', type=int, nargs='+', default=[1000, 10000])
+        parser.add_argument('--round-trip-us', type=int, default=200,
+                            help='Simulated channel layer round trip for the second run.')
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def handle(self, *args, **options):
+        layers = [
+            ('in-memory', lambda: InMemoryChannelLayer(capacity=10)),
+            (f"{options['round_trip_us']}us RTT",
+             lambda: RoundTripChannelLayer(options['round_trip_us'] / 1_000_000, capacity=10)),
+        ]
+        self.stdout.write(
+            f"{'subscribers':>11} {'layer':>10} {'per-user sends (ms)':>20} "
+            f"{'group send (ms)':>16} {'filter per socket (us)':>23}"
+        )
+        for count in options['subscribers']:
+            for name, make_layer in layers:
+                per_user_ms = min(self._per_user(make_layer(), count) for _ in range(options['repeat']))
+                group_ms = min(self._group(make_layer(), count) for _ in range(options['repeat']))
+                filter_us = min(self._filter(count) for _ in range(options['repeat']))
+                self.stdout.write(
+                    f'{count:>11} {name:>10} {per_user_ms:>20.1f} {group_ms:>16.1f} {filter_us:>23.1f}'
+                )
+
+    def _entries(self, count):
+        # (entry_id, user_id, eta_seconds) in position order, as send_queue_update builds them
+        return [(entry_id, entry_id, entry_id * 60) for entry_id in range(count)]
+
+    def _subscribe(self, layer, count):
+        channels = [async_to_sync(layer.new_channel)() for _ in range(count)]
+        for channel in channels:
+            async_to_sync(layer.group_add)('queue_1', channel)
+        return channels
+
+    def _timed(self, func):
+        gc.collect()
+        gc.disable()
+        try:
+            started = time.perf_counter()
+            func()
+            return time.perf_counter() - started
+        finally:
+            gc.enable()
+
+    def _per_user(self, layer, count):
+        # Large enough that no channel name is evicted before it is read
+        cache = LocMemCache('bench-fanout', {'OPTIONS': {'MAX_ENTRIES': count * 2}})
+        channels = self._subscribe(layer, count)
+        for user_id, channel in enumerate(channels):
+            cache.set(f'queue_channel_1_{user_id}', channel)
+
+        def fan_out():
+            # What send_queue_update used to do for each active entry
+            for user_id in range(count):
+                channel_name = cache.get(f'queue_channel_1_{user_id}')
+                if channel_name:
+                    async_to_sync(layer.send)(
+                        channel_name,
+                        {'type': 'queue_update', 'data': {'position': user_id + 1, 'service_point_id': 1}}
+                    )
+
+        elapsed = self._timed(fan_out)
+        cache.clear()
+        return elapsed * 1000
+
+    def _group(self, layer, count):
+        self._subscribe(layer, count)
+        ordered_entries = self._entries(count)
+
+        def broadcast():
+            message = queue_update_message(1, ordered_entries, version=1)
+            async_to_sync(layer.group_send)('queue_1', message)
+
+        return self._timed(broadcast) * 1000
+
+    def _filter(self, count):
+        # Consumer side: the subscriber at the back of the queue picking out its position
+        message = queue_update_message(1, self._entries(count), version=1)
+        return self._timed(lambda: personalise_queue_update(message['data'], user_id=count - 1)) * 1_000_000
@@ -0,0 +1,60 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F
+
+from accounts.models import User
+from queues.engine.orm import ORMQueueEngine
+from queues.models import QueueEntry, ServicePoint
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare the cost of a queue departure with the old position renumbering '
+        'against rank-on-read sequence numbers. Runs inside a rolled back transaction.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[100, 500, 2000, 5000])
+        parser.add_argument('--departures', type=int, default=20)
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{'queue length':>12} {'renumbering (ms)':>18} {'rank-on-read (ms)':>18}")
+        for size in options['sizes']:
+            renumber_ms = self._run(size, options['departures'], renumber=True)
+            rank_ms = self._run(size, options['departures'], renumber=False)
+            self.stdout.write(f'{size:>12} {renumber_ms:>18.3f} {rank_ms:>18.3f}')
+
+    def _run(self, size, departures, renumber):
+        with transaction.atomic():
+            entries = self._seed(size)
+            engine = ORMQueueEngine()
+            started = time.perf_counter()
+            for entry in entries[:departures]:
+                engine.abandon(entry)
+                if renumber:
+                    # What leave_queue used to do for everyone behind
+                    QueueEntry.objects.filter(
+                        service_point_id=entry.service_point_id,
+                        sequence__gt=entry.sequence,
+                        status__in=['joined', 'waiting', 'called']
+                    ).update(sequence=F('sequence') - 1)
+            # Read back one position so the rank query is part of the cost
+            entries[-1].__dict__.pop('live_position', None)
+            entries[-1].position
+            elapsed = time.perf_counter() - started
+            transaction.set_rollback(True)
+        return elapsed * 1000 / departures
+
+    def _seed(self, size):
+        staff = User.objects.create(username='bench-positions-staff', role='staff')
+        service_point = ServicePoint.objects.create(name='Benchmark', creator=staff)
+        users = User.objects.bulk_create([
+            User(username=f'bench-positions-{i}', email=f'bench-positions-{i}@example.com')
+            for i in range(size)
+        ])
+        return QueueEntry.objects.bulk_create([
+            QueueEntry(service_point=service_point, user=user, sequence=i + 1, ticket_number=f'BP{i}')
+            for i, user in enumerate(users)
+        ])
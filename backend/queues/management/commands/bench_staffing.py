@@ -0,0 +1,58 @@
+import time
+from datetime import timedelta
+
+import numpy as np
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from accounts.models import User
+from queues.models import QueueEntry, ServicePoint
+from queues.staffing import forecast
+
+
+class Command(BaseCommand):
+    help = (
+        'Time a staffing forecast over a year of synthetic queue history. '
+        'Runs inside a rolled back transaction.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--per-day', type=int, default=300, help='Arrivals per day')
+        parser.add_argument('--days', type=int, default=365)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            service_point, size = self._seed(options['per_day'], options['days'])
+            started = time.perf_counter()
+            hours = forecast(service_point.id, weeks=options['days'] // 7 + 1)
+            elapsed = time.perf_counter() - started
+            transaction.set_rollback(True)
+
+        self.stdout.write(f'history: {size} entries over {options["days"]} days')
+        self.stdout.write(f'forecast: {elapsed * 1000:10.1f} ms')
+        self.stdout.write(f'peak counters: {max(hour["counters"] for hour in hours)}')
+
+    def _seed(self, per_day, days):
+        rng = np.random.default_rng(0)
+        staff = User.objects.create(username='bench-staffing-staff', role='staff')
+        customer = User.objects.create(username='bench-staffing-customer')
+        service_point = ServicePoint.objects.create(name='Benchmark', creator=staff)
+        start = timezone.now() - timedelta(days=days)
+        size = per_day * days
+        # Arrivals during opening hours, 8:00 to 18:00 UTC
+        offsets = rng.integers(0, days, size) * 86400 + rng.uniform(8 * 3600, 18 * 3600, size)
+        services = rng.exponential(300, size)
+        entries = []
+        for i in range(size):
+            called_at = start + timedelta(seconds=float(offsets[i]) + 600)
+            entries.append(QueueEntry(
+                service_point=service_point, user=customer, status='served', sequence=i + 1,
+                ticket_number=f'BS{i}', called_at=called_at,
+                served_at=called_at + timedelta(seconds=float(services[i]))
+            ))
+        QueueEntry.objects.bulk_create(entries, batch_size=2000)
+        # joined_at is set on insert; move it back to ten minutes before the call
+        QueueEntry.objects.filter(service_point=service_point).update(joined_at=F('called_at') - timedelta(minutes=10))
+        return service_point, size
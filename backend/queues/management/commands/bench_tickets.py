@@ -0,0 +1,103 @@
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import override_settings
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from accounts.models import User
+from queues import tickets
+from queues.models import QueueEntry, ServicePoint, TicketCounter
+from queues.views import join_queue
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure concurrent joins through the join_queue view, one ticket number '
+        'per counter write against block allocation. Commits for real (each '
+        'thread has its own connection) and deletes its data afterwards.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--joins', type=int, default=100, help='Joins per thread')
+        parser.add_argument('--block-size', type=int, default=settings.TICKET_BLOCK_SIZE)
+
+    def handle(self, *args, **options):
+        threads, joins = options['threads'], options['joins']
+        staff = User.objects.create(username='bench-tickets-staff', role='staff')
+        users = User.objects.bulk_create([
+            User(username=f'bench-tickets-{i}', email=f'bench-tickets-{i}@example.com', role='customer')
+            for i in range(threads * joins)
+        ])
+        try:
+            # The outbox relay is not what is measured here
+            with override_settings(OUTBOX_RELAY_ON_COMMIT=False):
+                for block_size in sorted({1, options['block_size']}):
+                    self._report(block_size, staff, users, threads, joins)
+        finally:
+            User.objects.filter(pk__in=[user.pk for user in users] + [staff.pk]).delete()
+            tickets.reset()
+
+    def _report(self, block_size, staff, users, threads, joins):
+        service_point = ServicePoint.objects.create(name=f'Benchmark {block_size}', creator=staff)
+        tickets.reset()
+        with override_settings(TICKET_BLOCK_SIZE=block_size):
+            elapsed, latencies, failures = self._run(service_point, users, threads, joins)
+
+        entries = QueueEntry.objects.filter(service_point=service_point)
+        claimed = TicketCounter.objects.get(service_point=service_point).last_number
+        service_point.refresh_from_db()
+        numbers = list(entries.values_list('ticket_number', flat=True))
+        sequences = list(entries.values_list('sequence', flat=True))
+        p50, p99 = np.percentile(np.asarray(latencies) * 1000, [50, 99]) if latencies else (0, 0)
+        consistent = (
+            len(set(numbers)) == len(numbers)
+            and len(set(sequences)) == len(sequences)
+            and service_point.active_count == len(numbers)
+        )
+        self.stdout.write(
+            f'block size {block_size:>4}: {len(latencies) / elapsed:8.0f} joins/s, '
+            f'p50 {p50:6.1f} ms, p99 {p99:7.1f} ms, {failures} failed, '
+            f'{-(-claimed // block_size)} counter writes, '
+            f'{"consistent" if consistent else "INCONSISTENT"}'
+        )
+        service_point.delete()
+
+    def _run(self, service_point, users, threads, joins):
+        factory = APIRequestFactory()
+        latencies = []
+        failures = []
+        start = threading.Barrier(threads)
+
+        def joiner(batch):
+            timings = []
+            failed = 0
+            try:
+                start.wait()
+                for user in batch:
+                    request = factory.post('/api/queues/join/', {'service_point_id': service_point.id}, format='json')
+                    force_authenticate(request, user=user)
+                    began = time.perf_counter()
+                    response = join_queue(request)
+                    timings.append(time.perf_counter() - began)
+                    if response.status_code != 200:
+                        failed += 1
+            finally:
+                latencies.extend(timings)
+                failures.append(failed)
+                connection.close()
+
+        workers = [
+            threading.Thread(target=joiner, args=(users[i * joins:(i + 1) * joins],))
+            for i in range(threads)
+        ]
+        started = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        return time.perf_counter() - started, latencies, sum(failures)
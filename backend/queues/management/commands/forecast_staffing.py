@@ -0,0 +1,42 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from queues.models import ServicePoint
+from queues.staffing import MAX_WEEKS, forecast
+
+WEEKDAYS = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+
+
+class Command(BaseCommand):
+    help = 'Print the counters a service point needs in each hour of the week to meet a target mean wait.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('service_point_id', type=int)
+        parser.add_argument(
+            '--target-wait', type=float, default=settings.STAFFING_TARGET_WAIT,
+            help='Target mean wait in minutes'
+        )
+        parser.add_argument(
+            '--weeks', type=int, default=settings.STAFFING_HISTORY_WEEKS,
+            help='Weeks of queue history to learn from'
+        )
+
+    def handle(self, *args, **options):
+        if not 0 < options['target_wait'] < float('inf'):
+            raise CommandError('--target-wait must be a positive number of minutes.')
+        if not 0 < options['weeks'] <= MAX_WEEKS:
+            raise CommandError(f'--weeks must be between 1 and {MAX_WEEKS}.')
+        try:
+            service_point = ServicePoint.objects.get(pk=options['service_point_id'])
+        except ServicePoint.DoesNotExist:
+            raise CommandError(f"Service point {options['service_point_id']} does not exist.")
+
+        hours = forecast(service_point.id, target_wait=options['target_wait'], weeks=options['weeks'])
+        self.stdout.write(
+            f"Counters needed at {service_point.name} for a mean wait of at most "
+            f"{options['target_wait']} minutes (last {options['weeks']} weeks):"
+        )
+        self.stdout.write('hour  ' + ' '.join(f'{day:>4}' for day in WEEKDAYS))
+        for hour in range(24):
+            row = [hours[weekday * 24 + hour]['counters'] for weekday in range(7)]
+            self.stdout.write(f'{hour:02d}:00 ' + ' '.join(f'{counters:>4}' for counters in row))
@@ -0,0 +1,359 @@
+import asyncio
+import base64
+import json
+import os
+import random
+import struct
+import time
+from datetime import datetime
+from urllib.parse import urlsplit
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from accounts.models import User
+from accounts.serializers import LoginSerializer
+from queues.models import ServicePoint
+
+PERCENTILES = (50, 95, 99)
+
+
+class HttpConnection:
+    """
+    Minimal keep-alive HTTP/1.1 client over asyncio streams, one per
+    simulated user, so the load generator needs nothing beyond the standard
+    library.
+    """
+
+    def __init__(self, host, port, cookie):
+        self.host = host
+        self.port = port
+        self.cookie = cookie
+        self.reader = self.writer = None
+
+    async def request(self, method, path, body=None):
+        payload = json.dumps(body).encode() if body is not None else b''
+        head = (
+            f'{method} {path} HTTP/1.1\r\nHost: {self.host}:{self.port}\r\nCookie: {self.cookie}\r\n'
+            f'Content-Type: application/json\r\nContent-Length: {len(payload)}\r\n\r\n'
+        ).encode()
+        for attempt in range(2):
+            if self.writer is None:
+                self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+            try:
+                self.writer.write(head + payload)
+                await self.writer.drain()
+                return await self._response()
+            except (ConnectionError, asyncio.IncompleteReadError):
+                # The server closed the idle connection; reconnect once
+                self.close()
+                if attempt:
+                    raise
+
+    async def _response(self):
+        status_line, *header_lines = (await self.reader.readuntil(b'\r\n\r\n')).decode('latin-1').split('\r\n')
+        status = int(status_line.split(' ', 2)[1])
+        headers = {}
+        for line in header_lines:
+            if ':' in line:
+                name, value = line.split(':', 1)
+                headers[name.strip().lower()] = value.strip()
+        if headers.get('transfer-encoding') == 'chunked':
+            body = b''
+            while True:
+                size = int((await self.reader.readuntil(b'\r\n')).split(b';')[0], 16)
+                chunk = await self.reader.readexactly(size + 2)
+                if not size:
+                    break
+                body += chunk[:-2]
+        else:
+            body = await self.reader.readexactly(int(headers.get('content-length', 0)))
+        if headers.get('connection') == 'close':
+            self.close()
+        return status, body
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+class Stats:
+    def __init__(self):
+        self.latencies = {}
+        self.statuses = {}
+        self.errors = {}
+
+    async def timed(self, name, call):
+        started = time.perf_counter()
+        try:
+            status, body = await call
+        except (OSError, asyncio.IncompleteReadError, ValueError) as e:
+            self.errors.setdefault(name, {})
+            self.errors[name][type(e).__name__] = self.errors[name].get(type(e).__name__, 0) + 1
+            return None, b''
+        self.latencies.setdefault(name, []).append(time.perf_counter() - started)
+        statuses = self.statuses.setdefault(name, {})
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+        return status, body
+
+
+def summarise(latencies, statuses, errors, duration):
+    """
+    Throughput and latency percentiles (in milliseconds) of one endpoint.
+    """
+    summary = {
+        'requests': len(latencies),
+        'throughput': round(len(latencies) / duration, 2),
+        'statuses': statuses,
+        'errors': errors,
+    }
+    if latencies:
+        values = np.percentile(np.asarray(latencies) * 1000, PERCENTILES)
+        summary.update({f'p{p}_ms': round(float(value), 2) for p, value in zip(PERCENTILES, values)})
+        summary['max_ms'] = round(max(latencies) * 1000, 2)
+    return summary
+
+
+def _rss_kb(pid):
+    try:
+        with open(f'/proc/{pid}/status') as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+
+
+class Command(BaseCommand):
+    help = (
+        'Load test the queue API and WebSockets of a running ASGI server: customers '
+        'join, poll and leave, tellers call and dismiss, and sockets listen. Reports '
+        'throughput and p50/p95/p99 latency per endpoint and saves the results as JSON. '
+        'The server has to use the same database as this command, which creates the '
+        'test users and service point there and removes them afterwards.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8001', help='Base URL of the ASGI server')
+        parser.add_argument('--customers', type=int, default=50)
+        parser.add_argument('--tellers', type=int, default=2)
+        parser.add_argument('--sockets', type=int, default=200, help='Listening QueueConsumer connections')
+        parser.add_argument('--duration', type=float, default=30, help='Seconds of load')
+        parser.add_argument('--poll-interval', type=float, default=2, help='Seconds between position polls')
+        parser.add_argument('--service-time', type=float, default=0.5, help='Seconds a teller spends per customer')
+        parser.add_argument('--leave-ratio', type=float, default=0.1,
+                            help='Chance that a waiting customer leaves after each poll')
+        parser.add_argument('--server-pid', type=int, help='ASGI server process, to measure memory per connection')
+        parser.add_argument('--output', help='JSON results file (default: loadtest-<time>.json)')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--keep-data', action='store_true')
+
+    def handle(self, *args, **options):
+        url = urlsplit(options['url'])
+        if url.scheme != 'http' or not url.hostname:
+            raise CommandError('--url must be an http:// URL.')
+        self.host, self.port = url.hostname, url.port or 80
+        self.options = options
+        self.random = random.Random(options['seed'])
+
+        run_id = timezone.now().strftime('%Y%m%d%H%M%S')
+        staff = User.objects.create(username=f'loadtest-{run_id}-staff', role='staff')
+        customers = [
+            User(username=f'loadtest-{run_id}-{i}', email=f'loadtest-{run_id}-{i}@example.com')
+            for i in range(options['customers'])
+        ]
+        customers = User.objects.bulk_create(customers)
+        if any(customer.pk is None for customer in customers):
+            customers = list(User.objects.filter(username__startswith=f'loadtest-{run_id}-').exclude(pk=staff.pk))
+        service_point = ServicePoint.objects.create(name=f'Load test {run_id}', creator=staff)
+        self.service_point_id = service_point.id
+        self.staff_cookie = self._cookie(staff)
+        self.customer_cookies = [self._cookie(customer) for customer in customers]
+
+        try:
+            results = asyncio.run(self._run())
+        finally:
+            if not options['keep_data']:
+                service_point.delete()
+                User.objects.filter(pk__in=[customer.pk for customer in customers] + [staff.pk]).delete()
+
+        results['config'] = {
+            key: options[key] for key in (
+                'url', 'customers', 'tellers', 'sockets', 'duration', 'poll_interval', 'service_time',
+                'leave_ratio', 'seed'
+            )
+        }
+        output = options['output'] or f'loadtest-{run_id}.json'
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+        self.stdout.write(
+            f"{'endpoint':<14} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}"
+        )
+        for name, summary in sorted(results['endpoints'].items()):
+            failed = sum(summary['errors'].values()) + sum(
+                count for code, count in summary['statuses'].items() if code.startswith('5')
+            )
+            self.stdout.write(
+                f"{name:<14} {summary['throughput']:>8.1f} {summary.get('p50_ms', 0):>8.1f} "
+                f"{summary.get('p95_ms', 0):>8.1f} {summary.get('p99_ms', 0):>8.1f} {failed:>7}"
+            )
+        sockets = results['sockets']
+        per_connection = sockets['server_kb_per_connection']
+        self.stdout.write(
+            f"sockets: {sockets['connected']} connected, {sockets['failed']} failed, "
+            f"{sockets['messages_per_second']} msg/s received, "
+            f"server memory per connection: {'n/a' if per_connection is None else per_connection} KB"
+        )
+        self.stdout.write(self.style.SUCCESS(f'Results saved to {output}'))
+
+    @staticmethod
+    def _cookie(user):
+        return f'access_token={LoginSerializer.get_token(user).access_token}'
+
+    async def _run(self):
+        options = self.options
+        stats = Stats()
+        stop = asyncio.Event()
+        socket_stats = {'connected': 0, 'failed': 0, 'messages': 0}
+
+        # Sockets first, so memory is measured before the request load starts
+        rss_before = _rss_kb(options['server_pid']) if options['server_pid'] else None
+        opened = []
+        sockets = [
+            asyncio.create_task(self._socket(
+                self.customer_cookies[i % len(self.customer_cookies)] if self.customer_cookies else '',
+                socket_stats, stop, opened
+            ))
+            for i in range(options['sockets'])
+        ]
+        while len(opened) + socket_stats['failed'] < options['sockets']:
+            await asyncio.sleep(0.05)
+        await asyncio.sleep(0.5)
+        rss_after = _rss_kb(options['server_pid']) if options['server_pid'] else None
+
+        started = time.perf_counter()
+        workers = [asyncio.create_task(self._customer(cookie, stats, stop)) for cookie in self.customer_cookies]
+        workers += [asyncio.create_task(self._teller(str(i + 1), stats, stop)) for i in range(options['tellers'])]
+        await asyncio.sleep(options['duration'])
+        stop.set()
+        duration = time.perf_counter() - started
+        await asyncio.gather(*workers, return_exceptions=True)
+        for task in sockets:
+            task.cancel()
+        await asyncio.gather(*sockets, return_exceptions=True)
+
+        endpoints = {
+            name: summarise(
+                stats.latencies.get(name, []), stats.statuses.get(name, {}), stats.errors.get(name, {}), duration
+            )
+            for name in set(stats.latencies) | set(stats.errors)
+        }
+        per_connection = None
+        if rss_before is not None and rss_after is not None and socket_stats['connected']:
+            per_connection = round((rss_after - rss_before) / socket_stats['connected'], 2)
+        return {
+            'started_at': datetime.now().isoformat(timespec='seconds'),
+            'duration': round(duration, 2),
+            'endpoints': endpoints,
+            'sockets': {
+                'connected': socket_stats['connected'],
+                'failed': socket_stats['failed'],
+                'messages': socket_stats['messages'],
+                'messages_per_second': round(socket_stats['messages'] / duration, 2),
+                'server_rss_before_kb': rss_before,
+                'server_rss_after_kb': rss_after,
+                'server_kb_per_connection': per_connection,
+            },
+        }
+
+    async def _customer(self, cookie, stats, stop):
+        options = self.options
+        http = HttpConnection(self.host, self.port, cookie)
+        try:
+            # Spread the first joins over a poll interval
+            await asyncio.sleep(self.random.uniform(0, options['poll_interval']))
+            while not stop.is_set():
+                status, _ = await stats.timed('join', http.request(
+                    'POST', '/api/queues/join/', {'service_point_id': self.service_point_id}
+                ))
+                if status != 200:
+                    await asyncio.sleep(options['poll_interval'])
+                    continue
+                while not stop.is_set():
+                    await asyncio.sleep(options['poll_interval'])
+                    status, body = await stats.timed('my_position', http.request('GET', '/api/queues/my-position/'))
+                    await stats.timed('notifications', http.request('GET', '/api/queues/notifications/'))
+                    if status != 200:
+                        # Served (or gone): come back later
+                        break
+                    entry = json.loads(body)
+                    if entry.get('status') != 'called' and self.random.random() < options['leave_ratio']:
+                        await stats.timed('leave', http.request('POST', '/api/queues/leave/', {}))
+                        break
+                await asyncio.sleep(self.random.uniform(0, options['poll_interval']))
+        finally:
+            http.close()
+
+    async def _teller(self, counter, stats, stop):
+        options = self.options
+        http = HttpConnection(self.host, self.port, self.staff_cookie)
+        try:
+            while not stop.is_set():
+                status, body = await stats.timed('call_next', http.request(
+                    'POST', '/api/queues/call-next/', {'service_point_id': self.service_point_id, 'counter': counter}
+                ))
+                if status != 200:
+                    await asyncio.sleep(options['service_time'])
+                    continue
+                await asyncio.sleep(options['service_time'])
+                await stats.timed('dismiss', http.request(
+                    'POST', '/api/queues/dismiss-customer/', {'queue_entry_id': json.loads(body)['id']}
+                ))
+        finally:
+            http.close()
+
+    async def _socket(self, cookie, socket_stats, stop, opened):
+        path = f'/ws/queues/{self.service_point_id}/'
+        try:
+            reader, writer = await asyncio.open_connection(self.host, self.port)
+            key = base64.b64encode(os.urandom(16)).decode()
+            writer.write((
+                f'GET {path} HTTP/1.1\r\nHost: {self.host}:{self.port}\r\nUpgrade: websocket\r\n'
+                f'Connection: Upgrade\r\nSec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n'
+                f'Cookie: {cookie}\r\n\r\n'
+            ).encode())
+            await writer.drain()
+            handshake = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), 30)
+            if b' 101 ' not in handshake.split(b'\r\n', 1)[0]:
+                raise ConnectionError('handshake refused')
+        except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError, asyncio.LimitOverrunError):
+            socket_stats['failed'] += 1
+            return
+        socket_stats['connected'] += 1
+        opened.append(writer)
+        try:
+            while not stop.is_set():
+                header = await reader.readexactly(2)
+                opcode, length = header[0] & 0x0f, header[1] & 0x7f
+                if length == 126:
+                    length = struct.unpack('>H', await reader.readexactly(2))[0]
+                elif length == 127:
+                    length = struct.unpack('>Q', await reader.readexactly(8))[0]
+                payload = await reader.readexactly(length)
+                if opcode == 0x1:
+                    socket_stats['messages'] += 1
+                elif opcode == 0x9:
+                    # Answer the server's keepalive pings with a masked pong
+                    mask = os.urandom(4)
+                    writer.write(bytes([0x8a, 0x80 | len(payload)]) + mask + bytes(
+                        byte ^ mask[i % 4] for i, byte in enumerate(payload)
+                    ))
+                elif opcode == 0x8:
+                    break
+        except (OSError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from queues import counters
+
+
+class Command(BaseCommand):
+    help = 'Recompute the live queue counters of service points from their queue entries.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'service_point_ids', type=int, nargs='*',
+            help='Only repair these service points (default: all)'
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            fixed = counters.recount(options['service_point_ids'] or None)
+        for service_point in fixed:
+            self.stdout.write(
+                f'{service_point.name} (#{service_point.id}): active={service_point.active_count} '
+                f'waiting={service_point.waiting_count} called={service_point.called_count}'
+            )
+        self.stdout.write(self.style.SUCCESS(f'Repaired {len(fixed)} service point(s).'))
@@ -0,0 +1,48 @@
+from django.db import migrations, models
+
+
+def number_entries(apps, schema_editor):
+    """
+    Give every entry a join-order sequence number within its service point.
+    """
+    QueueEntry = apps.get_model('queues', 'QueueEntry')
+    service_point_ids = QueueEntry.objects.order_by().values_list('service_point_id', flat=True).distinct()
+    for service_point_id in service_point_ids:
+        entries = list(QueueEntry.objects.filter(service_point_id=service_point_id).order_by('id').only('id'))
+        for sequence, entry in enumerate(entries, start=1):
+            entry.sequence = sequence
+        QueueEntry.objects.bulk_update(entries, ['sequence'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('queues', '0008_servicepoint_latitude_servicepoint_longitude'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='queueentry',
+            name='status',
+            field=models.CharField(choices=[('joined', 'Joined'), ('waiting', 'Waiting'), ('called', 'Called'), ('served', 'Served'), ('abandoned', 'Abandoned'), ('paused', 'Paused')], default='joined', max_length=10),
+        ),
+        migrations.RenameField(
+            model_name='queueentry',
+            old_name='position',
+            new_name='sequence',
+        ),
+        migrations.AlterModelOptions(
+            name='queueentry',
+            options={'ordering': ['priority_level', 'sequence']},
+        ),
+        migrations.AlterField(
+            model_name='queueentry',
+            name='sequence',
+            field=models.PositiveIntegerField(help_text='Join order within the service point, never renumbered'),
+        ),
+        migrations.RunPython(number_entries, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='queueentry',
+            index=models.Index(fields=['service_point', 'sequence'], name='queueentry_sp_sequence_idx'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:23
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('queues', '0010_outboxmessage'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['user', '-created_at'], name='notification_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='queueentry',
+            index=models.Index(condition=models.Q(('status__in', ('joined', 'waiting', 'called'))), fields=['service_point', 'status', 'sequence'], name='queueentry_sp_active_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='queueentry',
+            index=models.Index(condition=models.Q(('status__in', ('joined', 'waiting', 'called'))), fields=['user', 'status'], name='queueentry_user_active_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='queueentry',
+            index=models.Index(fields=['user', '-joined_at'], name='queueentry_user_joined_idx'),
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:24
+
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+
+def count_entries(apps, schema_editor):
+    """
+    Initialise the counters from the entries currently in each queue.
+    """
+    ServicePoint = apps.get_model('queues', 'ServicePoint')
+    QueueEntry = apps.get_model('queues', 'QueueEntry')
+    rows = QueueEntry.objects.filter(
+        status__in=('joined', 'waiting', 'called')
+    ).values('service_point_id').annotate(
+        waiting=Count('id', filter=Q(status__in=('joined', 'waiting'))),
+        called=Count('id', filter=Q(status='called')),
+    ).order_by()
+    for row in rows:
+        ServicePoint.objects.filter(pk=row['service_point_id']).update(
+            active_count=row['waiting'] + row['called'],
+            waiting_count=row['waiting'],
+            called_count=row['called'],
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('queues', '0011_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='servicepoint',
+            name='active_count',
+            field=models.PositiveIntegerField(default=0, help_text='Entries joined, waiting or called'),
+        ),
+        migrations.AddField(
+            model_name='servicepoint',
+            name='called_count',
+            field=models.PositiveIntegerField(default=0, help_text='Entries called and not yet served'),
+        ),
+        migrations.AddField(
+            model_name='servicepoint',
+            name='waiting_count',
+            field=models.PositiveIntegerField(default=0, help_text='Entries joined or waiting'),
+        ),
+        migrations.RunPython(count_entries, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:26
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('queues', '0012_servicepoint_counters'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='notification',
+            name='notification_user_created_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='queueentry',
+            name='queueentry_user_joined_idx',
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='notification_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='queueentry',
+            index=models.Index(fields=['user', '-joined_at', '-id'], name='queueentry_user_joined_idx'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:31
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('queues', '0015_emaildelivery'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='queueentry',
+            name='last_eta_threshold',
+            field=models.PositiveSmallIntegerField(blank=True, help_text='Smallest wait-time reminder (minutes) already sent', null=True),
+        ),
+        migrations.AddIndex(
+            model_name='queueentry',
+            index=models.Index(condition=models.Q(('status__in', ('joined', 'waiting'))), fields=['estimated_wait_time'], name='queueentry_eta_idx'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:32
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('queues', '0016_eta_threshold'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ServiceStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('samples', models.PositiveIntegerField(default=0)),
+                ('ewma_seconds', models.FloatField(default=0, help_text='Exponentially weighted mean service time')),
+                ('sketch', models.JSONField(default=dict, help_text='Quantile sketch of service times (see queues.estimator)')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('service_point', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='service_stats', to='queues.servicepoint')),
+                ('service_type', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='service_stats', to='queues.servicetype')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(condition=models.Q(('service_type__isnull', True)), fields=('service_point',), name='servicestats_point_unique'), models.UniqueConstraint(condition=models.Q(('service_type__isnull', False)), fields=('service_point', 'service_type'), name='servicestats_point_type_unique')],
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:35
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('queues', '0017_servicestats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HourlyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.DateTimeField(help_text='Start of the hour')),
+                ('joins', models.PositiveIntegerField(default=0)),
+                ('served', models.PositiveIntegerField(default=0)),
+                ('abandoned', models.PositiveIntegerField(default=0)),
+                ('wait_seconds_sum', models.FloatField(default=0, help_text='Total join-to-served time of entries served this hour')),
+                ('wait_count', models.PositiveIntegerField(default=0)),
+                ('service_point', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='hourly_rollups', to='queues.servicepoint')),
+            ],
+            options={
+                'ordering': ['hour'],
+                'constraints': [models.UniqueConstraint(fields=('service_point', 'hour'), name='hourlyrollup_point_hour_unique')],
+            },
+        ),
+    ]
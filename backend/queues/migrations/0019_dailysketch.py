@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:38
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('queues', '0018_hourlyrollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailySketch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('metric', models.CharField(choices=[('wait', 'Wait (joined to served)'), ('service', 'Service (called to served)')], max_length=10)),
+                ('sketch', models.JSONField(default=dict, help_text='Quantile sketch of durations in seconds (see queues.estimator)')),
+                ('service_point', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_sketches', to='queues.servicepoint')),
+            ],
+            options={
+                'ordering': ['day'],
+                'constraints': [models.UniqueConstraint(fields=('service_point', 'day', 'metric'), name='dailysketch_point_day_metric_unique')],
+            },
+        ),
+    ]
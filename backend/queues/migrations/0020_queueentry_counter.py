@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('queues', '0019_dailysketch'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='queueentry',
+            name='counter',
+            field=models.CharField(blank=True, help_text='Counter the entry was called to', max_length=20),
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:45
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('queues', '0020_queueentry_counter'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TicketCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('last_number', models.PositiveIntegerField(default=0, help_text='Highest ticket number claimed')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='queueentry',
+            name='ticket_day',
+            field=models.DateField(blank=True, help_text='Day the ticket number sequence belongs to', null=True),
+        ),
+        migrations.AddField(
+            model_name='servicepoint',
+            name='ticket_prefix',
+            field=models.CharField(default='A', help_text='Shown before ticket numbers, e.g. A-042', max_length=3),
+        ),
+        migrations.AlterField(
+            model_name='queueentry',
+            name='ticket_number',
+            field=models.CharField(blank=True, max_length=20),
+        ),
+        migrations.AddConstraint(
+            model_name='queueentry',
+            constraint=models.UniqueConstraint(fields=('service_point', 'ticket_day', 'ticket_number'), name='queueentry_ticket_unique'),
+        ),
+        migrations.AddField(
+            model_name='ticketcounter',
+            name='service_point',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ticket_counters', to='queues.servicepoint'),
+        ),
+        migrations.AddConstraint(
+            model_name='ticketcounter',
+            constraint=models.UniqueConstraint(fields=('service_point', 'day'), name='ticketcounter_point_day_unique'),
+        ),
+    ]
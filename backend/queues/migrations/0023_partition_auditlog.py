@@ -0,0 +1,83 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:50
+
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.db import migrations, models
+
+# Partitions created up front for the coming months; afterwards the
+# ensure_audit_partitions task keeps them ahead
+MONTHS_AHEAD = 3
+
+
+def partition_auditlog(apps, schema_editor):
+    """
+    Turn queues_auditlog into a table partitioned by month of timestamp on
+    PostgreSQL, keeping its rows, indexes, foreign keys and id sequence.
+    Other databases keep the plain table.
+    """
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    table, old = 'queues_auditlog', 'queues_auditlog_unpartitioned'
+
+    def month_index(moment):
+        return moment.year * 12 + moment.month - 1
+
+    def month(index):
+        return datetime(index // 12, index % 12 + 1, 1, tzinfo=timezone.utc)
+
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT indexdef FROM pg_indexes WHERE tablename = %s AND indexname <> %s', [table, f'{table}_pkey']
+        )
+        indexes = [row[0] for row in cursor.fetchall()]
+        cursor.execute(
+            "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint WHERE conrelid = %s::regclass AND contype = 'f'",
+            [table]
+        )
+        foreign_keys = cursor.fetchall()
+
+        cursor.execute(f'ALTER TABLE {table} RENAME TO {old}')
+        # The partition key has to be part of the primary key, added below
+        cursor.execute(f'CREATE TABLE {table} (LIKE {old} INCLUDING DEFAULTS) PARTITION BY RANGE ("timestamp")')
+
+        cursor.execute(f'SELECT min("timestamp") FROM {old}')
+        now = datetime.now(timezone.utc)
+        oldest = cursor.fetchone()[0] or now
+        for index in range(month_index(oldest.astimezone(timezone.utc)), month_index(now) + MONTHS_AHEAD + 1):
+            start = month(index)
+            cursor.execute(
+                f'CREATE TABLE {table}_y{start.year}m{start.month:02d} PARTITION OF {table} FOR VALUES FROM (%s) TO (%s)',
+                [start, month(index + 1)]
+            )
+
+        cursor.execute(f'INSERT INTO {table} SELECT * FROM {old}')
+        cursor.execute(f'DROP TABLE {old}')
+
+        cursor.execute(f'ALTER TABLE {table} ADD CONSTRAINT {table}_pkey PRIMARY KEY (id, "timestamp")')
+        # Captured before the rename, so these already name the new table
+        for definition in indexes:
+            cursor.execute(definition)
+        for name, definition in foreign_keys:
+            cursor.execute(f'ALTER TABLE {table} ADD CONSTRAINT {name} {definition}')
+        cursor.execute(f'CREATE SEQUENCE {table}_id_seq OWNED BY {table}.id')
+        cursor.execute(f"SELECT setval('{table}_id_seq', COALESCE(max(id), 0) + 1, false) FROM {table}")
+        cursor.execute(f"ALTER TABLE {table} ALTER COLUMN id SET DEFAULT nextval('{table}_id_seq')")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('queues', '0022_auditlog_event_timestamp'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='auditlog',
+            index=models.Index(fields=['-timestamp'], name='auditlog_timestamp_idx'),
+        ),
+        # A partitioned table behaves like the plain one for every Django
+        # operation, so going back leaves it in place
+        migrations.RunPython(partition_auditlog, migrations.RunPython.noop),
+    ]
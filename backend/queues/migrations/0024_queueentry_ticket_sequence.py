@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('queues', '0023_partition_auditlog'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='queueentry',
+            name='sequence',
+            field=models.PositiveBigIntegerField(help_text='Join order within the service point, never renumbered'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('queues', '0024_queueentry_ticket_sequence'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='outboxmessage',
+            name='kind',
+            field=models.CharField(choices=[('email', 'Email'), ('queue_update', 'Queue Update'), ('group_send', 'Channel Group Message'), ('email_batch', 'Email Batch'), ('notifications', 'Notifications'), ('display_update', 'Display Update')], max_length=20),
+        ),
+    ]
@@ -0,0 +1,22 @@
+from django.db import migrations
+from django.db.models import F
+
+
+def number_entries_by_id(apps, schema_editor):
+    """
+    Give every entry its id as sequence, so entries numbered from ticket
+    numbers keep their place ahead of the ones joining from now on.
+    """
+    QueueEntry = apps.get_model('queues', 'QueueEntry')
+    QueueEntry.objects.update(sequence=F('id'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('queues', '0025_outboxmessage_kinds'),
+    ]
+
+    operations = [
+        migrations.RunPython(number_entries_by_id, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:48
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('queues', '0026_queueentry_sequence_from_id'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DisplayState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.PositiveIntegerField()),
+                ('data', models.JSONField(help_text='Plain display state of this version')),
+                ('snapshot', models.TextField(help_text='Snapshot message of this version, serialized once')),
+                ('deltas', models.JSONField(default=list, help_text='Last [version, message] deltas, oldest first')),
+                ('service_point', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='display_state', to='queues.servicepoint')),
+            ],
+        ),
+    ]
@@ -1,6 +1,11 @@
-from django.db import models
+from django.db import models, transaction
+from django.utils import timezone
+from django.db.models import Q
 from accounts.models import User
-import uuid
+
+# Statuses of entries still holding a place in their queue
+ACTIVE_STATUSES = ('joined', 'waiting', 'called')
+WAITING_STATUSES = ('joined', 'waiting')
 
 
 class Notification(models.Model):
@@ -11,6 +16,9 @@ class Notification(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user', '-created_at', '-id'], name='notification_user_created_idx'),
+        ]
 
     def __str__(self):
         return f"Notification for {self.user.username}: {self.message[:50]}"
@@ -57,6 +65,12 @@ class ServicePoint(models.Model):
     display_screen_url = models.URLField(blank=True, help_text="URL for public display screen")
 
     is_paused = models.BooleanField(default=False)  # New field to pause/resume services at service point
+    ticket_prefix = models.CharField(max_length=3, default='A', help_text="Shown before ticket numbers, e.g. A-042")
+
+    # Live queue counters, maintained by the queue engine (see queues.counters)
+    active_count = models.PositiveIntegerField(default=0, help_text="Entries joined, waiting or called")
+    waiting_count = models.PositiveIntegerField(default=0, help_text="Entries joined or waiting")
+    called_count = models.PositiveIntegerField(default=0, help_text="Entries called and not yet served")
 
     def __str__(self):
         return self.name
@@ -184,11 +198,16 @@ class AuditLog(models.Model):
     description = models.TextField(blank=True)
     ip_address = models.GenericIPAddressField(null=True, blank=True)
     user_agent = models.TextField(blank=True)
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Set when the event happens, not when the batch holding it is written
+    timestamp = models.DateTimeField(default=timezone.now)
     session_id = models.CharField(max_length=100, blank=True)
 
     class Meta:
         ordering = ['-timestamp']
+        # Partitioned by month of timestamp on PostgreSQL (see queues.partitions)
+        indexes = [
+            models.Index(fields=['-timestamp'], name='auditlog_timestamp_idx'),
+        ]
 
     def __str__(self):
         return f"{self.user.username} - {self.action} - {self.resource_type}"
@@ -227,33 +246,271 @@ class QueueEntry(models.Model):
 
     service_point = models.ForeignKey(ServicePoint, on_delete=models.CASCADE, related_name='queue_entries')
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='queue_entries')
-    position = models.PositiveIntegerField()
+    sequence = models.PositiveBigIntegerField(help_text="Join order within the service point, never renumbered")
     status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='joined')
     joined_at = models.DateTimeField(auto_now_add=True)
     called_at = models.DateTimeField(null=True, blank=True)
+    counter = models.CharField(max_length=20, blank=True, help_text="Counter the entry was called to")
     served_at = models.DateTimeField(null=True, blank=True)
     estimated_wait_time = models.DurationField(null=True, blank=True)
+    last_eta_threshold = models.PositiveSmallIntegerField(
+        null=True, blank=True, help_text="Smallest wait-time reminder (minutes) already sent"
+    )
 
     # Government-specific fields
     service_type = models.ForeignKey(ServiceType, on_delete=models.SET_NULL, null=True, blank=True)
     priority_level = models.IntegerField(default=1)
     appointment = models.ForeignKey(Appointment, on_delete=models.SET_NULL, null=True, blank=True)
-    ticket_number = models.CharField(max_length=20, unique=True, blank=True)
+    ticket_number = models.CharField(max_length=20, blank=True)
+    ticket_day = models.DateField(null=True, blank=True, help_text="Day the ticket number sequence belongs to")
     qr_code = models.CharField(max_length=100, blank=True)
     sms_sent = models.BooleanField(default=False)
 
     staff_notes = models.TextField(blank=True)  # New field for staff quick notes
 
     class Meta:
-        ordering = ['priority_level', 'position']
+        ordering = ['priority_level', 'sequence']
+        indexes = [
+            models.Index(fields=['service_point', 'sequence'], name='queueentry_sp_sequence_idx'),
+            # Only entries still in a queue; these stay small as history grows
+            models.Index(
+                fields=['service_point', 'status', 'sequence'],
+                condition=Q(status__in=ACTIVE_STATUSES),
+                name='queueentry_sp_active_idx'
+            ),
+            models.Index(
+                fields=['user', 'status'],
+                condition=Q(status__in=ACTIVE_STATUSES),
+                name='queueentry_user_active_idx'
+            ),
+            models.Index(fields=['user', '-joined_at', '-id'], name='queueentry_user_joined_idx'),
+            models.Index(
+                fields=['estimated_wait_time'],
+                condition=Q(status__in=WAITING_STATUSES),
+                name='queueentry_eta_idx'
+            ),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['service_point', 'ticket_day', 'ticket_number'], name='queueentry_ticket_unique'
+            ),
+        ]
+
+    @property
+    def position(self):
+        """
+        Live position in the queue: the number of active entries of the same
+        service point up to and including this one. ``None`` once the entry
+        has left the queue.
+        """
+        if 'live_position' not in self.__dict__:
+            if self.status not in ACTIVE_STATUSES or self.sequence is None:
+                return None
+            self.live_position = QueueEntry.objects.filter(
+                Q(sequence__lt=self.sequence) | Q(sequence=self.sequence, id__lte=self.id),
+                service_point_id=self.service_point_id,
+                status__in=ACTIVE_STATUSES
+            ).count()
+        return self.live_position
+
+    @position.setter
+    def position(self, value):
+        self.live_position = value
 
     def save(self, *args, **kwargs):
         if not self.ticket_number:
-            # Generate unique ticket number
-            import random
-            import string
-            self.ticket_number = ''.join(random.choices(string.ascii_uppercase + string.digits, k=8))
-        super().save(*args, **kwargs)
+            from .tickets import next_ticket
+
+            self.ticket_number, self.ticket_day = next_ticket(self.service_point)
+        if self.sequence is not None:
+            return super().save(*args, **kwargs)
+        # The queue order follows the entry's id, which the database hands
+        # out in insert order to every process, so joins take no lock shared
+        # with other joins. Ticket numbers come from per-process blocks and
+        # only label entries; they are not in join order across processes.
+        with transaction.atomic():
+            self.sequence = 0
+            super().save(*args, **kwargs)
+            self.sequence = self.pk
+            QueueEntry.objects.filter(pk=self.pk).update(sequence=self.sequence)
+
+    def __str__(self):
+        return f"{self.user.username} - #{self.sequence} at {self.service_point.name} (Ticket: {self.ticket_number})"
+
+
+class OutboxMessage(models.Model):
+    """Side effect recorded in the same transaction as a queue change and delivered by the outbox relay"""
+    KIND_CHOICES = (
+        ('email', 'Email'),
+        ('queue_update', 'Queue Update'),
+        ('group_send', 'Channel Group Message'),
+        ('email_batch', 'Email Batch'),
+        ('notifications', 'Notifications'),
+        ('display_update', 'Display Update'),
+    )
+
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    payload = models.JSONField(default=dict)
+    created_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+
+    class Meta:
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['id'], condition=Q(processed_at__isnull=True), name='outbox_pending_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} #{self.id} ({'processed' if self.processed_at else 'pending'})"
+
+
+class ClosureJob(models.Model):
+    """Background removal of closed service points and their queue history"""
+    STATUS_CHOICES = (
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    )
+
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='closure_jobs')
+    service_point_ids = models.JSONField(default=list)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    entries_closed = models.PositiveIntegerField(default=0, help_text="Active entries abandoned on closure")
+    rows_deleted = models.PositiveIntegerField(default=0, help_text="Queue entries and service points removed so far")
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    error = models.TextField(blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"Closure of {len(self.service_point_ids)} service point(s) - {self.status}"
+
+
+class EmailDelivery(models.Model):
+    """One queued notification email and the outcome of delivering it"""
+    STATUS_CHOICES = (
+        ('pending', 'Pending'),
+        ('sent', 'Sent'),
+        ('failed', 'Failed'),
+    )
+
+    recipient = models.EmailField()
+    subject = models.CharField(max_length=200, default='Queue Notification')
+    message = models.TextField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    provider = models.CharField(max_length=100, blank=True, help_text="Email backend that handled the last attempt")
+    provider_message_id = models.CharField(max_length=200, blank=True)
+    provider_status = models.CharField(max_length=50, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['next_attempt_at', 'id'], condition=Q(status='pending'), name='emaildelivery_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"Email to {self.recipient} ({self.status})"
+
+
+class ServiceStats(models.Model):
+    """Running service-time statistics of a service point, overall or for one service type"""
+    service_point = models.ForeignKey(ServicePoint, on_delete=models.CASCADE, related_name='service_stats')
+    service_type = models.ForeignKey(ServiceType, on_delete=models.CASCADE, null=True, blank=True, related_name='service_stats')
+    samples = models.PositiveIntegerField(default=0)
+    ewma_seconds = models.FloatField(default=0, help_text="Exponentially weighted mean service time")
+    sketch = models.JSONField(default=dict, help_text="Quantile sketch of service times (see queues.estimator)")
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['service_point'], condition=Q(service_type__isnull=True), name='servicestats_point_unique'
+            ),
+            models.UniqueConstraint(
+                fields=['service_point', 'service_type'], condition=Q(service_type__isnull=False),
+                name='servicestats_point_type_unique'
+            ),
+        ]
+
+    def __str__(self):
+        return f"Service stats for {self.service_point_id}/{self.service_type_id or 'all'}: {self.ewma_seconds:.0f}s"
+
+
+class HourlyRollup(models.Model):
+    """Queue activity of a service point during one hour (UTC), maintained by the queue engine"""
+    service_point = models.ForeignKey(ServicePoint, on_delete=models.CASCADE, related_name='hourly_rollups')
+    hour = models.DateTimeField(help_text="Start of the hour")
+    joins = models.PositiveIntegerField(default=0)
+    served = models.PositiveIntegerField(default=0)
+    abandoned = models.PositiveIntegerField(default=0)
+    wait_seconds_sum = models.FloatField(default=0, help_text="Total join-to-served time of entries served this hour")
+    wait_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ['hour']
+        constraints = [
+            models.UniqueConstraint(fields=['service_point', 'hour'], name='hourlyrollup_point_hour_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.service_point_id} @ {self.hour:%Y-%m-%d %H}:00 - {self.joins} joins"
+
+
+class DailySketch(models.Model):
+    """Mergeable quantile sketch of one duration of a service point's served entries during one day"""
+    METRIC_CHOICES = [
+        ('wait', 'Wait (joined to served)'),
+        ('service', 'Service (called to served)'),
+    ]
+
+    service_point = models.ForeignKey(ServicePoint, on_delete=models.CASCADE, related_name='daily_sketches')
+    day = models.DateField()
+    metric = models.CharField(max_length=10, choices=METRIC_CHOICES)
+    sketch = models.JSONField(default=dict, help_text="Quantile sketch of durations in seconds (see queues.estimator)")
+
+    class Meta:
+        ordering = ['day']
+        constraints = [
+            models.UniqueConstraint(fields=['service_point', 'day', 'metric'], name='dailysketch_point_day_metric_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.metric} sketch for {self.service_point_id} on {self.day}"
+
+
+class TicketCounter(models.Model):
+    """Ticket numbers of a service point already claimed for a day, in blocks (see queues.tickets)"""
+    service_point = models.ForeignKey(ServicePoint, on_delete=models.CASCADE, related_name='ticket_counters')
+    day = models.DateField()
+    last_number = models.PositiveIntegerField(default=0, help_text="Highest ticket number claimed")
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['service_point', 'day'], name='ticketcounter_point_day_unique'),
+        ]
+
+    def __str__(self):
+        return f"Tickets of {self.service_point_id} on {self.day}: {self.last_number} claimed"
+
+
+class DisplayState(models.Model):
+    """Display screen state last published for a service point, with the deltas leading to it (see queues.display)"""
+    service_point = models.OneToOneField(ServicePoint, on_delete=models.CASCADE, related_name='display_state')
+    version = models.PositiveIntegerField()
+    data = models.JSONField(help_text="Plain display state of this version")
+    snapshot = models.TextField(help_text="Snapshot message of this version, serialized once")
+    deltas = models.JSONField(default=list, help_text="Last [version, message] deltas, oldest first")
 
     def __str__(self):
-        return f"{self.user.username} - Position {self.position} at {self.service_point.name} (Ticket: {self.ticket_number})"
+        return f"Display of {self.service_point_id} at version {self.version}"
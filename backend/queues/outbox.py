@@ -0,0 +1,173 @@
+"""
+Transactional outbox for queue side effects.
+
+Views record WebSocket messages as ``OutboxMessage`` rows (and emails as
+``EmailDelivery`` rows) in the same transaction as the queue change they
+describe. The ``relay_outbox``
+Celery task then drains pending rows in batches and delivers them, so a
+request never waits on Mailgun or on a channel layer fan-out, and a message
+is only marked processed once it has actually been delivered.
+"""
+import logging
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .mailer import queue_email, queue_emails
+from .models import Notification, OutboxMessage
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue(kind, **payload):
+    """
+    Record a side effect to be delivered once the current transaction commits.
+    """
+    message = OutboxMessage.objects.create(kind=kind, payload=payload)
+    if settings.OUTBOX_RELAY_ON_COMMIT:
+        transaction.on_commit(_kick_relay)
+    return message
+
+
+def enqueue_email(user_email, message):
+    """
+    Record an email; emails have their own outbox, ``EmailDelivery``, sent
+    by the pooled dispatcher in ``queues.mailer``.
+    """
+    return queue_email(user_email, message)
+
+
+def enqueue_email_batch(user_emails, message):
+    """
+    Record the same email to each address in one insert.
+    """
+    return queue_emails(user_emails, message)
+
+
+def enqueue_queue_update(service_point_id):
+    return enqueue('queue_update', service_point_id=service_point_id)
+
+
+def enqueue_group_send(group, message):
+    return enqueue('group_send', group=group, message=message)
+
+
+def enqueue_display_update(service_point_id):
+    return enqueue('display_update', service_point_id=service_point_id)
+
+
+def enqueue_notifications(notifications):
+    """
+    Record that new ``Notification`` rows should be pushed to their users'
+    sockets. One outbox row covers the whole batch.
+    """
+    ids = [notification.id for notification in notifications]
+    if ids:
+        return enqueue('notifications', notification_ids=ids)
+
+
+def _kick_relay():
+    from .tasks import relay_outbox
+
+    try:
+        relay_outbox.delay()
+    except Exception as e:
+        # The periodic relay will pick the messages up
+        logger.warning('Could not schedule outbox relay: %s', e)
+
+
+def _send_email(payload):
+    # Rows written before emails moved to EmailDelivery
+    queue_email(payload['user_email'], payload['message'])
+
+
+def _send_email_batch(payload):
+    queue_emails(payload['user_emails'], payload['message'])
+
+
+def _send_queue_update(payload):
+    from .coalesce import request_queue_update
+
+    request_queue_update(payload['service_point_id'])
+
+
+def _group_send(payload):
+    async_to_sync(get_channel_layer().group_send)(payload['group'], payload['message'])
+
+
+def _send_display_update(payload):
+    from .display import publish
+
+    publish(payload['service_point_id'])
+
+
+def _send_notifications(payload):
+    from .serializers import NotificationSerializer
+
+    channel_layer = get_channel_layer()
+    # Rows deleted in the meantime are simply not pushed
+    notifications = Notification.objects.filter(id__in=payload['notification_ids']).order_by('id')
+    for notification in notifications:
+        async_to_sync(channel_layer.group_send)(
+            f'user_{notification.user_id}',
+            {'type': 'notification', 'data': NotificationSerializer(notification).data}
+        )
+
+
+HANDLERS = {
+    'email': _send_email,
+    'email_batch': _send_email_batch,
+    'queue_update': _send_queue_update,
+    'group_send': _group_send,
+    'notifications': _send_notifications,
+    'display_update': _send_display_update,
+}
+
+
+def relay(batch_size=None):
+    """
+    Deliver one batch of pending messages and return how many were handled.
+
+    Rows are locked with ``SKIP LOCKED`` so several relays can run side by
+    side. A message that fails stays pending with its attempt count raised
+    until ``OUTBOX_MAX_ATTEMPTS`` is reached; if the worker dies mid-batch
+    the transaction rolls back and the whole batch is retried.
+    """
+    batch_size = batch_size or settings.OUTBOX_BATCH_SIZE
+
+    with transaction.atomic():
+        batch = list(
+            OutboxMessage.objects.select_for_update(skip_locked=True).filter(
+                processed_at__isnull=True,
+                attempts__lt=settings.OUTBOX_MAX_ATTEMPTS
+            ).order_by('id')[:batch_size]
+        )
+
+        now = timezone.now()
+        delivered_updates = set()
+        for message in batch:
+            if message.kind == 'queue_update':
+                # One broadcast per service point covers every update in the batch
+                service_point_id = message.payload['service_point_id']
+                if service_point_id in delivered_updates:
+                    message.processed_at = now
+                    continue
+            try:
+                # A failed handler only rolls back its own writes
+                with transaction.atomic():
+                    HANDLERS[message.kind](message.payload)
+            except Exception as e:
+                message.attempts += 1
+                message.last_error = str(e)
+                continue
+            message.attempts += 1
+            message.processed_at = now
+            if message.kind == 'queue_update':
+                delivered_updates.add(message.payload['service_point_id'])
+
+        OutboxMessage.objects.bulk_update(batch, ['processed_at', 'attempts', 'last_error'])
+
+    return len(batch)
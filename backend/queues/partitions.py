@@ -0,0 +1,199 @@
+"""
+Monthly storage of the audit log.
+
+On PostgreSQL ``queues_auditlog`` is a declaratively partitioned table with
+one partition per calendar month (UTC) of ``timestamp``, created ahead of
+time by ``ensure_partitions``. Queries filtered on ``timestamp`` are pruned
+to the partitions they cover, so recent audit ranges never read old months,
+and retiring a month is a metadata operation instead of a mass ``DELETE``.
+Other databases keep a plain table, where the same calls work row by row.
+
+``archive`` streams every month older than the cutoff to a gzip compressed
+JSON Lines file and then drops the month (or deletes its rows on the plain
+table fallback).
+"""
+import gzip
+import json
+import os
+import re
+from datetime import datetime, timezone as dt_timezone
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import AuditLog
+
+TABLE = AuditLog._meta.db_table
+PARTITION_NAME = re.compile(rf'^{TABLE}_y(\d{{4}})m(\d{{2}})$')
+ARCHIVE_FIELDS = (
+    'id', 'user_id', 'action', 'resource_type', 'resource_id', 'description', 'ip_address',
+    'user_agent', 'timestamp', 'session_id',
+)
+
+
+def month_start(moment):
+    moment = moment.astimezone(dt_timezone.utc)
+    return datetime(moment.year, moment.month, 1, tzinfo=dt_timezone.utc)
+
+
+def add_months(start, months):
+    index = start.year * 12 + start.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1, tzinfo=dt_timezone.utc)
+
+
+def partition_name(start):
+    return f'{TABLE}_y{start.year}m{start.month:02d}'
+
+
+def is_partitioned():
+    """
+    Whether the audit log table is partitioned in this database.
+    """
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid WHERE c.relname = %s',
+            [TABLE]
+        )
+        return cursor.fetchone() is not None
+
+
+def partitions():
+    """
+    Return the start of the month of every existing partition, oldest first.
+    """
+    if not is_partitioned():
+        return []
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid '
+            'JOIN pg_class p ON p.oid = i.inhparent WHERE p.relname = %s',
+            [TABLE]
+        )
+        names = [row[0] for row in cursor.fetchall()]
+    months = []
+    for name in names:
+        match = PARTITION_NAME.match(name)
+        if match:
+            months.append(datetime(int(match[1]), int(match[2]), 1, tzinfo=dt_timezone.utc))
+    return sorted(months)
+
+
+def ensure_partitions(since=None, ahead=None):
+    """
+    Create the monthly partitions from the month of ``since`` (default: now)
+    up to ``ahead`` months in the future. Returns the names created; does
+    nothing on a plain table.
+    """
+    if not is_partitioned():
+        return []
+    ahead = settings.AUDIT_PARTITIONS_AHEAD if ahead is None else ahead
+    now = timezone.now()
+    month = month_start(since or now)
+    last = add_months(month_start(now), ahead)
+    existing = set(partitions())
+    created = []
+    with connection.cursor() as cursor:
+        while month <= last:
+            if month not in existing:
+                name = partition_name(month)
+                cursor.execute(
+                    f'CREATE TABLE IF NOT EXISTS "{name}" PARTITION OF "{TABLE}" FOR VALUES FROM (%s) TO (%s)',
+                    [month, add_months(month, 1)]
+                )
+                created.append(name)
+            month = add_months(month, 1)
+    return created
+
+
+def retention_cutoff(now=None):
+    """
+    Start of the oldest month kept online by the retention policy: the
+    current month plus ``AUDIT_RETENTION_MONTHS`` before it.
+    """
+    return add_months(month_start(now or timezone.now()), -settings.AUDIT_RETENTION_MONTHS)
+
+
+def months_before(cutoff):
+    """
+    Months holding audit rows (or partitions) that end on or before ``cutoff``.
+    """
+    if is_partitioned():
+        return [month for month in partitions() if add_months(month, 1) <= cutoff]
+    oldest = AuditLog.objects.filter(timestamp__lt=cutoff).order_by('timestamp').values_list('timestamp', flat=True).first()
+    months = []
+    month = month_start(oldest) if oldest else cutoff
+    while add_months(month, 1) <= cutoff:
+        months.append(month)
+        month = add_months(month, 1)
+    return months
+
+
+def export_month(month, directory):
+    """
+    Stream the rows of one month to ``<directory>/auditlog-YYYY-MM.jsonl.gz``
+    and return ``(rows, path)``. The file only appears once complete.
+    """
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    path = directory / f'auditlog-{month:%Y-%m}.jsonl.gz'
+    partial = path.with_name(path.name + '.partial')
+    rows = AuditLog.objects.filter(
+        timestamp__gte=month, timestamp__lt=add_months(month, 1)
+    ).order_by().values_list(*ARCHIVE_FIELDS)
+
+    count = 0
+    with open(partial, 'wb') as raw:
+        with gzip.GzipFile(fileobj=raw, mode='wb') as archive:
+            for row in rows.iterator(chunk_size=2000):
+                record = dict(zip(ARCHIVE_FIELDS, row))
+                record['timestamp'] = record['timestamp'].isoformat()
+                archive.write(json.dumps(record, separators=(',', ':')).encode() + b'\n')
+                count += 1
+        raw.flush()
+        os.fsync(raw.fileno())
+    os.replace(partial, path)
+    return count, path
+
+
+def drop_month(month, chunk_size=5000):
+    """
+    Remove one month from the audit log: detach and drop its partition, or
+    delete its rows in chunks on a plain table.
+    """
+    if is_partitioned():
+        name = partition_name(month)
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f'ALTER TABLE "{TABLE}" DETACH PARTITION "{name}"')
+            cursor.execute(f'DROP TABLE "{name}"')
+        return
+    rows = AuditLog.objects.filter(timestamp__gte=month, timestamp__lt=add_months(month, 1))
+    while True:
+        with transaction.atomic():
+            chunk = list(rows.order_by('id').values_list('id', flat=True)[:chunk_size])
+            if not chunk:
+                break
+            AuditLog.objects.filter(pk__in=chunk).delete()
+
+
+def archive(cutoff=None, directory=None, dry_run=False):
+    """
+    Archive and drop every month before ``cutoff`` (default: the retention
+    cutoff). Returns ``(month, rows, path)`` for each month; with
+    ``dry_run`` nothing is written or dropped and ``path`` is ``None``.
+    """
+    cutoff = cutoff or retention_cutoff()
+    directory = directory or settings.AUDIT_ARCHIVE_DIR
+    archived = []
+    for month in months_before(cutoff):
+        if dry_run:
+            rows = AuditLog.objects.filter(timestamp__gte=month, timestamp__lt=add_months(month, 1)).count()
+            archived.append((month, rows, None))
+            continue
+        rows, path = export_month(month, directory)
+        drop_month(month)
+        archived.append((month, rows, path))
+    return archived
@@ -0,0 +1,117 @@
+"""
+Registry of who is connected to which service point.
+
+Every open ``QueueConsumer`` of an authenticated user is registered under its
+service point with an expiry ``PRESENCE_TTL`` seconds ahead, renewed by the
+client's heartbeats. Sockets that vanish without disconnecting (a killed
+worker, a dropped network) therefore fall out of the registry on their own.
+
+With ``PRESENCE_REDIS_URL`` set the registry is a Redis sorted set per
+service point, scored by expiry, shared by every worker; otherwise it lives
+in the current process.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+try:
+    import redis
+except ImportError:  # pragma: no cover - optional dependency
+    redis = None
+
+
+def _member(user_id, channel_name):
+    return f'{user_id}|{channel_name}'
+
+
+def _user_id(member):
+    return int(member.split('|', 1)[0])
+
+
+class InMemoryPresence:
+    """
+    Presence kept in this process; for tests and single worker setups.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._points = {}
+
+    def touch(self, service_point_id, user_id, channel_name, ttl=None):
+        expires = time.time() + (ttl or settings.PRESENCE_TTL)
+        with self._lock:
+            self._points.setdefault(str(service_point_id), {})[_member(user_id, channel_name)] = expires
+
+    def leave(self, service_point_id, user_id, channel_name):
+        with self._lock:
+            members = self._points.get(str(service_point_id), {})
+            members.pop(_member(user_id, channel_name), None)
+            if not members:
+                self._points.pop(str(service_point_id), None)
+
+    def connected(self, service_point_id):
+        now = time.time()
+        with self._lock:
+            members = self._points.get(str(service_point_id), {})
+            for member in [member for member, expires in members.items() if expires <= now]:
+                del members[member]
+            return sorted({_user_id(member) for member in members})
+
+
+class RedisPresence:
+    """
+    Presence in Redis sorted sets, one per service point, scored by expiry.
+    """
+
+    def __init__(self, url=None, prefix=None):
+        if redis is None:
+            raise ImproperlyConfigured('RedisPresence requires the "redis" package.')
+        self.client = redis.Redis.from_url(url or settings.PRESENCE_REDIS_URL, decode_responses=True)
+        self.prefix = prefix or settings.QUEUE_ENGINE_KEY_PREFIX
+
+    def _key(self, service_point_id):
+        return f'{self.prefix}:presence:{service_point_id}'
+
+    def touch(self, service_point_id, user_id, channel_name, ttl=None):
+        ttl = ttl or settings.PRESENCE_TTL
+        key = self._key(service_point_id)
+        pipe = self.client.pipeline()
+        pipe.zadd(key, {_member(user_id, channel_name): time.time() + ttl})
+        # The set itself goes once nobody has sent a heartbeat for a while
+        pipe.expire(key, ttl * 2)
+        pipe.execute()
+
+    def leave(self, service_point_id, user_id, channel_name):
+        self.client.zrem(self._key(service_point_id), _member(user_id, channel_name))
+
+    def connected(self, service_point_id):
+        key = self._key(service_point_id)
+        pipe = self.client.pipeline()
+        pipe.zremrangebyscore(key, '-inf', time.time())
+        pipe.zrange(key, 0, -1)
+        _, members = pipe.execute()
+        return sorted({_user_id(member) for member in members})
+
+
+_presence = None
+
+
+def get_presence():
+    """
+    Return the process-wide presence registry.
+    """
+    global _presence
+    if _presence is None:
+        _presence = RedisPresence() if settings.PRESENCE_REDIS_URL else InMemoryPresence()
+    return _presence
+
+
+@receiver(setting_changed)
+def _reset_presence(setting, **kwargs):
+    global _presence
+    if setting.startswith('PRESENCE'):
+        _presence = None
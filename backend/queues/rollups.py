@@ -0,0 +1,158 @@
+"""
+Hourly analytics rollups.
+
+Each queue transition adds to the ``HourlyRollup`` row of its service point
+and hour: joins when an entry is created, served (with its join-to-served
+wait) and abandoned when it leaves the queue. ``analytics`` then sums at
+most one row per service point and hour instead of scanning every entry
+ever made.
+
+Wait and service durations of served entries also go into one
+``DailySketch`` per service point, day and metric. The sketches merge
+exactly, so percentiles for any date range and set of service points come
+from combining a few rows. ``backfill_rollups`` rebuilds both tables from
+``QueueEntry``.
+"""
+from datetime import timezone as dt_timezone
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .estimator import QuantileSketch
+from .models import DailySketch, HourlyRollup
+
+PERCENTILES = (50, 90, 99)
+
+
+def hour_of(moment):
+    """
+    Start of the UTC hour containing ``moment``.
+    """
+    return moment.astimezone(dt_timezone.utc).replace(minute=0, second=0, microsecond=0)
+
+
+def record(service_point_id, moment, **counts):
+    """
+    Add ``counts`` (e.g. ``joins=1``) to the rollup of the hour containing
+    ``moment`` once the current transaction commits, creating the row on
+    first use.
+    """
+    # Every join of the hour writes this row; doing it after commit keeps
+    # the row lock out of the joins' transactions
+    transaction.on_commit(lambda: _add(service_point_id, hour_of(moment), counts))
+
+
+def _add(service_point_id, hour, counts):
+    rollups = HourlyRollup.objects.filter(service_point_id=service_point_id, hour=hour)
+    increments = {field: F(field) + value for field, value in counts.items()}
+    if rollups.update(**increments):
+        return
+    try:
+        with transaction.atomic():
+            HourlyRollup.objects.create(service_point_id=service_point_id, hour=hour, **counts)
+    except IntegrityError:
+        # Created concurrently since the update above
+        rollups.update(**increments)
+
+
+def durations(joined_at, called_at, served_at):
+    """
+    Return ``(metric, seconds)`` pairs of a served entry.
+    """
+    pairs = [('wait', max((served_at - joined_at).total_seconds(), 0))]
+    if called_at is not None:
+        pairs.append(('service', max((served_at - called_at).total_seconds(), 0)))
+    return pairs
+
+
+def record_served(queue_entry):
+    """
+    Count a served entry in its hour and add its durations to the day's
+    sketches once the transaction that marks the entry served commits.
+    """
+    pairs = durations(queue_entry.joined_at, queue_entry.called_at, queue_entry.served_at)
+    record(
+        queue_entry.service_point_id, queue_entry.served_at,
+        served=1, wait_seconds_sum=pairs[0][1], wait_count=1
+    )
+    day = timezone.localdate(queue_entry.served_at)
+    # Every dismiss of the day rewrites these rows, so their locks are kept
+    # out of the dismiss transactions like the hourly rollup's
+    transaction.on_commit(lambda: _add_durations(queue_entry.service_point_id, day, pairs))
+
+
+def _add_durations(service_point_id, day, pairs):
+    with transaction.atomic():
+        for metric, seconds in pairs:
+            daily, _ = DailySketch.objects.select_for_update().get_or_create(
+                service_point_id=service_point_id, day=day, metric=metric
+            )
+            sketch = QuantileSketch.from_dict(daily.sketch)
+            sketch.add(seconds)
+            daily.sketch = sketch.to_dict()
+            daily.save(update_fields=['sketch'])
+
+
+def percentiles(sketches, metric, points=PERCENTILES):
+    """
+    Merge the ``metric`` sketches of a ``DailySketch`` queryset and return
+    ``{'p50': seconds, ...}``, with ``None`` values when nothing was served.
+    """
+    merged = QuantileSketch()
+    for data in sketches.filter(metric=metric).values_list('sketch', flat=True):
+        merged.merge(QuantileSketch.from_dict(data))
+    return {f'p{p}': merged.quantile(p / 100) for p in points}
+
+
+def backfill(service_point_ids=None):
+    """
+    Rebuild the rollups and daily sketches from queue entries and return
+    how many rows were written.
+
+    Entries do not record when they were abandoned, so backfilled
+    abandonments are counted in the hour the entry joined.
+    """
+    from .models import QueueEntry
+
+    entries = QueueEntry.objects.all()
+    rollups = HourlyRollup.objects.all()
+    sketches = DailySketch.objects.all()
+    if service_point_ids is not None:
+        entries = entries.filter(service_point_id__in=service_point_ids)
+        rollups = rollups.filter(service_point_id__in=service_point_ids)
+        sketches = sketches.filter(service_point_id__in=service_point_ids)
+
+    rows = {}
+    daily = {}
+
+    def row(service_point_id, moment):
+        key = (service_point_id, hour_of(moment))
+        if key not in rows:
+            rows[key] = HourlyRollup(service_point_id=key[0], hour=key[1])
+        return rows[key]
+
+    values = entries.order_by().values_list('service_point_id', 'status', 'joined_at', 'called_at', 'served_at')
+    for service_point_id, status, joined_at, called_at, served_at in values.iterator(chunk_size=2000):
+        row(service_point_id, joined_at).joins += 1
+        if status == 'abandoned':
+            row(service_point_id, joined_at).abandoned += 1
+        elif status == 'served' and served_at is not None:
+            pairs = durations(joined_at, called_at, served_at)
+            rollup = row(service_point_id, served_at)
+            rollup.served += 1
+            rollup.wait_seconds_sum += pairs[0][1]
+            rollup.wait_count += 1
+            day = timezone.localdate(served_at)
+            for metric, seconds in pairs:
+                daily.setdefault((service_point_id, day, metric), QuantileSketch()).add(seconds)
+
+    with transaction.atomic():
+        rollups.delete()
+        sketches.delete()
+        HourlyRollup.objects.bulk_create(rows.values(), batch_size=1000)
+        DailySketch.objects.bulk_create([
+            DailySketch(service_point_id=service_point_id, day=day, metric=metric, sketch=sketch.to_dict())
+            for (service_point_id, day, metric), sketch in daily.items()
+        ], batch_size=1000)
+    return len(rows) + len(daily)
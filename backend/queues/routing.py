@@ -1,6 +1,12 @@
-from django.urls import re_path
+from django.urls import path, re_path
 from . import consumers
 
 websocket_urlpatterns = [
     re_path(r'ws/queues/(?P<service_point_id>\w+)/$', consumers.QueueConsumer.as_asgi()),
+    path('ws/display/<int:service_point_id>/', consumers.DisplayConsumer.as_asgi()),
+]
+
+# Long-lived HTTP streams, served by the ASGI worker ahead of Django
+http_urlpatterns = [
+    path('events/display/<int:service_point_id>/', consumers.DisplayEventsConsumer.as_asgi()),
 ]
@@ -2,7 +2,7 @@ from rest_framework import serializers
 from .models import (
     ServicePoint, QueueEntry, Notification, ServiceType,
     Appointment, Feedback, Announcement, DocumentCheck,
-    AuditLog, PriorityQueue
+    AuditLog, PriorityQueue, ClosureJob
 )
 from accounts.models import User
 from django.utils import timezone
@@ -24,16 +24,19 @@ class ServicePointSerializer(serializers.ModelSerializer):
             'id', 'name', 'description', 'bank_name', 'branch', 'location', 'latitude', 'longitude',
             'directions', 'teller_no', 'map_url', 'is_active', 'created_at', 'queue_length',
             'organization_type', 'service_types', 'supports_appointments', 'supports_priority',
-            'max_queue_length', 'display_screen_url', 'is_paused'
+            'max_queue_length', 'display_screen_url', 'is_paused', 'ticket_prefix',
+            'active_count', 'waiting_count', 'called_count'
         )
-        read_only_fields = ('created_at', 'queue_length')
+        read_only_fields = ('created_at', 'queue_length', 'active_count', 'waiting_count', 'called_count')
 
     def get_queue_length(self, obj):
-        return obj.queue_entries.filter(status__in=['joined', 'waiting', 'called']).count()
+        # Denormalised counter kept up to date by the queue engine
+        return obj.active_count
 
 
 class QueueEntrySerializer(serializers.ModelSerializer):
     service_point = ServicePointSerializer(read_only=True)
+    eta_seconds = serializers.SerializerMethodField()
     user = serializers.StringRelatedField()  # Just username
     service_type = ServiceTypeSerializer(read_only=True)
 
@@ -41,10 +44,15 @@ class QueueEntrySerializer(serializers.ModelSerializer):
         model = QueueEntry
         fields = (
             'id', 'service_point', 'user', 'position', 'status', 'joined_at',
-            'called_at', 'served_at', 'estimated_wait_time', 'service_type',
+            'called_at', 'counter', 'served_at', 'estimated_wait_time', 'eta_seconds', 'service_type',
             'priority_level', 'appointment', 'ticket_number', 'qr_code', 'sms_sent'
         )
-        read_only_fields = ('position', 'status', 'joined_at', 'called_at', 'served_at', 'estimated_wait_time', 'ticket_number', 'qr_code')
+        read_only_fields = ('position', 'status', 'joined_at', 'called_at', 'counter', 'served_at', 'estimated_wait_time', 'ticket_number', 'qr_code')
+
+    def get_eta_seconds(self, obj):
+        if obj.estimated_wait_time is None:
+            return None
+        return round(obj.estimated_wait_time.total_seconds())
 
 
 class JoinQueueSerializer(serializers.Serializer):
@@ -152,3 +160,13 @@ class CreateAppointmentSerializer(serializers.Serializer):
 class QRCodeSerializer(serializers.Serializer):
     data = serializers.CharField()
     size = serializers.IntegerField(default=200, min_value=100, max_value=500)
+
+
+class ClosureJobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ClosureJob
+        fields = (
+            'id', 'service_point_ids', 'status', 'entries_closed', 'rows_deleted',
+            'created_at', 'started_at', 'finished_at', 'error'
+        )
+        read_only_fields = fields
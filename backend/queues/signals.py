@@ -0,0 +1,24 @@
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+
+from .caching import invalidate_public_listing
+from .models import Announcement, ServicePoint
+from .outbox import enqueue_display_update
+
+
+@receiver(post_save, sender=ServicePoint)
+@receiver(post_delete, sender=ServicePoint)
+def service_point_changed(sender, **kwargs):
+    invalidate_public_listing()
+
+
+@receiver(m2m_changed, sender=ServicePoint.service_types.through)
+def service_point_types_changed(sender, **kwargs):
+    invalidate_public_listing()
+
+
+@receiver(post_save, sender=Announcement)
+@receiver(post_delete, sender=Announcement)
+def announcement_changed(sender, instance, **kwargs):
+    # Display screens show the active announcements
+    enqueue_display_update(instance.service_point_id)
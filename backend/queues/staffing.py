@@ -0,0 +1,135 @@
+"""
+Counter staffing forecasts from queue history.
+
+The history of a service point is read in one query as plain timestamps and
+folded with NumPy into per-hour-of-week profiles: the mean arrival rate
+(``joined_at``) and mean service time (``called_at`` to ``served_at``) of
+each of the 168 hours of a week. For every hour the Erlang C model of an
+M/M/c queue then gives the fewest counters whose mean wait stays within the
+target. The Erlang C search runs once per counter count over all 168 hours
+at the same time.
+"""
+from datetime import datetime, timedelta
+
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+
+from .models import QueueEntry
+
+HOURS_PER_WEEK = 7 * 24
+# Upper bound of the counter search; hours that need more report this many
+MAX_COUNTERS = 100
+# Longest history a forecast reads, ten years
+MAX_WEEKS = 520
+
+
+def _epochs(moments):
+    return np.fromiter((moment.timestamp() for moment in moments), dtype=float, count=len(moments))
+
+
+def hour_of_week(epochs):
+    """
+    Return the local hour of the week (0 = Monday 00:00) of each timestamp.
+    The timezone is only consulted once per distinct hour.
+    """
+    hours, inverse = np.unique((epochs // 3600).astype(np.int64), return_inverse=True)
+    tz = timezone.get_current_timezone()
+    local = [datetime.fromtimestamp(hour * 3600, tz) for hour in hours.tolist()]
+    return np.array([moment.weekday() * 24 + moment.hour for moment in local], dtype=np.int64)[inverse]
+
+
+def profiles(service_point_id, weeks=None, now=None):
+    """
+    Return ``(arrivals_per_hour, service_seconds)``, two arrays of 168
+    values indexed by hour of the week, built from the last ``weeks`` weeks
+    of history.
+    """
+    weeks = weeks or settings.STAFFING_HISTORY_WEEKS
+    now = now or timezone.now()
+    rows = list(QueueEntry.objects.filter(
+        service_point_id=service_point_id,
+        joined_at__gte=now - timedelta(weeks=weeks),
+        joined_at__lte=now
+    ).order_by().values_list('joined_at', 'called_at', 'served_at'))
+
+    default_service = settings.DEFAULT_SERVICE_DURATION * 60.0
+    if not rows:
+        return np.zeros(HOURS_PER_WEEK), np.full(HOURS_PER_WEEK, default_service)
+
+    joined_at, called_at, served_at = zip(*rows)
+    joined = _epochs(joined_at)
+    arrivals = np.bincount(hour_of_week(joined), minlength=HOURS_PER_WEEK)
+    # How often each hour of the week occurred since the first arrival
+    observed_hours = np.arange(joined.min() // 3600, now.timestamp() // 3600 + 1) * 3600
+    occurrences = np.bincount(hour_of_week(observed_hours), minlength=HOURS_PER_WEEK)
+    arrival_rate = arrivals / np.maximum(occurrences, 1)
+
+    served = [(called, done) for called, done in zip(called_at, served_at) if called and done]
+    service = np.full(HOURS_PER_WEEK, default_service)
+    if served:
+        started = _epochs([called for called, _ in served])
+        durations = _epochs([done for _, done in served]) - started
+        valid = durations > 0
+        buckets = hour_of_week(started[valid])
+        counts = np.bincount(buckets, minlength=HOURS_PER_WEEK)
+        totals = np.bincount(buckets, weights=durations[valid], minlength=HOURS_PER_WEEK)
+        if counts.any():
+            # Hours without services fall back to the overall mean
+            service[:] = totals.sum() / counts.sum()
+            service = np.where(counts > 0, totals / np.maximum(counts, 1), service)
+    return arrival_rate, service
+
+
+def required_counters(arrival_rate, service_seconds, target_wait_seconds, max_counters=MAX_COUNTERS):
+    """
+    Return ``(counters, mean_wait_seconds)`` arrays: for each hour, the
+    fewest counters whose Erlang C mean wait is within the target, and that
+    wait.
+    """
+    arrival_rate = np.asarray(arrival_rate, dtype=float)
+    service_seconds = np.asarray(service_seconds, dtype=float)
+    # Offered load in Erlangs
+    load = arrival_rate * service_seconds / 3600
+
+    counters = np.zeros(load.shape, dtype=np.int64)
+    waits = np.zeros(load.shape)
+    pending = load > 0
+    # Erlang B by its recurrence, then Erlang C from it
+    erlang_b = np.ones(load.shape)
+    for c in range(1, max_counters + 1):
+        if not pending.any():
+            break
+        erlang_b = load * erlang_b / (c + load * erlang_b)
+        stable = c > load
+        with np.errstate(divide='ignore', invalid='ignore'):
+            erlang_c = np.where(stable, c * erlang_b / (c - load * (1 - erlang_b)), 1.0)
+            wait = np.where(stable, erlang_c * service_seconds / (c - load), np.inf)
+        done = pending & (wait <= target_wait_seconds)
+        counters[done] = c
+        waits[done] = wait[done]
+        counters[pending & ~done] = c
+        waits[pending & ~done] = wait[pending & ~done]
+        pending &= ~done
+    return counters, waits
+
+
+def forecast(service_point_id, target_wait=None, weeks=None, now=None):
+    """
+    Return the staffing forecast of a service point: one dict per hour of
+    the week, Monday 00:00 first. ``target_wait`` is in minutes.
+    """
+    target_wait = settings.STAFFING_TARGET_WAIT if target_wait is None else target_wait
+    arrival_rate, service = profiles(service_point_id, weeks, now)
+    counters, waits = required_counters(arrival_rate, service, target_wait * 60)
+    return [
+        {
+            'weekday': how // 24,
+            'hour': how % 24,
+            'arrivals_per_hour': round(float(arrival_rate[how]), 2),
+            'mean_service_minutes': round(float(service[how]) / 60, 2),
+            'counters': int(counters[how]),
+            'expected_wait_minutes': round(float(waits[how]) / 60, 2) if np.isfinite(waits[how]) else None,
+        }
+        for how in range(HOURS_PER_WEEK)
+    ]
@@ -1,115 +1,132 @@
+import logging
+
 from celery import shared_task
-from django.utils import timezone
-from datetime import timedelta
-from .models import QueueEntry, Notification
-from .utils import send_queue_notification_email
+from django.conf import settings
+from .models import QueueEntry
+
+logger = logging.getLogger(__name__)
 
 
 @shared_task
 def send_queue_update(service_point_id):
     """
-    Task to send queue update notifications to joined users only.
+    Task to broadcast the current queue order to everyone watching a service
+    point. A single message goes to the ``queue_<id>`` group and each
+    QueueConsumer filters it for its own user. Errors propagate, so the
+    outbox relay keeps a failed broadcast pending and retries it.
     """
     from channels.layers import get_channel_layer
     from asgiref.sync import async_to_sync
-    from django.core.cache import cache
-    from .models import QueueEntry
+    from .broadcast import next_queue_version, queue_update_message
+    from .display import publish as publish_display
+    from .engine import get_queue_engine, ACTIVE_STATUSES
+    from .eta import refresh_etas
+    from .estimator import queue_etas
+
+    channel_layer = get_channel_layer()
+    positions = get_queue_engine().positions(service_point_id)
+    etas = queue_etas(service_point_id, positions)
+    refresh_etas(service_point_id, positions, etas)
+
+    # Owners of the active entries (joined, waiting or called)
+    users = dict(QueueEntry.objects.filter(
+        service_point_id=service_point_id,
+        status__in=ACTIVE_STATUSES
+    ).values_list('id', 'user_id'))
+
+    ordered_entries = [
+        (entry_id, users.get(entry_id), round(etas[entry_id].total_seconds()) if entry_id in etas else None)
+        for entry_id in sorted(positions, key=positions.get)
+    ]
+    async_to_sync(channel_layer.group_send)(
+        f'queue_{service_point_id}',
+        queue_update_message(service_point_id, ordered_entries, next_queue_version(service_point_id))
+    )
+    publish_display(service_point_id)
+
+
+@shared_task(bind=True, max_retries=3)
+def flush_queue_update(self, service_point_id):
+    """
+    Task ending the coalescing window of a service point: broadcast once it
+    is due, otherwise run again when it will be.
+    """
+    from .coalesce import close, due_in, note_update
 
+    delay = due_in(service_point_id)
+    if delay is None:
+        return
+    if delay > 0:
+        flush_queue_update.apply_async((service_point_id,), countdown=delay)
+        return
+    close(service_point_id)
     try:
-        channel_layer = get_channel_layer()
-
-        # Get joined users (joined, waiting or called)
-        joined_entries = QueueEntry.objects.filter(
-            service_point_id=service_point_id,
-            status__in=['joined', 'waiting', 'called']
-        ).select_related('user')
-
-        # Send position updates to each joined user individually
-        for entry in joined_entries:
-            cache_key = f'queue_channel_{service_point_id}_{entry.user.id}'
-            channel_name = cache.get(cache_key)
-            if channel_name:
-                async_to_sync(channel_layer.send)(
-                    channel_name,
-                    {
-                        'type': 'queue_update',
-                        'data': {
-                            'position': entry.position,
-                            'service_point_id': service_point_id
-                        }
-                    }
-                )
+        send_queue_update(service_point_id)
     except Exception as e:
-        # Log the error but don't fail the task
-        print(f"Error sending queue update: {e}")
+        logger.warning('Queue update of service point %s failed: %s', service_point_id, e)
+        # Reopen the window so the retry still finds the broadcast due
+        note_update(service_point_id)
+        raise self.retry(exc=e, countdown=settings.QUEUE_UPDATE_WINDOW / 1000)
+
+
+@shared_task
+def relay_outbox(max_batches=10):
+    """
+    Task delivering pending outbox messages (emails, queue updates, channel
+    messages) in batches.
+    """
+    from django.conf import settings
+    from .outbox import relay
+
+    for _ in range(max_batches):
+        if relay() < settings.OUTBOX_BATCH_SIZE:
+            break
+
+
+@shared_task
+def dispatch_emails(max_batches=10):
+    """
+    Task sending due notification emails in pooled batches.
+    """
+    from django.conf import settings
+    from .mailer import dispatch
+
+    for _ in range(max_batches):
+        if dispatch() < settings.EMAIL_DISPATCH_BATCH_SIZE:
+            break
+
+
+@shared_task
+def run_closure_job(job_id):
+    """
+    Task deleting closed service points and their queue history in chunks.
+    """
+    from .closure import run_job
+
+    run_job(job_id)
 
 
 @shared_task
 def send_wait_time_notifications():
     """
-    Periodic task to send notifications based on estimated wait time.
+    Periodic safety sweep for wait-time reminders. Reminders are normally
+    sent as queue updates are broadcast; this only revisits service points
+    with an entry inside a threshold it was not reminded of.
+    """
+    from .eta import due_service_points, refresh_etas
+
+    for service_point_id in list(due_service_points()):
+        try:
+            refresh_etas(service_point_id)
+        except Exception:
+            logger.exception('Wait time notifications of service point %s failed', service_point_id)
+
+
+@shared_task
+def ensure_audit_partitions():
+    """
+    Create the audit log partitions of the coming months.
     """
-    now = timezone.now()
-
-    # Send notifications for 15 minutes remaining
-    fifteen_min_entries = QueueEntry.objects.filter(
-        status='waiting',
-        estimated_wait_time__lte=timedelta(minutes=15),
-        estimated_wait_time__gt=timedelta(minutes=10)
-    ).exclude(
-        # Don't send if already sent in last hour
-        user__notification__message__icontains='15 minutes',
-        user__notification__created_at__gte=now - timedelta(hours=1)
-    ).select_related('user')
-
-    for entry in fifteen_min_entries:
-        Notification.objects.create(
-            user=entry.user,
-            message='You will be called in approximately 15 minutes.'
-        )
-        send_queue_notification_email(
-            entry.user.email,
-            'You will be called in approximately 15 minutes.'
-        )
-
-    # Send notifications for 10 minutes remaining
-    ten_min_entries = QueueEntry.objects.filter(
-        status='waiting',
-        estimated_wait_time__lte=timedelta(minutes=10),
-        estimated_wait_time__gt=timedelta(minutes=5)
-    ).exclude(
-        # Don't send if already sent in last hour
-        user__notification__message__icontains='10 minutes',
-        user__notification__created_at__gte=now - timedelta(hours=1)
-    ).select_related('user')
-
-    for entry in ten_min_entries:
-        Notification.objects.create(
-            user=entry.user,
-            message='You will be called in approximately 10 minutes.'
-        )
-        send_queue_notification_email(
-            entry.user.email,
-            'You will be called in approximately 10 minutes.'
-        )
-
-    # Send notifications for 5 minutes remaining
-    five_min_entries = QueueEntry.objects.filter(
-        status='waiting',
-        estimated_wait_time__lte=timedelta(minutes=5),
-        estimated_wait_time__gt=timedelta(minutes=0)
-    ).exclude(
-        # Don't send if already sent in last hour
-        user__notification__message__icontains='5 minutes',
-        user__notification__created_at__gte=now - timedelta(hours=1)
-    ).select_related('user')
-
-    for entry in five_min_entries:
-        Notification.objects.create(
-            user=entry.user,
-            message='You will be called in approximately 5 minutes.'
-        )
-        send_queue_notification_email(
-            entry.user.email,
-            'You will be called in approximately 5 minutes.'
-        )
+    from .partitions import ensure_partitions
+
+    return ensure_partitions()
@@ -1,10 +1,65 @@
-from django.test import TestCase
+import asyncio
+import base64
+import gzip
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import threading
+import urllib.parse
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import skipUnless
+from unittest.mock import Mock, patch
+import numpy as np
+from asgiref.sync import async_to_sync
+from celery.exceptions import Retry
+from channels.db import database_sync_to_async
+from channels.routing import URLRouter
+from channels.testing import ApplicationCommunicator, WebsocketCommunicator
+from datetime import datetime, timedelta, timezone as dt_timezone
+from io import StringIO
+from django.core import mail
+from django.core.cache import cache
+from django.core.mail import get_connection
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, transaction
+from django.conf import settings
+from django.db import connection
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from rest_framework.test import APITestCase
 from rest_framework import status
 from django.contrib.auth import get_user_model
 from django.urls import reverse
-from .models import ServicePoint, QueueEntry, Notification
+from django.utils import timezone
+from . import coalesce, display, partitions, presence as presence_module, tickets
+from .audit import AuditBuffer, get_audit_buffer, reset_audit_buffer
+from .closure import run_job
+from .engine import get_queue_engine
+from .models import (
+    ServicePoint, ServiceType, QueueEntry, Notification, OutboxMessage, EmailDelivery, ServiceStats, HourlyRollup,
+    DailySketch, TicketCounter, AuditLog, Announcement, DisplayState, ACTIVE_STATUSES
+)
+from .mailer import dispatch, queue_emails
+from .management.commands.loadtest import summarise
+from .outbox import enqueue_email, enqueue_group_send, enqueue_queue_update, relay
+from .pagination import MAX_PAGE_SIZE
+from .presence import get_presence
+from .routing import http_urlpatterns, websocket_urlpatterns
+from .estimator import QuantileSketch, SKETCH_ACCURACY, observe, quantiles, queue_etas
+from .eta import due_service_points, refresh_etas
+from .rollups import percentiles
+from .staffing import profiles, required_counters
+from .tasks import flush_queue_update, send_queue_update, send_wait_time_notifications
 from accounts.models import User
+from accounts.websocket import JWTAuthMiddlewareStack
+from rest_framework_simplejwt.tokens import RefreshToken
 
 User = get_user_model()
 
@@ -12,6 +67,10 @@ User = get_user_model()
 class QueueAPITestCase(APITestCase):
     def setUp(self):
         """Set up test data"""
+        # Ticket blocks released by executed on_commit callbacks outlive the
+        # rolled back counter rows they came from
+        tickets.reset()
+        self.addCleanup(tickets.reset)
         # Create test users
         self.customer_user = User.objects.create_user(
             username='testcustomer',
@@ -177,6 +236,91 @@ class DeleteAllServicePointsTests(QueueAPITestCase):
         self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
 
 
+class ClosureTests(QueueAPITestCase):
+    """Test bulk closure of service points and the background cascade"""
+
+    def setUp(self):
+        super().setUp()
+        self.customers = [
+            User.objects.create_user(username=f'closure{i}', email=f'closure{i}@test.com', password='testpass123')
+            for i in range(5)
+        ]
+        engine = get_queue_engine()
+        with self.captureOnCommitCallbacks(execute=True):
+            for customer in self.customers:
+                engine.join(self.service_point, customer)
+
+    def close(self, service_point=None):
+        self.authenticate_staff()
+        return self.client.delete(reverse('delete_service_point', args=[(service_point or self.service_point).id]))
+
+    def test_closure_queries_do_not_grow_with_queue(self):
+        """Test closing a busy service point uses a fixed number of statements"""
+        busy = ServicePoint.objects.create(name='Busy Service Point', creator=self.staff_user)
+        engine = get_queue_engine()
+        with self.captureOnCommitCallbacks(execute=True):
+            for i in range(30):
+                customer = User.objects.create_user(username=f'busy{i}', email=f'busy{i}@test.com', password='testpass123')
+                engine.join(busy, customer)
+
+        with CaptureQueriesContext(connection) as small:
+            self.close()
+        with CaptureQueriesContext(connection) as large:
+            self.close(busy)
+        self.assertEqual(len(large), len(small))
+
+    def test_closure_notifies_in_bulk(self):
+        """Test customers are notified with one batched email and entries abandoned"""
+        response = self.close()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(Notification.objects.filter(user__in=self.customers).count(), 5)
+        self.assertFalse(QueueEntry.objects.filter(status__in=ACTIVE_STATUSES).exists())
+        self.assertEqual(
+            sorted(EmailDelivery.objects.values_list('recipient', flat=True)),
+            sorted(c.email for c in self.customers)
+        )
+
+        with patch('queues.mailer.get_connection', wraps=get_connection) as connections:
+            dispatch()
+        connections.assert_called_once()
+        self.assertEqual(len(mail.outbox), 5)
+        self.assertEqual(mail.outbox[0].to, [self.customers[0].email])
+
+    def test_background_job_deletes_in_chunks(self):
+        """Test the closure job removes entries and the service point and reports progress"""
+        job_id = self.close().data['job_id']
+        job = run_job(job_id, chunk_size=2)
+        self.assertEqual(job.status, 'completed')
+        self.assertFalse(ServicePoint.objects.filter(pk=self.service_point.pk).exists())
+        self.assertFalse(QueueEntry.objects.exists())
+
+        response = self.client.get(reverse('closure_job_status', args=[job_id]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['status'], 'completed')
+        self.assertEqual(response.data['entries_closed'], 5)
+        # Five entries, their hourly rollup, the day's ticket counter and the service point
+        self.assertEqual(response.data['rows_deleted'], 8)
+
+    def test_job_status_only_for_owner(self):
+        """Test other users cannot see a closure job"""
+        job_id = self.close().data['job_id']
+        self.authenticate_customer()
+        response = self.client.get(reverse('closure_job_status', args=[job_id]))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_delete_all_bulk_mode(self):
+        """Test delete_all with mode=bulk closes every point and returns a job"""
+        ServicePoint.objects.create(name='Second Service Point', creator=self.staff_user)
+        self.authenticate_staff()
+        response = self.client.delete(reverse('delete_all_service_points') + '?mode=bulk')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('Successfully deleted 2 service points', response.data['message'])
+        self.assertFalse(ServicePoint.objects.filter(creator=self.staff_user, is_active=True).exists())
+
+        run_job(response.data['job_id'])
+        self.assertFalse(ServicePoint.objects.filter(creator=self.staff_user).exists())
+
+
 class JoinQueueTests(QueueAPITestCase):
     """Test join_queue endpoint"""
 
@@ -207,6 +351,22 @@ class JoinQueueTests(QueueAPITestCase):
         response = self.client.post(reverse('join_queue'), data)
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
 
+    def test_join_queue_closed_meanwhile(self):
+        """Test a join racing a closure of its service point is rolled back"""
+        engine = get_queue_engine()
+        join = engine.join
+
+        def close_then_join(service_point, user):
+            ServicePoint.objects.filter(pk=service_point.pk).update(is_active=False)
+            return join(service_point, user)
+
+        self.authenticate_customer()
+        with patch.object(engine, 'join', side_effect=close_then_join):
+            response = self.client.post(reverse('join_queue'), {'service_point_id': self.service_point.id})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertFalse(QueueEntry.objects.exists())
+        self.assertFalse(OutboxMessage.objects.exists())
+
     def test_join_queue_unauthenticated(self):
         """Test joining queue when not authenticated"""
         data = {'service_point_id': self.service_point.id}
@@ -290,6 +450,31 @@ class CallNextTests(QueueAPITestCase):
         response = self.client.post(reverse('call_next'))
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
 
+    def test_call_next_from_one_service_point_to_a_counter(self):
+        """Test staff can call from a chosen service point to a named counter"""
+        other = ServicePoint.objects.create(name='Other desk', creator=self.staff_user)
+        get_queue_engine().join(other, self.customer_user)
+        self.authenticate_staff()
+        response = self.client.post(reverse('call_next'), {'service_point_id': self.service_point.id})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        response = self.client.post(reverse('call_next'), {'service_point_id': other.id, 'counter': '3'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['counter'], '3')
+        self.assertEqual(
+            Notification.objects.get(user=self.customer_user).message,
+            'Your turn! Please proceed to Other desk, counter 3.'
+        )
+
+    def test_call_next_other_staff_service_point(self):
+        """Test staff cannot call from a service point they do not own"""
+        someone_else = User.objects.create_user(username='otherteller', email='ot@test.com', password='x', role='staff')
+        theirs = ServicePoint.objects.create(name='Theirs', creator=someone_else)
+        self.authenticate_staff()
+        response = self.client.post(reverse('call_next'), {'service_point_id': theirs.id})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(response.data['error'], 'Service point not found or you do not own it.')
+
     def test_call_next_customer_forbidden(self):
         """Test customer cannot call next"""
         self.authenticate_customer()
@@ -374,6 +559,81 @@ class AnalyticsTests(QueueAPITestCase):
         response = self.client.get(reverse('analytics'))
         self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
 
+    def run_queue(self, customers=4):
+        """Join customers, serve two of them and let one leave"""
+        engine = get_queue_engine()
+        users = [
+            User.objects.create_user(username=f'analytics{i}', email=f'analytics{i}@test.com', password='x', role='customer')
+            for i in range(customers)
+        ]
+        with self.captureOnCommitCallbacks(execute=True):
+            entries = [engine.join(self.service_point, user) for user in users]
+            for _ in range(2):
+                engine.serve(engine.call_next([self.service_point.id]))
+            engine.abandon(entries[-1])
+        return entries
+
+    def test_rollups_follow_transitions(self):
+        """Test joins, serves and abandonments are added to the hourly rollup"""
+        self.run_queue()
+        rollup = HourlyRollup.objects.get(service_point=self.service_point)
+        self.assertEqual((rollup.joins, rollup.served, rollup.abandoned, rollup.wait_count), (4, 2, 1, 2))
+        self.assertEqual(rollup.hour.minute, 0)
+
+        self.authenticate_staff()
+        response = self.client.get(reverse('analytics'))
+        self.assertEqual(response.data['total_queues'], 4)
+        self.assertEqual(response.data['total_served'], 2)
+        self.assertEqual(response.data['abandoned_queues'], 1)
+        self.assertEqual(response.data['busiest_hour'], timezone.localtime(rollup.hour).hour)
+
+    def test_backfill_matches_incremental_rollups(self):
+        """Test rebuilding the rollups from queue entries gives the same totals"""
+        self.run_queue()
+        incremental = list(HourlyRollup.objects.values_list('joins', 'served', 'abandoned', 'wait_count'))
+        HourlyRollup.objects.all().delete()
+
+        out = StringIO()
+        call_command('backfill_rollups', stdout=out)
+        # One hourly rollup plus the day's wait and service sketches
+        self.assertIn('Wrote 3 rollup and sketch row(s).', out.getvalue())
+        self.assertEqual(list(HourlyRollup.objects.values_list('joins', 'served', 'abandoned', 'wait_count')), incremental)
+
+    def test_date_range(self):
+        """Test start and end restrict the analytics to whole days"""
+        now = timezone.now()
+        HourlyRollup.objects.create(service_point=self.service_point, hour=now - timedelta(days=10), joins=7)
+        HourlyRollup.objects.create(service_point=self.service_point, hour=now, joins=3, served=1, wait_seconds_sum=600, wait_count=1)
+
+        self.authenticate_staff()
+        today = timezone.localdate(now).isoformat()
+        response = self.client.get(reverse('analytics'), {'start': today, 'end': today})
+        self.assertEqual(response.data['total_queues'], 3)
+        self.assertEqual(response.data['average_wait_time'], '10.0 minutes')
+        response = self.client.get(reverse('analytics'))
+        self.assertEqual(response.data['total_queues'], 10)
+
+        response = self.client.get(reverse('analytics'), {'start': 'yesterday'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_query_count_does_not_grow_with_history(self):
+        """Test analytics cost the same queries however many entries were made"""
+        self.authenticate_staff()
+        self.run_queue(customers=3)
+        with CaptureQueriesContext(connection) as small:
+            self.client.get(reverse('analytics'))
+        QueueEntry.objects.bulk_create([
+            QueueEntry(service_point=self.service_point, user=self.customer_user, status='served',
+                       sequence=100 + i, ticket_number=f'HIST{i}')
+            for i in range(200)
+        ])
+        with CaptureQueriesContext(connection) as large:
+            self.client.get(reverse('analytics'))
+        self.assertEqual(len(large), len(small))
+        self.assertEqual(sum(
+            'queues_queueentry' in query['sql'] for query in large.captured_queries
+        ), 0)
+
 
 class NotificationsTests(QueueAPITestCase):
     """Test notifications endpoints"""
@@ -389,6 +649,44 @@ class NotificationsTests(QueueAPITestCase):
         response = self.client.get(reverse('notifications'))
         self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
 
+    def test_notifications_are_cursor_paginated(self):
+        """Test walking the notification pages returns every row once, newest first"""
+        Notification.objects.bulk_create([
+            Notification(user=self.customer_user, message=f'Notification {i}') for i in range(25)
+        ])
+        # Identical timestamps must still page deterministically on id
+        Notification.objects.filter(id__in=Notification.objects.order_by('id').values('id')[:10]).update(
+            created_at=timezone.now()
+        )
+        expected = list(Notification.objects.filter(user=self.customer_user).order_by('-created_at', '-id').values_list('id', flat=True))
+
+        self.authenticate_customer()
+        seen = []
+        url = reverse('notifications') + '?page_size=10'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertLessEqual(len(response.data['results']), 10)
+            seen.extend(item['id'] for item in response.data['results'])
+            url = response.data['next']
+        self.assertEqual(seen, expected)
+
+    def test_page_size_is_capped(self):
+        """Test page_size cannot exceed the maximum"""
+        Notification.objects.bulk_create([
+            Notification(user=self.customer_user, message='Capped') for _ in range(MAX_PAGE_SIZE + 5)
+        ])
+        self.authenticate_customer()
+        response = self.client.get(reverse('notifications'), {'page_size': 1000})
+        self.assertEqual(len(response.data['results']), MAX_PAGE_SIZE)
+        self.assertIsNotNone(response.data['next'])
+
+    def test_invalid_cursor(self):
+        """Test a malformed cursor is rejected"""
+        self.authenticate_customer()
+        response = self.client.get(reverse('notifications'), {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
     def test_mark_notification_read_success(self):
         """Test marking notification as read"""
         # Create a notification
@@ -416,6 +714,37 @@ class NotificationsTests(QueueAPITestCase):
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
 
 
+class MyQueuesTests(QueueAPITestCase):
+    """Test my_queues endpoint"""
+
+    def create_history(self, count):
+        for i in range(count):
+            service_point = ServicePoint.objects.create(name=f'History {i}', creator=self.staff_user)
+            QueueEntry.objects.create(service_point=service_point, user=self.customer_user, status='served')
+
+    def test_history_is_paginated(self):
+        """Test queue history is returned newest first in cursor pages"""
+        self.create_history(3)
+        self.authenticate_customer()
+        response = self.client.get(reverse('my_queues'), {'page_size': 2})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([item['service_point']['name'] for item in response.data['results']], ['History 2', 'History 1'])
+        response = self.client.get(response.data['next'])
+        self.assertEqual([item['service_point']['name'] for item in response.data['results']], ['History 0'])
+        self.assertIsNone(response.data['next'])
+
+    def test_query_count_does_not_grow_with_history(self):
+        """Test nested service points are loaded without per-row queries"""
+        self.create_history(1)
+        self.authenticate_customer()
+        with self.assertNumQueries(2):
+            self.client.get(reverse('my_queues'))
+        self.create_history(10)
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('my_queues'))
+        self.assertEqual(len(response.data['results']), 11)
+
+
 class QueuePositionUpdateTests(QueueAPITestCase):
     """Test queue position updates when customers leave"""
 
@@ -458,3 +787,1696 @@ class QueuePositionUpdateTests(QueueAPITestCase):
 
         self.assertEqual(customer2_entry.position, 1)  # Was 2, now 1
         self.assertEqual(customer3_entry.position, 2)  # Was 3, now 2
+
+
+class QueueEngineTests(QueueAPITestCase):
+    """Test the live queue engines behind join/call/serve/abandon"""
+
+    engine_path = 'queues.engine.memory.InMemoryQueueEngine'
+
+    def setUp(self):
+        super().setUp()
+        self.settings_override = self.settings(QUEUE_ENGINE=self.engine_path)
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+        self.engine = get_queue_engine()
+        self.engine.reset()
+        self.customers = [
+            User.objects.create_user(
+                username=f'enginecustomer{i}',
+                email=f'enginecustomer{i}@test.com',
+                password='testpass123',
+                role='customer'
+            )
+            for i in range(3)
+        ]
+
+    def join_all(self):
+        return [self.committed(self.engine.join, self.service_point, customer) for customer in self.customers]
+
+    def committed(self, operation, *args, **kwargs):
+        # Engines apply their changes once the transaction commits
+        with self.captureOnCommitCallbacks(execute=True):
+            return operation(*args, **kwargs)
+
+    def test_call_next_skips_entries_called_elsewhere(self):
+        """Test an entry already called by another worker is never handed out twice"""
+        first, second, _ = self.join_all()
+        # Another process calls the head of the queue behind this engine's back
+        QueueEntry.objects.filter(pk=first.pk).update(status='called', counter='9')
+        called = self.committed(self.engine.call_next, [self.service_point.id], counter='2')
+        self.assertEqual(called.id, second.id)
+        self.assertEqual(called.counter, '2')
+        self.assertEqual(QueueEntry.objects.get(pk=first.pk).counter, '9')
+
+    def test_join_assigns_increasing_positions(self):
+        """Test each join lands at the back of the queue"""
+        entries = self.join_all()
+        self.assertEqual([entry.position for entry in entries], [1, 2, 3])
+
+    def test_abandon_moves_queue_up(self):
+        """Test positions behind an abandoned entry move up"""
+        first, second, third = self.join_all()
+        self.committed(self.engine.abandon, first)
+        self.assertEqual(self.engine.position(second), 1)
+        self.assertEqual(self.engine.position(third), 2)
+        self.assertEqual(QueueEntry.objects.get(id=first.id).status, 'abandoned')
+
+    def test_call_next_and_serve(self):
+        """Test call_next takes the head of the queue exactly once"""
+        first, second, _ = self.join_all()
+        called = self.committed(self.engine.call_next, [self.service_point.id])
+        self.assertEqual(called.id, first.id)
+        self.assertEqual(QueueEntry.objects.get(id=first.id).status, 'called')
+        self.assertEqual(self.committed(self.engine.call_next, [self.service_point.id]).id, second.id)
+
+        self.committed(self.engine.serve, called)
+        self.assertEqual(QueueEntry.objects.get(id=first.id).status, 'served')
+        self.assertEqual(self.engine.position(second), 1)
+
+    def test_call_next_empty_queue(self):
+        """Test call_next returns None when nobody is waiting"""
+        self.assertIsNone(self.committed(self.engine.call_next, [self.service_point.id]))
+
+    def test_engine_positions_match_database(self):
+        """Test engine positions agree with positions derived from QueueEntry"""
+        first, second, third = self.join_all()
+        self.committed(self.engine.abandon, first)
+        self.assertEqual(self.engine.positions(self.service_point.id), {second.id: 1, third.id: 2})
+        self.assertEqual(QueueEntry.objects.get(id=second.id).position, 1)
+        self.assertEqual(QueueEntry.objects.get(id=third.id).position, 2)
+
+    def test_state_rebuilt_from_database(self):
+        """Test a fresh engine rebuilds the queue from QueueEntry rows"""
+        entries = self.join_all()
+        self.engine.reset()
+        self.assertEqual(self.engine.position(entries[2]), 3)
+        self.assertEqual(self.committed(self.engine.call_next, [self.service_point.id]).id, entries[0].id)
+
+    def test_api_flow_uses_engine(self):
+        """Test the join/call/dismiss endpoints run on the configured engine"""
+        self.authenticate_customer()
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('join_queue'), {'service_point_id': self.service_point.id})
+        self.assertEqual(response.data['position'], 1)
+
+        self.authenticate_staff()
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('call_next'))
+        self.assertEqual(response.data['status'], 'called')
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('dismiss_customer'), {'queue_entry_id': response.data['id']})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIsNone(self.committed(self.engine.call_next, [self.service_point.id]))
+
+    def test_rolled_back_join_leaves_no_entry(self):
+        """Test a join whose transaction rolls back does not hold a place"""
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            self.engine.join(self.service_point, self.customers[0])
+            raise RuntimeError
+        entry = self.committed(self.engine.join, self.service_point, self.customers[1])
+        self.assertEqual(entry.position, 1)
+        self.assertEqual(self.engine.positions(self.service_point.id), {entry.id: 1})
+
+    def test_rolled_back_leave_keeps_place(self):
+        """Test an abandon whose transaction rolls back leaves the entry in the queue"""
+        first, second, third = self.join_all()
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            self.engine.abandon(first)
+            raise RuntimeError
+        self.assertEqual(self.engine.positions(self.service_point.id), {first.id: 1, second.id: 2, third.id: 3})
+
+    @override_settings(QUEUE_ENGINE_CLAIM_TIMEOUT=0)
+    def test_rolled_back_call_gives_entry_back(self):
+        """Test an entry taken by a call that rolls back can be called again"""
+        first, second, _ = self.join_all()
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            self.assertEqual(self.engine.call_next([self.service_point.id]).id, first.id)
+            raise RuntimeError
+        self.assertEqual(QueueEntry.objects.get(pk=first.pk).status, 'joined')
+        self.assertEqual(self.committed(self.engine.call_next, [self.service_point.id]).id, first.id)
+        self.assertEqual(self.committed(self.engine.call_next, [self.service_point.id]).id, second.id)
+
+
+class ORMQueueEngineTests(QueueEngineTests):
+    """Run the engine tests against the default database engine"""
+
+    engine_path = 'queues.engine.orm.ORMQueueEngine'
+
+    def test_departure_does_not_renumber_queue(self):
+        """Test leaving costs the same number of queries regardless of queue length"""
+        with self.captureOnCommitCallbacks(execute=True):
+            entries = [self.engine.join(self.service_point, customer) for customer in self.customers]
+        # A departure only writes the departing row, then after commit its
+        # service point's counters and the hour's analytics rollup
+        with self.assertNumQueries(3), self.captureOnCommitCallbacks(execute=True):
+            self.engine.abandon(entries[0])
+        self.assertEqual(
+            [entry.sequence for entry in QueueEntry.objects.order_by('id')], [entry.sequence for entry in entries]
+        )
+
+    def test_sequence_is_monotonic_per_service_point(self):
+        """Test sequence numbers keep increasing after departures"""
+        first = self.engine.join(self.service_point, self.customers[0])
+        self.engine.abandon(first)
+        second = self.engine.join(self.service_point, self.customers[1])
+        self.assertGreater(second.sequence, first.sequence)
+        self.assertEqual(second.position, 1)
+
+    def test_position_none_after_leaving(self):
+        """Test entries that left the queue have no position"""
+        entry = self.engine.join(self.service_point, self.customers[0])
+        self.engine.serve(entry)
+        self.assertIsNone(QueueEntry.objects.get(id=entry.id).position)
+
+
+@skipUnless(os.getenv('QUEUE_ENGINE_REDIS_URL'), 'QUEUE_ENGINE_REDIS_URL is not set')
+class RedisQueueEngineTests(QueueEngineTests):
+    """Run the engine tests against a live Redis"""
+
+    engine_path = 'queues.engine.redis.RedisQueueEngine'
+
+
+class OutboxTests(QueueAPITestCase):
+    """Test side effects go through the transactional outbox"""
+
+    def join(self):
+        self.authenticate_customer()
+        return self.client.post(reverse('join_queue'), {'service_point_id': self.service_point.id})
+
+    def test_join_records_side_effects_without_sending(self):
+        """Test join writes outbox rows instead of emailing inline"""
+        self.join()
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(
+            list(OutboxMessage.objects.order_by('id').values_list('kind', flat=True)), ['notifications', 'queue_update']
+        )
+        self.assertEqual(
+            list(EmailDelivery.objects.values_list('recipient', 'status')),
+            [('customer@test.com', 'pending')]
+        )
+
+    def test_relay_delivers_and_marks_processed(self):
+        """Test the relay and email dispatcher deliver pending side effects"""
+        self.join()
+        with patch('queues.tasks.send_queue_update') as send_queue_update:
+            relay()
+        send_queue_update.assert_called_once_with(self.service_point.id)
+        self.assertFalse(OutboxMessage.objects.filter(processed_at__isnull=True).exists())
+        dispatch()
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['customer@test.com'])
+
+    def test_relay_coalesces_queue_updates(self):
+        """Test several updates for one service point are broadcast once"""
+        for _ in range(3):
+            enqueue_queue_update(self.service_point.id)
+        with patch('queues.tasks.send_queue_update') as send_queue_update:
+            self.assertEqual(relay(), 3)
+        send_queue_update.assert_called_once_with(self.service_point.id)
+
+    def test_failed_delivery_is_retried(self):
+        """Test a failing message stays pending until it succeeds"""
+        message = enqueue_group_send('queue_1', {'type': 'queue_update', 'data': {}})
+        failing = Mock(side_effect=ConnectionError('Redis down'))
+        with patch.dict('queues.outbox.HANDLERS', {'group_send': failing}):
+            relay()
+        message.refresh_from_db()
+        self.assertIsNone(message.processed_at)
+        self.assertEqual(message.attempts, 1)
+        self.assertEqual(message.last_error, 'Redis down')
+
+        relay()
+        message.refresh_from_db()
+        self.assertIsNotNone(message.processed_at)
+
+    def test_failed_queue_broadcast_stays_pending(self):
+        """Test a queue update whose broadcast fails is retried instead of marked processed"""
+        message = enqueue_queue_update(self.service_point.id)
+        with patch('channels.layers.InMemoryChannelLayer.group_send', side_effect=ConnectionError('Redis down')):
+            relay()
+        message.refresh_from_db()
+        self.assertIsNone(message.processed_at)
+        self.assertEqual((message.attempts, message.last_error), (1, 'Redis down'))
+
+        relay()
+        message.refresh_from_db()
+        self.assertIsNotNone(message.processed_at)
+
+    def test_rolled_back_change_leaves_no_message(self):
+        """Test outbox rows share the transaction of the queue change"""
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                enqueue_email('customer@test.com', 'Hello')
+                enqueue_queue_update(self.service_point.id)
+                raise RuntimeError
+        self.assertFalse(OutboxMessage.objects.exists())
+        self.assertFalse(EmailDelivery.objects.exists())
+
+
+class EmailDispatchTests(TestCase):
+    """Test the pooled email dispatcher with the locmem backend"""
+
+    def setUp(self):
+        cache.clear()
+
+    def test_batch_uses_one_connection(self):
+        """Test a batch of emails is sent over a single backend connection"""
+        queue_emails([f'user{i}@test.com' for i in range(5)], 'Closing soon')
+        with patch('queues.mailer.get_connection', wraps=get_connection) as connections:
+            self.assertEqual(dispatch(), 5)
+        connections.assert_called_once()
+        self.assertEqual(len(mail.outbox), 5)
+        self.assertEqual(EmailDelivery.objects.filter(status='sent', attempts=1).count(), 5)
+
+    @override_settings(EMAIL_RATE_LIMITS={'django.core.mail.backends.locmem.EmailBackend': 2})
+    def test_rate_limit_holds_back_excess(self):
+        """Test sends beyond the provider's per-second budget wait for the next run"""
+        queue_emails([f'user{i}@test.com' for i in range(5)], 'Closing soon')
+        self.assertEqual(dispatch(), 2)
+        self.assertEqual(dispatch(), 0)
+        self.assertEqual(EmailDelivery.objects.filter(status='pending').count(), 3)
+
+    @override_settings(EMAIL_MAX_ATTEMPTS=2, EMAIL_RETRY_BACKOFF=30)
+    def test_failure_backs_off_then_gives_up(self):
+        """Test failed sends are retried later and marked failed after the last attempt"""
+        delivery, = queue_emails(['user@test.com'], 'Hello')
+        failing = patch(
+            'django.core.mail.backends.locmem.EmailBackend.send_messages',
+            side_effect=ConnectionError('Mailgun down')
+        )
+        with failing:
+            dispatch()
+        delivery.refresh_from_db()
+        self.assertEqual((delivery.status, delivery.attempts, delivery.last_error), ('pending', 1, 'Mailgun down'))
+        self.assertGreater(delivery.next_attempt_at, timezone.now() + timedelta(seconds=25))
+        # Not due yet
+        self.assertEqual(dispatch(), 0)
+
+        EmailDelivery.objects.update(next_attempt_at=timezone.now())
+        with failing:
+            dispatch()
+        delivery.refresh_from_db()
+        self.assertEqual((delivery.status, delivery.attempts), ('failed', 2))
+
+
+class FakeMailgunHandler(BaseHTTPRequestHandler):
+    """Stand-in for the Mailgun messages API that records every call"""
+    requests = []
+    status_code = 200
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length'])).decode()
+        FakeMailgunHandler.requests.append((self.path, urllib.parse.parse_qs(body)))
+        self.send_response(self.status_code)
+        self.send_header('Content-Type', 'application/json')
+        self.end_headers()
+        if self.status_code == 200:
+            self.wfile.write(b'{"id": "<20261018.1@mg.test>", "message": "Queued. Thank you."}')
+        else:
+            self.wfile.write(b'{"message": "Internal error"}')
+
+    def log_message(self, *args):
+        pass
+
+
+class MailgunDispatchTests(TestCase):
+    """Test batch sending against a local fake Mailgun HTTP API"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), FakeMailgunHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.anymail = override_settings(
+            EMAIL_BACKEND='anymail.backends.mailgun.EmailBackend',
+            ANYMAIL={
+                'MAILGUN_API_KEY': 'test-key',
+                'MAILGUN_SENDER_DOMAIN': 'mg.test',
+                'MAILGUN_API_URL': f'http://127.0.0.1:{cls.server.server_port}/v3',
+            },
+        )
+        cls.anymail.enable()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.anymail.disable()
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        cache.clear()
+        FakeMailgunHandler.requests = []
+        FakeMailgunHandler.status_code = 200
+
+    def test_recipients_of_one_email_share_an_api_call(self):
+        """Test identical emails go out as one batch send and record the provider id"""
+        queue_emails([f'user{i}@test.com' for i in range(3)], 'Closing soon')
+        queue_emails(['other@test.com'], 'Your turn!')
+        self.assertEqual(dispatch(), 4)
+
+        self.assertEqual(len(FakeMailgunHandler.requests), 2)
+        path, form = FakeMailgunHandler.requests[0]
+        self.assertEqual(path, '/v3/mg.test/messages')
+        self.assertEqual(len(form['to']), 3)
+        self.assertIn('recipient-variables', form)
+        sent = EmailDelivery.objects.filter(status='sent')
+        self.assertEqual(sent.count(), 4)
+        self.assertEqual(set(sent.values_list('provider_message_id', flat=True)), {'<20261018.1@mg.test>'})
+
+    def test_provider_error_is_retried(self):
+        """Test an HTTP error from the provider leaves the batch pending with backoff"""
+        FakeMailgunHandler.status_code = 500
+        queue_emails(['user@test.com'], 'Closing soon')
+        dispatch()
+        delivery = EmailDelivery.objects.get()
+        self.assertEqual((delivery.status, delivery.attempts), ('pending', 1))
+        self.assertIn('500', delivery.last_error)
+        self.assertGreater(delivery.next_attempt_at, timezone.now())
+
+
+@override_settings(DEFAULT_SERVICE_DURATION=5)
+class WaitTimeReminderTests(QueueAPITestCase):
+    """Test wait-time reminders are sent once per threshold as ETAs change"""
+
+    def setUp(self):
+        super().setUp()
+        engine = get_queue_engine()
+        self.entries = [
+            engine.join(self.service_point, User.objects.create_user(
+                username=f'eta{i}', email=f'eta{i}@test.com', password='testpass123'
+            )) for i in range(4)
+        ]
+
+    def reminders(self, entry):
+        return list(Notification.objects.filter(user=entry.user).values_list('message', flat=True))
+
+    def test_thresholds_follow_queue_changes(self):
+        """Test each entry is reminded once per newly crossed threshold"""
+        self.assertEqual(refresh_etas(self.service_point.id), 3)
+        last = QueueEntry.objects.get(pk=self.entries[3].pk)
+        self.assertEqual(last.estimated_wait_time, timedelta(minutes=15))
+        self.assertEqual(last.last_eta_threshold, 15)
+        self.assertEqual(self.reminders(self.entries[1]), ['You will be called in approximately 5 minutes.'])
+        # The head of the queue is next; it is not told to wait 5 minutes
+        self.assertEqual(self.reminders(self.entries[0]), [])
+        self.assertEqual(list(due_service_points()), [])
+
+        # Nothing changed, nothing resent
+        self.assertEqual(refresh_etas(self.service_point.id), 0)
+
+        get_queue_engine().abandon(self.entries[0])
+        self.assertEqual(refresh_etas(self.service_point.id), 2)
+        self.assertEqual(self.reminders(self.entries[3]), [
+            'You will be called in approximately 10 minutes.',
+            'You will be called in approximately 15 minutes.',
+        ])
+        self.assertEqual(EmailDelivery.objects.filter(recipient='eta3@test.com').count(), 2)
+
+    def test_sweep_only_visits_missed_reminders(self):
+        """Test the periodic sweep picks up entries whose reminder was missed"""
+        refresh_etas(self.service_point.id)
+        self.assertEqual(list(due_service_points()), [])
+
+        QueueEntry.objects.filter(pk=self.entries[2].pk).update(last_eta_threshold=15)
+        self.assertEqual(list(due_service_points()), [self.service_point.id])
+        send_wait_time_notifications()
+        self.assertEqual(self.reminders(self.entries[2])[0], 'You will be called in approximately 10 minutes.')
+        self.assertEqual(list(due_service_points()), [])
+
+
+class WaitTimeEstimatorTests(QueueAPITestCase):
+    """Test the online service-time statistics and queue ETAs"""
+
+    def join(self, count):
+        engine = get_queue_engine()
+        return [
+            engine.join(self.service_point, User.objects.create_user(
+                username=f'estimate{i}', email=f'estimate{i}@test.com', password='testpass123'
+            )) for i in range(count)
+        ]
+
+    def test_dismiss_updates_running_statistics(self):
+        """Test serving a customer folds its service time into the EWMA and sketch"""
+        service_type = ServiceType.objects.create(name='Passport', estimated_duration=timedelta(minutes=10))
+        engine = get_queue_engine()
+        entry = engine.join(self.service_point, self.customer_user, service_type=service_type)
+        engine.call_next([self.service_point.id])
+        QueueEntry.objects.filter(pk=entry.pk).update(called_at=timezone.now() - timedelta(minutes=4))
+        self.authenticate_staff()
+        self.client.post(reverse('dismiss_customer'), {'queue_entry_id': entry.id})
+
+        overall = ServiceStats.objects.get(service_point=self.service_point, service_type=None)
+        self.assertEqual(overall.samples, 1)
+        self.assertAlmostEqual(overall.ewma_seconds, 240, delta=5)
+        by_type = ServiceStats.objects.get(service_point=self.service_point, service_type=service_type)
+        self.assertEqual(by_type.samples, 1)
+        p50, = quantiles(self.service_point.id, qs=(0.5,))
+        self.assertAlmostEqual(p50, 240, delta=240 * 0.03)
+
+    def test_ewma_weights_recent_services(self):
+        """Test the running average moves towards new service times"""
+        stats = ServiceStats(service_point=self.service_point)
+        for seconds in (100, 100, 300):
+            observe(stats, seconds)
+        self.assertAlmostEqual(stats.ewma_seconds, 100 + 0.2 * 200)
+
+    def test_sketch_quantiles_are_accurate(self):
+        """Test the quantile sketch stays within its relative accuracy"""
+        sketch = QuantileSketch()
+        for value in range(1, 1001):
+            sketch.add(value)
+        for q, expected in ((0.5, 500), (0.9, 900), (0.99, 990)):
+            self.assertAlmostEqual(sketch.quantile(q), expected, delta=expected * SKETCH_ACCURACY * 1.5)
+
+    def test_queue_etas_sum_expected_services_ahead(self):
+        """Test ETAs add up the expected time of everyone ahead, minus elapsed service"""
+        ServiceStats.objects.create(service_point=self.service_point, samples=10, ewma_seconds=120)
+        first, second, third = self.join(3)
+        QueueEntry.objects.filter(pk=first.pk).update(status='called', called_at=timezone.now() - timedelta(seconds=30))
+        etas = queue_etas(self.service_point.id)
+        self.assertEqual(etas[first.id], timedelta(0))
+        self.assertAlmostEqual(etas[second.id].total_seconds(), 90, delta=2)
+        self.assertAlmostEqual(etas[third.id].total_seconds(), 210, delta=2)
+
+    @override_settings(DEFAULT_SERVICE_DURATION=5)
+    def test_my_queue_position_exposes_eta(self):
+        """Test my_queue_position returns the customer's ETA in seconds"""
+        self.join(2)
+        self.authenticate_customer()
+        self.client.post(reverse('join_queue'), {'service_point_id': self.service_point.id})
+        response = self.client.get(reverse('my_queue_position'))
+        self.assertEqual(response.data['position'], 3)
+        self.assertEqual(response.data['eta_seconds'], 10 * 60)
+
+
+class WaitTimePercentileTests(QueueAPITestCase):
+    """Test the daily duration sketches behind the analytics percentiles"""
+
+    def store(self, service_point, day, values):
+        sketch = QuantileSketch()
+        for value in values:
+            sketch.add(value)
+        DailySketch.objects.create(service_point=service_point, day=day, metric='wait', sketch=sketch.to_dict())
+
+    def test_merged_percentiles_match_numpy(self):
+        """Test merged daily sketches agree with exact percentiles for any range and set of points"""
+        rng = np.random.default_rng(42)
+        other = ServicePoint.objects.create(name='Other', creator=self.staff_user)
+        today = timezone.localdate()
+        exact = {}
+        for service_point in (self.service_point, other):
+            for offset in range(7):
+                values = rng.lognormal(mean=6, sigma=0.8, size=int(rng.integers(200, 800)))
+                day = today - timedelta(days=offset)
+                self.store(service_point, day, values)
+                exact[service_point.id, day] = values
+
+        cases = [
+            ([self.service_point.id, other.id], today - timedelta(days=6), today),
+            ([self.service_point.id], today - timedelta(days=2), today),
+            ([other.id], today - timedelta(days=4), today - timedelta(days=4)),
+        ]
+        for ids, start, end in cases:
+            values = np.concatenate([
+                v for (pk, day), v in exact.items() if pk in ids and start <= day <= end
+            ])
+            merged = percentiles(
+                DailySketch.objects.filter(service_point_id__in=ids, day__gte=start, day__lte=end), 'wait'
+            )
+            for p in (50, 90, 99):
+                expected = np.percentile(values, p, method='lower')
+                self.assertAlmostEqual(merged[f'p{p}'], expected, delta=expected * SKETCH_ACCURACY)
+
+    def test_merge_is_exact(self):
+        """Test merging sketches equals sketching all values at once"""
+        values = np.random.default_rng(7).exponential(300, size=1000)
+        whole, left, right = QuantileSketch(), QuantileSketch(), QuantileSketch()
+        for value in values:
+            whole.add(value)
+        for value in values[:400]:
+            left.add(value)
+        for value in values[400:]:
+            right.add(value)
+        self.assertEqual(left.merge(right).to_dict(), whole.to_dict())
+
+    def test_serving_feeds_sketches_and_analytics(self):
+        """Test served entries land in the day's sketches and analytics report percentiles"""
+        now = timezone.now()
+        engine = get_queue_engine()
+        for i, minutes in enumerate((2, 4, 6, 8, 10)):
+            entry = engine.join(self.service_point, self.customer_user)
+            engine.call_next([self.service_point.id])
+            QueueEntry.objects.filter(pk=entry.pk).update(
+                joined_at=now - timedelta(minutes=minutes), called_at=now - timedelta(minutes=1)
+            )
+            entry.refresh_from_db()
+            with self.captureOnCommitCallbacks(execute=True):
+                engine.serve(entry)
+                # Written once the dismiss commits, outside its transaction
+                self.assertEqual(DailySketch.objects.count(), 2 if i else 0)
+        self.assertEqual(DailySketch.objects.filter(service_point=self.service_point).count(), 2)
+
+        self.authenticate_staff()
+        response = self.client.get(reverse('analytics'), {'service_points': str(self.service_point.id)})
+        self.assertAlmostEqual(response.data['wait_time_percentiles']['p50'], 6, delta=6 * 0.03)
+        # Like numpy's 'lower' method, a percentile is one of the observed values
+        self.assertAlmostEqual(response.data['wait_time_percentiles']['p99'], 8, delta=8 * 0.03)
+        self.assertAlmostEqual(response.data['service_time_percentiles']['p90'], 1, delta=0.03)
+
+        response = self.client.get(reverse('analytics'), {'service_points': 'all'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_backfill_rebuilds_sketches(self):
+        """Test backfill_rollups recreates the sketches from served entries"""
+        now = timezone.now()
+        QueueEntry.objects.create(
+            service_point=self.service_point, user=self.customer_user, status='served',
+            called_at=now - timedelta(minutes=3), served_at=now
+        )
+        call_command('backfill_rollups', stdout=StringIO())
+        wait = DailySketch.objects.get(service_point=self.service_point, metric='wait')
+        self.assertEqual(wait.day, timezone.localdate(now))
+        self.assertAlmostEqual(percentiles(DailySketch.objects.all(), 'service')['p50'], 180, delta=180 * SKETCH_ACCURACY)
+
+
+class StaffingForecastTests(QueueAPITestCase):
+    """Test the Erlang C staffing forecast"""
+
+    def seed(self):
+        # Mondays at 9:00 local time, two weeks running
+        self.now = timezone.make_aware(datetime(2026, 10, 19))
+        self.mondays = [timezone.make_aware(datetime(2026, 10, day, 9)) for day in (5, 12)]
+        entries = []
+        for week, monday in enumerate(self.mondays):
+            for i in range(10):
+                called_at = monday + timedelta(minutes=5 * i)
+                entries.append(QueueEntry(
+                    service_point=self.service_point, user=self.customer_user, status='served',
+                    sequence=week * 10 + i + 1, ticket_number=f'STAFF{week}{i}',
+                    called_at=called_at, served_at=called_at + timedelta(minutes=6)
+                ))
+        QueueEntry.objects.bulk_create(entries)
+        QueueEntry.objects.update(joined_at=F('called_at'))
+
+    def test_erlang_c_matches_textbook_values(self):
+        """Test 30 arrivals an hour at 6 minutes each need four counters for a 5 minute wait"""
+        counters, waits = required_counters([30, 0, 30], [360, 360, 360], 300)
+        self.assertEqual(list(counters), [4, 0, 4])
+        # Erlang C with 3 Erlangs on 4 counters: P(wait) = 0.5094
+        self.assertAlmostEqual(waits[0], 0.5094 * 360, delta=0.5)
+        counters, _ = required_counters([30], [360], 60)
+        self.assertEqual(counters[0], 5)
+
+    @override_settings(TIME_ZONE='Africa/Nairobi')
+    def test_profiles_from_history(self):
+        """Test arrival rates and service times are averaged per local hour of the week in one query"""
+        self.seed()
+        with self.assertNumQueries(1):
+            arrival_rate, service = profiles(self.service_point.id, weeks=4, now=self.now)
+        monday_nine = 9
+        self.assertAlmostEqual(arrival_rate[monday_nine], 10)
+        self.assertEqual(arrival_rate.sum(), 10)
+        self.assertAlmostEqual(service[monday_nine], 360)
+        # Hours without history fall back to the overall mean service time
+        self.assertAlmostEqual(service[24 + 9], 360)
+
+    def test_forecast_endpoint(self):
+        """Test staff get a forecast for their own service points only"""
+        self.seed()
+        self.authenticate_staff()
+        url = reverse('staffing_forecast', args=[self.service_point.id])
+        response = self.client.get(url, {'target_wait': 1, 'weeks': 52})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['hours']), 168)
+        self.assertEqual(response.data['hours'][0]['counters'], 0)
+
+        self.assertEqual(self.client.get(url, {'weeks': 'many'}).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get(url, {'weeks': 10 ** 9}).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get(url, {'target_wait': 'nan'}).status_code, status.HTTP_400_BAD_REQUEST)
+        other = ServicePoint.objects.create(name='Not mine', creator=User.objects.create_user(
+            username='otherstaff', email='other@test.com', password='testpass123', role='staff'
+        ))
+        response = self.client.get(reverse('staffing_forecast', args=[other.id]))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        self.authenticate_customer()
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_forecast_command(self):
+        """Test the command prints a counters grid"""
+        out = StringIO()
+        call_command('forecast_staffing', self.service_point.id, stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(len(lines), 26)
+        self.assertTrue(lines[1].startswith('hour'))
+
+    def test_forecast_command_rejects_bad_bounds(self):
+        """Test the command refuses the same target waits and history lengths as the endpoint"""
+        for option in (['--weeks', '100000'], ['--weeks', '0'], ['--target-wait', 'nan'], ['--target-wait', '-5']):
+            with self.subTest(option=option), self.assertRaises(CommandError):
+                call_command('forecast_staffing', self.service_point.id, *option, stdout=StringIO())
+
+
+class ConcurrentCallNextTests(TransactionTestCase):
+    """Test several tellers calling from one queue at the same time"""
+
+    engine_path = 'queues.engine.orm.ORMQueueEngine'
+    tellers = 6
+    customers = 60
+
+    def setUp(self):
+        if connection.vendor == 'sqlite' and connection.settings_dict['OPTIONS'].get('transaction_mode') != 'IMMEDIATE':
+            # Deferred SQLite transactions fail instead of waiting when two writers meet
+            self.skipTest('Needs row locks, or SQLite in IMMEDIATE transaction mode')
+        self.settings_override = self.settings(QUEUE_ENGINE=self.engine_path)
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+        get_queue_engine().reset()
+        # Blocks held from earlier tests point at flushed counter rows
+        tickets.reset()
+        staff = User.objects.create_user(username='tellerstaff', email='tellers@test.com', password='x', role='staff')
+        self.service_point = ServicePoint.objects.create(name='Busy branch', creator=staff)
+        engine = get_queue_engine()
+        for i in range(self.customers):
+            engine.join(self.service_point, User.objects.create_user(
+                username=f'teller{i}', email=f'teller{i}@test.com', password='x'
+            ))
+
+    def test_tellers_never_call_the_same_customer(self):
+        """Test every waiting customer is called exactly once across parallel tellers"""
+        called = []
+        errors = []
+        start = threading.Barrier(self.tellers)
+
+        def teller(counter):
+            engine = get_queue_engine()
+            try:
+                start.wait()
+                while True:
+                    with transaction.atomic():
+                        queue_entry = engine.call_next([self.service_point.id], counter)
+                    if queue_entry is None:
+                        break
+                    called.append((queue_entry.id, counter))
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=teller, args=(str(i + 1),)) for i in range(self.tellers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        ids = [entry_id for entry_id, _ in called]
+        self.assertEqual(len(ids), self.customers)
+        self.assertEqual(len(set(ids)), self.customers)
+        self.assertEqual(QueueEntry.objects.filter(status='called').count(), self.customers)
+        for entry_id, counter in called:
+            self.assertEqual(QueueEntry.objects.get(pk=entry_id).counter, counter)
+        self.service_point.refresh_from_db()
+        self.assertEqual((self.service_point.waiting_count, self.service_point.called_count), (0, self.customers))
+
+
+class InMemoryConcurrentCallNextTests(ConcurrentCallNextTests):
+    """Run the teller race against the in-memory engine"""
+
+    engine_path = 'queues.engine.memory.InMemoryQueueEngine'
+
+
+class TicketNumberTests(QueueAPITestCase):
+    """Test per service point, per day ticket numbers"""
+
+    def setUp(self):
+        super().setUp()
+        tickets.reset()
+        self.addCleanup(tickets.reset)
+
+    def join(self, service_point, username):
+        user = User.objects.create_user(username=username, email=f'{username}@test.com', password='x')
+        # Blocks are shared with the process once the claim commits
+        with self.captureOnCommitCallbacks(execute=True):
+            return get_queue_engine().join(service_point, user)
+
+    def allocate(self, **kwargs):
+        with self.captureOnCommitCallbacks(execute=True):
+            return tickets.allocate(self.service_point.id, **kwargs)
+
+    def test_tickets_count_up_per_service_point(self):
+        """Test tickets read A-001, A-002... separately for each service point"""
+        other = ServicePoint.objects.create(name='Pharmacy', creator=self.staff_user, ticket_prefix='P')
+        first = self.join(self.service_point, 'ticket1')
+        second = self.join(self.service_point, 'ticket2')
+        elsewhere = self.join(other, 'ticket3')
+        self.assertEqual([first.ticket_number, second.ticket_number, elsewhere.ticket_number], ['A-001', 'A-002', 'P-001'])
+        self.assertEqual(first.ticket_day, timezone.localdate())
+
+    @override_settings(TICKET_BLOCK_SIZE=5)
+    def test_counter_row_written_once_per_block(self):
+        """Test numbers come from memory between block claims"""
+        numbers = [self.allocate() for _ in range(6)]
+        self.assertEqual(numbers, [1, 2, 3, 4, 5, 6])
+        self.assertEqual(TicketCounter.objects.get(service_point=self.service_point).last_number, 10)
+        with self.assertNumQueries(0):
+            self.allocate()
+
+    def test_rolled_back_claim_is_not_reused(self):
+        """Test a block claimed by a rolled back join is not handed out from memory"""
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                self.assertEqual(tickets.allocate(self.service_point.id), 1)
+                raise RuntimeError
+        self.assertFalse(TicketCounter.objects.exists())
+        self.assertEqual([self.allocate(), self.allocate()], [1, 2])
+
+    @override_settings(TICKET_BLOCK_SIZE=20)
+    def test_queue_order_does_not_follow_blocks(self):
+        """Test a worker still holding an older block does not jump the queue"""
+        alice = self.join(self.service_point, 'alice')
+        # Another worker claims the next block
+        with patch.object(tickets, '_blocks', {}):
+            bob = self.join(self.service_point, 'bob')
+            carol = self.join(self.service_point, 'carol')
+        dave = self.join(self.service_point, 'dave')
+        self.assertEqual(
+            [alice.ticket_number, bob.ticket_number, carol.ticket_number, dave.ticket_number],
+            ['A-001', 'A-021', 'A-022', 'A-002']
+        )
+
+        engine = get_queue_engine()
+        called = [engine.call_next([self.service_point.id]).user.username for _ in range(4)]
+        self.assertEqual(called, ['alice', 'bob', 'carol', 'dave'])
+
+    def test_numbering_restarts_every_day(self):
+        """Test each day has its own sequence"""
+        yesterday = timezone.localdate() - timedelta(days=1)
+        self.assertEqual(self.allocate(day=yesterday), 1)
+        self.assertEqual(self.allocate(day=yesterday), 2)
+        self.assertEqual(self.allocate(), 1)
+
+
+class AuditLogTests(QueueAPITestCase):
+    """Test the buffered audit log"""
+
+    def setUp(self):
+        super().setUp()
+        reset_audit_buffer()
+        self.addCleanup(reset_audit_buffer)
+
+    def test_requests_are_buffered_then_written(self):
+        """Test authenticated requests are audited without writing during the request"""
+        self.authenticate_staff()
+        self.client.get(reverse('service_points'))
+        self.assertFalse(AuditLog.objects.exists())
+        self.assertEqual(get_audit_buffer().flush(), 1)
+
+        log = AuditLog.objects.get()
+        self.assertEqual(log.user, self.staff_user)
+        self.assertEqual((log.action, log.resource_type), ('view', 'service_points'))
+        self.assertEqual(log.description, 'GET /api/queues/service-points/ -> 200')
+        self.assertEqual(log.ip_address, '127.0.0.1')
+
+    def test_url_arguments_become_resource_id(self):
+        """Test the object a request targets is recorded"""
+        notification = Notification.objects.create(user=self.customer_user, message='Bye')
+        self.authenticate_customer()
+        self.client.delete(reverse('delete_notification', args=[notification.id]))
+        get_audit_buffer().flush()
+        log = AuditLog.objects.get()
+        self.assertEqual((log.action, log.resource_type, log.resource_id), ('delete', 'delete_notification', str(notification.id)))
+
+    def test_anonymous_requests_are_not_audited(self):
+        """Test requests without a user leave no audit trail"""
+        self.client.get(reverse('public_service_points'))
+        self.assertEqual(get_audit_buffer().pending(), 0)
+
+    @override_settings(AUDIT_BATCH_SIZE=3)
+    def test_full_batch_written_without_background_writer(self):
+        """Test a full batch is written inline when there is no writer thread"""
+        self.authenticate_staff()
+        for _ in range(4):
+            self.client.get(reverse('service_points'))
+        self.assertEqual(AuditLog.objects.count(), 3)
+        self.assertEqual(get_audit_buffer().pending(), 1)
+
+    def test_background_writer_batches_by_size_and_time(self):
+        """Test the writer thread flushes full batches at once and the rest after the interval"""
+        written = []
+        done = threading.Event()
+
+        def write(events):
+            written.append(len(events))
+            if sum(written) == 5:
+                done.set()
+
+        buffer = AuditBuffer(capacity=100, batch_size=2, interval=50, full_timeout=5)
+        with patch.object(buffer, '_write', side_effect=write):
+            for i in range(5):
+                buffer.record(user_id=self.staff_user.id, action='view', resource_type='test')
+            self.assertTrue(done.wait(timeout=5))
+        self.assertEqual(sum(written), 5)
+        self.assertLessEqual(max(written), 2)
+
+    def test_backpressure_then_drop_when_full(self):
+        """Test a full buffer briefly holds the caller, then drops the event"""
+        buffer = AuditBuffer(capacity=2, batch_size=10, interval=50, full_timeout=20, background=False)
+        for _ in range(2):
+            buffer.record(user_id=self.staff_user.id, action='view', resource_type='test')
+        started = time.monotonic()
+        buffer.record(user_id=self.staff_user.id, action='view', resource_type='test')
+        self.assertGreaterEqual(time.monotonic() - started, 0.015)
+        self.assertEqual((buffer.dropped, buffer.pending()), (1, 2))
+
+
+    def test_bad_row_does_not_lose_the_batch(self):
+        """Test a refused batch is written row by row, dropping only the bad rows"""
+        buffer = AuditBuffer(capacity=10, batch_size=10, interval=50, full_timeout=5, background=False)
+        buffer.record(user_id=self.staff_user.id, action='view', resource_type='first')
+        buffer.record(user_id=self.staff_user.id, action='view', resource_type=None)
+        buffer.record(user_id=self.staff_user.id, action='view', resource_type='third')
+        self.assertEqual(buffer.flush(), 3)
+        self.assertEqual(list(AuditLog.objects.order_by('id').values_list('resource_type', flat=True)),
+                         ['first', 'third'])
+        self.assertEqual(buffer.failed, 1)
+
+    def test_broken_connection_is_replaced(self):
+        """Test a batch failing on an unusable connection is retried on a new one"""
+        buffer = AuditBuffer(capacity=10, batch_size=10, interval=50, full_timeout=5, background=False)
+        buffer.record(user_id=self.staff_user.id, action='view', resource_type='test')
+        insert = buffer._insert
+        attempts = []
+
+        def flaky(events):
+            attempts.append(len(events))
+            if len(attempts) == 1:
+                raise OperationalError('server closed the connection unexpectedly')
+            insert(events)
+
+        broken = Mock(in_atomic_block=False, is_usable=Mock(return_value=False))
+        with patch.object(buffer, '_insert', side_effect=flaky), patch('queues.audit.connection', broken):
+            buffer.flush()
+        broken.close.assert_called_once()
+        self.assertEqual(attempts, [1, 1])
+        self.assertEqual((AuditLog.objects.count(), buffer.failed), (1, 0))
+
+
+class AuditArchiveTests(QueueAPITestCase):
+    """Test monthly audit log retention and archival"""
+
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def log_at(self, *moment):
+        return AuditLog.objects.create(
+            user=self.staff_user, action='view', resource_type='test',
+            timestamp=datetime(*moment, tzinfo=dt_timezone.utc)
+        )
+
+    @override_settings(AUDIT_RETENTION_MONTHS=12)
+    def test_retention_cutoff(self):
+        """Test the cutoff keeps the current month and the twelve before it"""
+        now = datetime(2025, 3, 17, 9, tzinfo=dt_timezone.utc)
+        self.assertEqual(partitions.retention_cutoff(now), datetime(2024, 3, 1, tzinfo=dt_timezone.utc))
+        self.assertEqual(partitions.add_months(datetime(2024, 11, 1, tzinfo=dt_timezone.utc), 3),
+                         datetime(2025, 2, 1, tzinfo=dt_timezone.utc))
+
+    def test_archive_exports_and_drops_old_months(self):
+        """Test months before the cutoff end up in compressed files and leave the table"""
+        old = [self.log_at(2024, 1, 3), self.log_at(2024, 1, 30), self.log_at(2024, 2, 14)]
+        recent = self.log_at(2024, 4, 2)
+
+        call_command(
+            'archive_audit_logs', before='2024-03', output_dir=self.directory.name, stdout=StringIO()
+        )
+
+        self.assertEqual(list(AuditLog.objects.values_list('id', flat=True)), [recent.id])
+        with gzip.open(os.path.join(self.directory.name, 'auditlog-2024-01.jsonl.gz'), 'rt') as archive:
+            records = [json.loads(line) for line in archive]
+        self.assertEqual(sorted(record['id'] for record in records), [old[0].id, old[1].id])
+        self.assertEqual(records[0]['user_id'], self.staff_user.id)
+        self.assertTrue(os.path.exists(os.path.join(self.directory.name, 'auditlog-2024-02.jsonl.gz')))
+        self.assertFalse(os.path.exists(os.path.join(self.directory.name, 'auditlog-2024-03.jsonl.gz')))
+
+    def test_dry_run_keeps_rows(self):
+        """Test a dry run only reports what would be archived"""
+        self.log_at(2024, 1, 3)
+        out = StringIO()
+        call_command(
+            'archive_audit_logs', before='2024-03', output_dir=self.directory.name, dry_run=True, stdout=out
+        )
+        self.assertIn('2024-01: 1 row(s) would be archived', out.getvalue())
+        self.assertEqual(AuditLog.objects.count(), 1)
+        self.assertEqual(os.listdir(self.directory.name), [])
+
+    @skipUnless(connection.vendor == 'postgresql', 'Needs a partitioned audit log table')
+    def test_recent_range_reads_only_its_partition(self):
+        """Test a timestamp range is pruned to the partitions it covers"""
+        partitions.ensure_partitions(since=timezone.now() - timedelta(days=62))
+        since = partitions.month_start(timezone.now())
+        plan = AuditLog.objects.filter(timestamp__gte=since).explain()
+        self.assertIn(partitions.partition_name(since), plan)
+        self.assertNotIn(partitions.partition_name(partitions.add_months(since, -1)), plan)
+
+
+class WebSocketPresenceTests(QueueAPITestCase):
+    """Test authenticated sockets, user groups and the presence registry"""
+
+    def setUp(self):
+        super().setUp()
+        self.addCleanup(presence_module._reset_presence, 'PRESENCE')
+        presence_module._reset_presence('PRESENCE')
+        self.application = JWTAuthMiddlewareStack(URLRouter(websocket_urlpatterns))
+
+    def connect(self, user=None):
+        headers = []
+        if user is not None:
+            token = RefreshToken.for_user(user).access_token
+            headers.append((b'cookie', f'access_token={token}'.encode()))
+        return WebsocketCommunicator(self.application, f'/ws/queues/{self.service_point.id}/', headers=headers)
+
+    def test_cookie_authenticates_socket_and_registers_presence(self):
+        """Test the access_token cookie identifies the user, who shows up as connected until leaving"""
+        anonymous = self.connect()
+        customer = self.connect(self.customer_user)
+
+        async def scenario():
+            await anonymous.connect()
+            connected, _ = await customer.connect()
+            during = get_presence().connected(self.service_point.id)
+            await customer.disconnect()
+            await anonymous.disconnect()
+            return connected, during
+
+        connected, during = async_to_sync(scenario)()
+        self.assertTrue(connected)
+        self.assertEqual(during, [self.customer_user.id])
+        self.assertEqual(get_presence().connected(self.service_point.id), [])
+
+    def test_new_notifications_are_pushed_to_the_user(self):
+        """Test the outbox relay pushes a new notification to its user's sockets"""
+        communicator = self.connect(self.customer_user)
+
+        async def scenario():
+            await communicator.connect()
+            await database_sync_to_async(self.join_queue)()
+            messages = [await communicator.receive_json_from(), await communicator.receive_json_from()]
+            await communicator.disconnect()
+            return messages
+
+        messages = async_to_sync(scenario)()
+        pushed = [message for message in messages if message['type'] == 'notification']
+        self.assertEqual(len(pushed), 1)
+        notification = Notification.objects.get(user=self.customer_user, message__startswith='You have joined')
+        self.assertEqual(pushed[0]['data']['id'], notification.id)
+        self.assertEqual(pushed[0]['data']['message'], notification.message)
+
+    def join_queue(self):
+        self.authenticate_customer()
+        self.client.post(reverse('join_queue'), {'service_point_id': self.service_point.id}, format='json')
+        relay()
+
+    def test_heartbeat_keeps_presence_alive(self):
+        """Test entries expire after PRESENCE_TTL unless the client sends heartbeats"""
+        communicator = self.connect(self.customer_user)
+
+        async def scenario():
+            await communicator.connect()
+            with patch('queues.presence.time.time', return_value=time.time() + 45):
+                await communicator.send_json_to({'type': 'heartbeat'})
+                reply = await communicator.receive_json_from()
+            with patch('queues.presence.time.time', return_value=time.time() + 90):
+                renewed = get_presence().connected(self.service_point.id)
+            with patch('queues.presence.time.time', return_value=time.time() + 120):
+                expired = get_presence().connected(self.service_point.id)
+            await communicator.disconnect()
+            return reply, renewed, expired
+
+        with override_settings(PRESENCE_TTL=60):
+            reply, renewed, expired = async_to_sync(scenario)()
+        self.assertEqual(reply, {'type': 'heartbeat'})
+        self.assertEqual(renewed, [self.customer_user.id])
+        self.assertEqual(expired, [])
+
+    def test_presence_endpoint_is_staff_only(self):
+        """Test staff can list who is connected to their service point"""
+        get_presence().touch(self.service_point.id, self.customer_user.id, 'channel-1')
+        url = reverse('service_point_presence', args=[self.service_point.id])
+
+        self.authenticate_customer()
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_403_FORBIDDEN)
+
+        self.authenticate_staff()
+        response = self.client.get(url)
+        self.assertEqual(response.data['connected_count'], 1)
+        self.assertEqual(response.data['user_ids'], [self.customer_user.id])
+
+
+@override_settings(QUEUE_UPDATE_WINDOW=150, QUEUE_UPDATE_MAX_DELAY=500, CELERY_TASK_ALWAYS_EAGER=False)
+class QueueUpdateCoalescingTests(QueueAPITestCase):
+    """Test bursts of queue changes are broadcast once per window"""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+    def test_burst_schedules_a_single_flush(self):
+        """Test only the change opening a window schedules a broadcast"""
+        with patch('queues.tasks.flush_queue_update.apply_async') as apply_async, \
+                patch('queues.tasks.send_queue_update') as send_queue_update:
+            for _ in range(5):
+                enqueue_queue_update(self.service_point.id)
+                relay()
+        apply_async.assert_called_once_with((self.service_point.id,), countdown=0.15)
+        send_queue_update.assert_not_called()
+
+    def test_window_debounces_up_to_the_max_delay(self):
+        """Test each change pushes the flush back, but never past the max delay"""
+        sp = self.service_point.id
+        self.assertTrue(coalesce.note_update(sp, now=100.0))
+        self.assertFalse(coalesce.note_update(sp, now=100.1))
+        self.assertAlmostEqual(coalesce.due_in(sp, now=100.1), 0.15)
+        for moment in (100.2, 100.3, 100.4):
+            coalesce.note_update(sp, now=moment)
+        # The last change would move it to 100.55; the window opened at 100.0
+        self.assertAlmostEqual(coalesce.due_in(sp, now=100.4), 0.1)
+
+        coalesce.close(sp)
+        self.assertIsNone(coalesce.due_in(sp, now=100.5))
+        self.assertTrue(coalesce.note_update(sp, now=100.6))
+
+    def test_flush_waits_for_the_window_then_broadcasts_once(self):
+        """Test the flush task reschedules itself until due, then sends and closes the window"""
+        sp = self.service_point.id
+        opened = time.time()
+        coalesce.note_update(sp, now=opened)
+        with patch('queues.tasks.flush_queue_update.apply_async') as apply_async, \
+                patch('queues.tasks.send_queue_update') as send_queue_update, \
+                patch('queues.coalesce.time.time', return_value=opened + 0.05):
+            flush_queue_update(sp)
+            apply_async.assert_called_once()
+            self.assertAlmostEqual(apply_async.call_args.kwargs['countdown'], 0.1, places=3)
+            send_queue_update.assert_not_called()
+
+        with patch('queues.tasks.send_queue_update') as send_queue_update, \
+                patch('queues.coalesce.time.time', return_value=opened + 0.2):
+            flush_queue_update(sp)
+            flush_queue_update(sp)
+        send_queue_update.assert_called_once_with(sp)
+
+    def test_failed_flush_is_retried(self):
+        """Test a flush whose broadcast fails reopens the window and retries"""
+        sp = self.service_point.id
+        coalesce.note_update(sp, now=time.time() - 1)
+        with patch('queues.tasks.send_queue_update', side_effect=ConnectionError('Redis down')), \
+                patch('queues.tasks.flush_queue_update.retry', side_effect=Retry) as retry:
+            with self.assertRaises(Retry):
+                flush_queue_update(sp)
+        self.assertIsInstance(retry.call_args.kwargs['exc'], ConnectionError)
+        self.assertIsNotNone(coalesce.due_in(sp))
+
+
+class DisplayFeedTests(QueueAPITestCase):
+    """Test the snapshot and delta feed for public display screens"""
+
+    def setUp(self):
+        super().setUp()
+        self.customers = [
+            User.objects.create_user(username=f'display{i}', email=f'display{i}@test.com', password='testpass123')
+            for i in range(3)
+        ]
+
+    def join(self, user):
+        return get_queue_engine().join(self.service_point, user)
+
+    def test_snapshot_lists_serving_next_and_announcements(self):
+        """Test the snapshot carries called tickets, the next ones and live announcements"""
+        first, second, third = [self.join(user) for user in self.customers]
+        get_queue_engine().call_next([self.service_point.id], counter='2')
+        announcement = Announcement.objects.create(
+            title='Lunch', message='Back at 2pm', service_point=self.service_point, created_by=self.staff_user
+        )
+        Announcement.objects.create(
+            title='Old', message='Gone', service_point=self.service_point, created_by=self.staff_user,
+            expires_at=timezone.now() - timedelta(hours=1)
+        )
+
+        data = display.publish(self.service_point.id, send=False)['data']
+        self.assertEqual(data['serving'], [[first.ticket_number, '2']])
+        self.assertEqual(data['next'], [second.ticket_number, third.ticket_number])
+        self.assertEqual(data['announcements'], [[announcement.id, 'Lunch', 'Back at 2pm', 'medium']])
+        self.assertFalse(data['closed'])
+
+    def test_changes_are_sent_as_small_deltas(self):
+        """Test only changed parts are sent, serialized once for every screen"""
+        self.join(self.customers[0])
+        self.assertEqual(display.publish(self.service_point.id, send=False)['version'], 1)
+        self.assertEqual(display.publish(self.service_point.id, send=False)['version'], 1)
+
+        self.join(self.customers[1])
+        with patch('channels.layers.InMemoryChannelLayer.group_send') as group_send:
+            state = display.publish(self.service_point.id)
+        group, message = group_send.call_args.args
+        self.assertEqual(group, f'display_{self.service_point.id}')
+        delta = json.loads(message['text'])
+        self.assertEqual((delta['type'], delta['version'], delta['base']), ('delta', 2, 1))
+        self.assertEqual(list(delta['changes']), ['next'])
+        self.assertEqual(state['deltas'], [(2, message['text'])])
+
+    def test_publisher_behind_another_starts_over(self):
+        """Test a publisher that read an older version never overwrites a newer one"""
+        display.publish(self.service_point.id, send=False)
+        stale = display._stored(self.service_point.id)
+        self.join(self.customers[0])
+        display.publish(self.service_point.id, send=False)
+
+        # This publisher read version 1 just before another stored version 2
+        self.join(self.customers[1])
+        stored = display._stored
+        reads = iter([stale])
+        with patch.object(display, '_stored', side_effect=lambda pk: next(reads, None) or stored(pk)):
+            state = display.publish(self.service_point.id, send=False)
+        self.assertEqual(state['version'], 3)
+        self.assertEqual([json.loads(text)['base'] for _, text in state['deltas']], [1, 2])
+        self.assertEqual(DisplayState.objects.get(service_point=self.service_point).version, 3)
+
+    def test_reconnect_by_version(self):
+        """Test screens are sent what they missed, or a snapshot once it is too old"""
+        display.publish(self.service_point.id, send=False)
+        for user in self.customers[:2]:
+            self.join(user)
+            display.publish(self.service_point.id, send=False)
+
+        self.assertEqual(display.catch_up(self.service_point.id, 3), (3, []))
+        version, messages = display.catch_up(self.service_point.id, 1)
+        self.assertEqual([json.loads(text)['version'] for _, text in messages], [2, 3])
+        self.assertEqual([message_version for message_version, _ in messages], [2, 3])
+        _, messages = display.catch_up(self.service_point.id)
+        self.assertEqual(messages[0][0], 3)
+        self.assertEqual(json.loads(messages[0][1])['type'], 'snapshot')
+        with override_settings(DISPLAY_DELTA_HISTORY=1):
+            self.join(self.customers[2])
+            display.publish(self.service_point.id, send=False)
+        _, messages = display.catch_up(self.service_point.id, 1)
+        self.assertEqual([json.loads(text)['type'] for _, text in messages], ['snapshot'])
+
+    def test_screen_socket_needs_no_login(self):
+        """Test an anonymous screen gets a snapshot, live deltas, and resumes from its version"""
+        application = URLRouter(websocket_urlpatterns)
+
+        async def scenario():
+            screen = WebsocketCommunicator(application, f'/ws/display/{self.service_point.id}/')
+            connected, _ = await screen.connect()
+            snapshot = await screen.receive_json_from()
+            await database_sync_to_async(self.join)(self.customers[0])
+            await database_sync_to_async(display.publish)(self.service_point.id)
+            delta = await screen.receive_json_from()
+            await screen.disconnect()
+
+            resumed = WebsocketCommunicator(application, f'/ws/display/{self.service_point.id}/?version=1')
+            await resumed.connect()
+            missed = await resumed.receive_json_from()
+            await resumed.disconnect()
+            return connected, snapshot, delta, missed
+
+        connected, snapshot, delta, missed = async_to_sync(scenario)()
+        self.assertTrue(connected)
+        self.assertEqual((snapshot['type'], snapshot['version']), ('snapshot', 1))
+        self.assertEqual((delta['type'], delta['base'], delta['version']), ('delta', 1, 2))
+        self.assertEqual(missed, delta)
+
+    def test_event_stream_resumes_from_last_event_id(self):
+        """Test the SSE feed sends the missed deltas after Last-Event-ID"""
+        display.publish(self.service_point.id, send=False)
+        self.join(self.customers[0])
+        display.publish(self.service_point.id, send=False)
+        path = f'/events/display/{self.service_point.id}/'
+
+        async def scenario():
+            stream = ApplicationCommunicator(URLRouter(http_urlpatterns), {
+                'type': 'http', 'method': 'GET', 'path': path, 'query_string': b'',
+                'headers': [(b'last-event-id', b'1')],
+            })
+            await stream.send_input({'type': 'http.request', 'body': b''})
+            start = await stream.receive_output()
+            body = await stream.receive_output()
+            await stream.send_input({'type': 'http.disconnect'})
+            await stream.wait()
+            return start, body
+
+        start, body = async_to_sync(scenario)()
+        self.assertIn((b'Content-Type', b'text/event-stream'), start['headers'])
+        event_id, data = body['body'].decode().strip().split('\n')
+        self.assertEqual(event_id, 'id: 2')
+        self.assertEqual(json.loads(data[len('data: '):])['type'], 'delta')
+        self.assertTrue(body['more_body'])
+
+    def test_event_stream_gives_each_missed_delta_its_id(self):
+        """Test every replayed delta carries its own version as event id"""
+        display.publish(self.service_point.id, send=False)
+        for user in self.customers[:2]:
+            self.join(user)
+            display.publish(self.service_point.id, send=False)
+        path = f'/events/display/{self.service_point.id}/'
+
+        async def scenario():
+            stream = ApplicationCommunicator(URLRouter(http_urlpatterns), {
+                'type': 'http', 'method': 'GET', 'path': path, 'query_string': b'',
+                'headers': [(b'last-event-id', b'1')],
+            })
+            await stream.send_input({'type': 'http.request', 'body': b''})
+            await stream.receive_output()
+            body = await stream.receive_output()
+            await stream.send_input({'type': 'http.disconnect'})
+            await stream.wait()
+            return body
+
+        body = async_to_sync(scenario)()
+        events = body['body'].decode().strip().split('\n\n')
+        self.assertEqual([event.split('\n')[0] for event in events], ['id: 2', 'id: 3'])
+
+    def test_event_stream_delivers_live_deltas(self):
+        """Test the SSE stream stays open and forwards deltas published after connecting"""
+        display.publish(self.service_point.id, send=False)
+        path = f'/events/display/{self.service_point.id}/'
+
+        async def scenario():
+            stream = ApplicationCommunicator(URLRouter(http_urlpatterns), {
+                'type': 'http', 'method': 'GET', 'path': path, 'query_string': b'', 'headers': [],
+            })
+            await stream.send_input({'type': 'http.request', 'body': b''})
+            await stream.receive_output()
+            snapshot = await stream.receive_output()
+            await database_sync_to_async(self.join)(self.customers[0])
+            await database_sync_to_async(display.publish)(self.service_point.id)
+            live = await stream.receive_output(timeout=2)
+            await stream.send_input({'type': 'http.disconnect'})
+            await stream.wait()
+            return snapshot, live
+
+        snapshot, live = async_to_sync(scenario)()
+        self.assertTrue(snapshot['body'].startswith(b'id: 1\n'))
+        event_id, data = live['body'].decode().strip().split('\n')
+        self.assertEqual(event_id, 'id: 2')
+        delta = json.loads(data[len('data: '):])
+        self.assertEqual((delta['type'], delta['base'], delta['version']), ('delta', 1, 2))
+        self.assertTrue(live['more_body'])
+
+
+class LoadTestSummaryTests(TestCase):
+    def test_summary_reports_throughput_and_percentiles(self):
+        latencies = [i / 1000 for i in range(1, 101)]
+        summary = summarise(latencies, {'200': 100}, 0, 10)
+        self.assertEqual(summary['requests'], 100)
+        self.assertEqual(summary['throughput'], 10.0)
+        self.assertEqual(summary['p50_ms'], 50.5)
+        self.assertEqual(summary['p99_ms'], 99.01)
+        self.assertEqual(summary['max_ms'], 100.0)
+        self.assertNotIn('p50_ms', summarise([], {}, 0, 10))
+
+
+class QueueBroadcastTests(QueueAPITestCase):
+    """Test queue updates are broadcast once per group and filtered per subscriber"""
+
+    def connect(self, user):
+        communicator = WebsocketCommunicator(
+            URLRouter(websocket_urlpatterns),
+            f'/ws/queues/{self.service_point.id}/'
+        )
+        communicator.scope['user'] = user
+        return communicator
+
+    def test_single_group_message_per_update(self):
+        """Test send_queue_update emits one group message with the queue order"""
+        entry = QueueEntry.objects.create(service_point=self.service_point, user=self.customer_user)
+        with patch('channels.layers.InMemoryChannelLayer.group_send') as group_send:
+            send_queue_update(self.service_point.id)
+        # The other group message goes to the display screens
+        queue_sends = [call.args for call in group_send.call_args_list if call.args[0] == f'queue_{self.service_point.id}']
+        self.assertEqual(len(queue_sends), 1)
+        _, message = queue_sends[0]
+        self.assertEqual(message['data']['queue_length'], 1)
+        self.assertEqual(json.loads(message['data']['queue']), [[entry.id, self.customer_user.id, 0]])
+
+    @override_settings(DEFAULT_SERVICE_DURATION=5)
+    def test_subscribers_receive_their_own_position(self):
+        """Test each consumer forwards only its own user's position"""
+        other = User.objects.create_user(username='broadcastother', email='bo@test.com', password='testpass123')
+        QueueEntry.objects.create(service_point=self.service_point, user=other)
+        entry = QueueEntry.objects.create(service_point=self.service_point, user=self.customer_user)
+
+        async def scenario():
+            customer = self.connect(self.customer_user)
+            staff = self.connect(self.staff_user)
+            await customer.connect()
+            await staff.connect()
+            await database_sync_to_async(send_queue_update)(self.service_point.id)
+            customer_update = await customer.receive_json_from()
+            staff_update = await staff.receive_json_from()
+            await customer.disconnect()
+            await staff.disconnect()
+            return customer_update, staff_update
+
+        customer_update, staff_update = async_to_sync(scenario)()
+        self.assertEqual(customer_update['data']['position'], 2)
+        self.assertEqual(customer_update['data']['eta_seconds'], 5 * 60)
+        self.assertEqual(customer_update['data']['queue_entry_id'], entry.id)
+        self.assertEqual(customer_update['data']['queue_length'], 2)
+        self.assertNotIn('position', staff_update['data'])
+        self.assertEqual(staff_update['data']['queue_length'], 2)
+        self.assertNotIn('queue', staff_update['data'])
+
+
+class ServicePointCounterTests(QueueAPITestCase):
+    """Test the denormalised queue counters on ServicePoint"""
+
+    def counts(self):
+        self.service_point.refresh_from_db()
+        return (
+            self.service_point.active_count,
+            self.service_point.waiting_count,
+            self.service_point.called_count,
+        )
+
+    def test_counters_follow_queue_transitions(self):
+        """Test join, call, serve and leave keep the counters in step"""
+        other = User.objects.create_user(username='counterother', email='co@test.com', password='testpass123')
+        self.client.force_authenticate(user=other)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('join_queue'), {'service_point_id': self.service_point.id})
+        self.authenticate_customer()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('join_queue'), {'service_point_id': self.service_point.id})
+        self.assertEqual(self.counts(), (2, 2, 0))
+
+        self.authenticate_staff()
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('call_next'))
+        self.assertEqual(self.counts(), (2, 1, 1))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('dismiss_customer'), {'queue_entry_id': response.data['id']})
+        self.assertEqual(self.counts(), (1, 1, 0))
+
+        self.authenticate_customer()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('leave_queue'))
+        self.assertEqual(self.counts(), (0, 0, 0))
+
+    def test_counters_move_after_commit(self):
+        """Test a join leaves the service point row alone until it commits"""
+        with self.captureOnCommitCallbacks() as callbacks:
+            get_queue_engine().join(self.service_point, self.customer_user)
+            self.assertEqual(self.counts(), (0, 0, 0))
+        for callback in callbacks:
+            callback()
+        self.assertEqual(self.counts(), (1, 1, 0))
+
+    def test_counters_do_not_go_negative(self):
+        """Test a transition of an entry written outside the engine clamps the counters at zero"""
+        entry = QueueEntry.objects.create(
+            service_point=self.service_point, user=self.customer_user, status='called', called_at=timezone.now()
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            get_queue_engine().serve(entry)
+        self.assertEqual(self.counts(), (0, 0, 0))
+
+    def test_repair_command_recounts(self):
+        """Test repair_queue_counters rebuilds counters from queue entries"""
+        QueueEntry.objects.create(service_point=self.service_point, user=self.customer_user)
+        QueueEntry.objects.create(service_point=self.service_point, user=self.staff_user, status='called')
+        ServicePoint.objects.filter(pk=self.service_point.pk).update(active_count=7, waiting_count=7)
+
+        out = StringIO()
+        call_command('repair_queue_counters', stdout=out)
+        self.assertIn('Repaired 1 service point(s).', out.getvalue())
+        self.assertEqual(self.counts(), (2, 1, 1))
+
+    def test_listings_use_constant_queries(self):
+        """Test service point listings do not query per service point"""
+        service_type = ServiceType.objects.create(name='Counter', estimated_duration=timedelta(minutes=5))
+        for i in range(10):
+            ServicePoint.objects.create(name=f'Branch {i}', creator=self.staff_user).service_types.add(service_type)
+        self.authenticate_customer()
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('public_service_points'))
+        self.assertEqual(len(response.json()), 11)
+        with self.assertNumQueries(2):
+            self.client.get(reverse('service_points'))
+
+
+class PublicServicePointsCacheTests(QueueAPITestCase):
+    """Test the cached, conditional public service point listing"""
+
+    def get(self, **headers):
+        return self.client.get(reverse('public_service_points'), **headers)
+
+    def test_listing_carries_validators(self):
+        """Test the listing is returned with ETag and Last-Modified headers"""
+        response = self.get()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()[0]['name'], 'Test Service Point')
+        self.assertIn('ETag', response)
+        self.assertIn('Last-Modified', response)
+
+    def test_repeat_request_is_not_modified(self):
+        """Test matching If-None-Match or If-Modified-Since gets a 304"""
+        response = self.get()
+        not_modified = self.get(HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(not_modified.status_code, status.HTTP_304_NOT_MODIFIED)
+        not_modified = self.get(HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(not_modified.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_cached_listing_needs_no_queries(self):
+        """Test a warm cache answers anonymous requests without the database"""
+        self.get()
+        with self.assertNumQueries(0):
+            response = self.get()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_queue_change_invalidates_listing(self):
+        """Test joining a queue changes the listing and its ETag"""
+        etag = self.get()['ETag']
+        self.authenticate_customer()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('join_queue'), {'service_point_id': self.service_point.id})
+        self.client.force_authenticate(user=None)
+
+        response = self.get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.json()[0]['queue_length'], 1)
+
+    def test_service_point_change_invalidates_listing(self):
+        """Test editing a service point changes the listing"""
+        self.get()
+        self.service_point.name = 'Renamed Point'
+        self.service_point.save()
+        self.assertEqual(self.get().json()[0]['name'], 'Renamed Point')
+
+
+class QueryPlanTests(TestCase):
+    """Test the hot queue queries are answered from indexes on a large dataset"""
+
+    USERS = 500
+    SERVICE_POINTS = 20
+    ENTRIES = 20000
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = User.objects.bulk_create([
+            User(username=f'planuser{i}', email=f'planuser{i}@test.com') for i in range(cls.USERS)
+        ])
+        cls.service_points = ServicePoint.objects.bulk_create([
+            ServicePoint(name=f'Plan Point {i}', creator=cls.users[0]) for i in range(cls.SERVICE_POINTS)
+        ])
+        # Mostly finished history with a few entries still waiting, as in production
+        QueueEntry.objects.bulk_create([
+            QueueEntry(
+                service_point=cls.service_points[i % cls.SERVICE_POINTS],
+                user=cls.users[i % cls.USERS],
+                sequence=i // cls.SERVICE_POINTS + 1,
+                status='joined' if i % 50 == 0 else 'served',
+                ticket_number=f'PLAN{i}'
+            ) for i in range(cls.ENTRIES)
+        ], batch_size=1000)
+        Notification.objects.bulk_create([
+            Notification(user=cls.users[i % cls.USERS], message='Plan') for i in range(cls.ENTRIES)
+        ], batch_size=1000)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        cls.user = cls.users[3]
+        cls.service_point = cls.service_points[2]
+
+    def assertIndexScan(self, queryset, *index_names):
+        """Assert the plan reads ``queryset``'s table through one of ``index_names``"""
+        plan = queryset.explain()
+        table = queryset.model._meta.db_table
+        # PostgreSQL reports "Seq Scan on <table>", SQLite "SCAN <table>"
+        self.assertNotRegex(plan, rf'Seq Scan on {table}\b|\bSCAN {table}\b', plan)
+        self.assertTrue(any(name in plan for name in index_names), plan)
+
+    def test_active_entry_of_user(self):
+        """Test the already-in-a-queue check uses a user index"""
+        self.assertIndexScan(
+            QueueEntry.objects.filter(user=self.user, status__in=ACTIVE_STATUSES),
+            'queueentry_user_active_idx', 'queues_queueentry_user_id'
+        )
+
+    def test_entries_of_user_by_join_time(self):
+        """Test my_queues and my_queue_position use the user/joined_at index"""
+        self.assertIndexScan(
+            QueueEntry.objects.filter(user=self.user).order_by('-joined_at', '-id'),
+            'queueentry_user_joined_idx'
+        )
+
+    def test_call_next(self):
+        """Test call_next finds the head of the queue through a service point index"""
+        self.assertIndexScan(
+            QueueEntry.objects.filter(
+                service_point_id__in=[self.service_point.id], status='joined'
+            ).order_by('sequence', 'id'),
+            'queueentry_sp_active_idx', 'queueentry_sp_sequence_idx'
+        )
+
+    def test_position_count(self):
+        """Test counting entries ahead of one uses a service point index"""
+        self.assertIndexScan(
+            QueueEntry.objects.filter(
+                service_point_id=self.service_point.id, status__in=ACTIVE_STATUSES, sequence__lte=500
+            ),
+            'queueentry_sp_active_idx', 'queueentry_sp_sequence_idx'
+        )
+
+    def test_queue_positions(self):
+        """Test ranking a whole queue uses a service point index"""
+        self.assertIndexScan(
+            QueueEntry.objects.filter(
+                service_point_id=self.service_point.id, status__in=ACTIVE_STATUSES
+            ).annotate(rank=Window(RowNumber(), order_by=[F('sequence').asc(), F('id').asc()])),
+            'queueentry_sp_active_idx', 'queueentry_sp_sequence_idx'
+        )
+
+    def test_notifications_of_user(self):
+        """Test the notification list uses the user/created_at index"""
+        self.assertIndexScan(
+            Notification.objects.filter(user=self.user).order_by('-created_at', '-id'),
+            'notification_user_created_idx'
+        )
+
+    def test_sequential_scan_is_detected(self):
+        """Test a filter on an unindexed column fails the plan assertion"""
+        with self.assertRaises(AssertionError):
+            self.assertIndexScan(QueueEntry.objects.filter(staff_notes='none'), 'queueentry_sp_active_idx')
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+async def _receive_ws_text(port, path, ready, timeout=10):
+    """
+    Minimal WebSocket client: perform the handshake, call ``ready`` once the
+    socket is subscribed and return the first text frame sent by the server.
+    """
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    key = base64.b64encode(os.urandom(16)).decode()
+    writer.write((
+        f'GET {path} HTTP/1.1\r\nHost: 127.0.0.1:{port}\r\nUpgrade: websocket\r\n'
+        f'Connection: Upgrade\r\nSec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n\r\n'
+    ).encode())
+    await writer.drain()
+    handshake = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), timeout)
+    if b' 101 ' not in handshake.split(b'\r\n', 1)[0]:
+        raise AssertionError(handshake.decode(errors='replace'))
+
+    await asyncio.get_running_loop().run_in_executor(None, ready)
+
+    header = await asyncio.wait_for(reader.readexactly(2), timeout)
+    length = header[1] & 0x7f
+    if length == 126:
+        length = int.from_bytes(await reader.readexactly(2), 'big')
+    elif length == 127:
+        length = int.from_bytes(await reader.readexactly(8), 'big')
+    payload = await asyncio.wait_for(reader.readexactly(length), timeout)
+    writer.close()
+    return payload.decode()
+
+
+@skipUnless(os.getenv('CHANNEL_REDIS_TEST_URLS'), 'CHANNEL_REDIS_TEST_URLS is not set')
+class MultiWorkerChannelLayerTests(TransactionTestCase):
+    """Test queue updates reach sockets held by another ASGI worker through Redis"""
+
+    def setUp(self):
+        if connection.vendor == 'sqlite' and connection.settings_dict['NAME'] in ('', ':memory:') \
+                or 'mode=memory' in str(connection.settings_dict['NAME']):
+            self.skipTest('ASGI workers need a database shared across processes')
+        self.customer = User.objects.create_user(
+            username='multiworker', email='mw@test.com', password='testpass123'
+        )
+        staff = User.objects.create_user(
+            username='multiworkerstaff', email='mws@test.com', password='testpass123', role='staff'
+        )
+        self.service_point = ServicePoint.objects.create(name='Multi Worker', creator=staff)
+        self.workers = [self.start_worker() for _ in range(2)]
+
+    def tearDown(self):
+        for process, _ in self.workers:
+            process.terminate()
+            process.wait(timeout=10)
+
+    def start_worker(self):
+        port = _free_port()
+        env = dict(
+            os.environ,
+            DJANGO_SETTINGS_MODULE=os.environ.get('DJANGO_SETTINGS_MODULE', 'queueflow.settings'),
+            DB_NAME=str(connection.settings_dict['NAME']),
+            CHANNEL_LAYER='redis',
+            CHANNEL_REDIS_URLS=os.environ['CHANNEL_REDIS_TEST_URLS'],
+            CELERY_TASK_ALWAYS_EAGER='True',
+            OUTBOX_RELAY_ON_COMMIT='True',
+        )
+        process = subprocess.Popen(
+            [sys.executable, '-m', 'daphne', '-b', '127.0.0.1', '-p', str(port), 'queueflow.asgi:application'],
+            cwd=settings.BASE_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=1).close()
+                break
+            except OSError:
+                if process.poll() is not None or time.monotonic() > deadline:
+                    process.kill()
+                    self.fail('ASGI worker did not start')
+                time.sleep(0.2)
+        return process, port
+
+    def test_join_on_one_worker_reaches_socket_on_other(self):
+        """Test a join handled by worker A is broadcast to a socket on worker B"""
+        (_, port_a), (_, port_b) = self.workers
+        token = str(RefreshToken.for_user(self.customer).access_token)
+
+        def join():
+            request = urllib.request.Request(
+                f'http://127.0.0.1:{port_a}/api/queues/join/',
+                data=json.dumps({'service_point_id': self.service_point.id}).encode(),
+                headers={'Content-Type': 'application/json', 'Authorization': f'Bearer {token}'},
+                method='POST'
+            )
+            with urllib.request.urlopen(request, timeout=10) as response:
+                self.assertEqual(response.status, 200)
+
+        message = json.loads(asyncio.run(
+            _receive_ws_text(port_b, f'/ws/queues/{self.service_point.id}/', join)
+        ))
+        self.assertEqual(message['type'], 'queue_update')
+        self.assertEqual(message['data']['service_point_id'], self.service_point.id)
+        self.assertEqual(message['data']['queue_length'], 1)
@@ -0,0 +1,109 @@
+"""
+Human friendly ticket numbers such as ``A-042``, counting from 1 per service
+point and day.
+
+Numbers are claimed from the day's ``TicketCounter`` row in blocks of
+``TICKET_BLOCK_SIZE`` and handed out from memory, so only one join in a block
+writes to the shared row. A block is exclusively owned by the process that
+claimed it, which makes tickets unique without retrying on conflicts.
+Numbers left in a block when a process stops are skipped.
+
+The first number of a block is used by the join that claimed it; the rest
+of the block only becomes available once that claim has committed, so a
+rolled back claim can never hand out numbers another process claims again.
+
+Ticket numbers are labels only. Processes holding blocks claimed at
+different times hand out numbers out of join order, so the queue order comes
+from ``QueueEntry.sequence`` instead.
+"""
+import threading
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import TicketCounter
+
+_lock = threading.Lock()
+# (service_point_id, day) -> list of [next, last] ranges owned by this process
+_blocks = {}
+
+
+def format_ticket(prefix, number):
+    return f'{prefix}-{number:03d}'
+
+
+def claim_block(service_point_id, day, size):
+    """
+    Claim the next ``size`` numbers of a service point's day and return the
+    first and last of them.
+    """
+    counters = TicketCounter.objects.filter(service_point_id=service_point_id, day=day)
+    with transaction.atomic():
+        if not counters.update(last_number=F('last_number') + size):
+            try:
+                with transaction.atomic():
+                    TicketCounter.objects.create(service_point_id=service_point_id, day=day, last_number=size)
+            except IntegrityError:
+                # Created concurrently since the update above
+                counters.update(last_number=F('last_number') + size)
+        last = counters.values_list('last_number', flat=True).get()
+    return last - size + 1, last
+
+
+def _release(key, first, last):
+    with _lock:
+        _blocks.setdefault(key, []).append([first, last])
+
+
+def _take(key):
+    with _lock:
+        ranges = _blocks.get(key)
+        while ranges:
+            number, last = ranges[0]
+            if number <= last:
+                ranges[0][0] += 1
+                return number
+            ranges.pop(0)
+        return None
+
+
+def allocate(service_point_id, day=None, block_size=None):
+    """
+    Return the next ticket number of a service point for ``day`` (today by
+    default).
+    """
+    day = day or timezone.localdate()
+    block_size = block_size or settings.TICKET_BLOCK_SIZE
+    key = (service_point_id, day)
+
+    number = _take(key)
+    if number is not None:
+        return number
+
+    with _lock:
+        # Blocks of earlier days will not be used again
+        for stale in [k for k in _blocks if k[1] != day]:
+            del _blocks[stale]
+
+    first, last = claim_block(service_point_id, day, block_size)
+    if last > first:
+        transaction.on_commit(lambda: _release(key, first + 1, last))
+    return first
+
+
+def next_ticket(service_point):
+    """
+    Return ``(ticket_number, ticket_day)`` for a new entry of ``service_point``.
+    """
+    day = timezone.localdate()
+    return format_ticket(service_point.ticket_prefix, allocate(service_point.id, day)), day
+
+
+def reset():
+    """
+    Forget the blocks held by this process; their remaining numbers are skipped.
+    """
+    with _lock:
+        _blocks.clear()
@@ -1,20 +1,12 @@
-from django.core.mail import send_mail
-from django.conf import settings
+from .mailer import queue_email
 
 
 def send_queue_notification_email(user_email, message):
     """
-    Send an email notification to the user.
+    Queue an email notification to the user for the pooled email dispatcher.
     """
-    subject = "Queue Notification"
     try:
-        send_mail(
-            subject,
-            message,
-            settings.DEFAULT_FROM_EMAIL,
-            [user_email],
-            fail_silently=True,  # Changed to True to prevent API failures
-        )
+        queue_email(user_email, message)
     except Exception as e:
         # Log the error but don't fail the API call
-        print(f"Email sending failed: {e}")
+        print(f"Email queueing failed: {e}")
@@ -2,23 +2,50 @@ from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.response import Response
 from rest_framework import status
+from django.conf import settings
+from django.http import HttpResponse
+from django.urls import reverse
 from django.utils import timezone
-from django.db.models import F, Avg, Count, Max, ExpressionWrapper, DurationField
+from django.utils.cache import get_conditional_response
+from django.utils.dateparse import parse_date
+from django.utils.http import http_date
+from django.db import transaction
+from django.db.models import Sum
 from django.db.models.functions import ExtractHour
-from datetime import timedelta
-from .models import QueueEntry, Notification, ServicePoint
-from .serializers import ServicePointSerializer, QueueEntrySerializer, JoinQueueSerializer, NotificationSerializer
-from .tasks import send_queue_notification_email, send_queue_update
+from datetime import datetime, time, timedelta
+from .caching import public_listing
+from .closure import close_service_points
+from .engine import get_queue_engine
+from .estimator import queue_etas
+from .models import QueueEntry, Notification, ServicePoint, ClosureJob, DailySketch, HourlyRollup
+from .serializers import ServicePointSerializer, QueueEntrySerializer, JoinQueueSerializer, NotificationSerializer, ClosureJobSerializer
+from .outbox import enqueue_email, enqueue_notifications, enqueue_queue_update
+from .pagination import KeysetPagination
+from .presence import get_presence
+from .rollups import percentiles as rollup_percentiles
+from .staffing import MAX_WEEKS, forecast
 
 @api_view(['GET'])
 @permission_classes([AllowAny])
 def public_service_points(request):
     """
     List all active service points for public view (landing page).
+    Served from the versioned listing cache, with conditional GET support.
     """
-    service_points = ServicePoint.objects.filter(is_active=True)
-    serializer = ServicePointSerializer(service_points, many=True)
-    return Response(serializer.data)
+    def build():
+        service_points = ServicePoint.objects.filter(is_active=True).prefetch_related('service_types')
+        return ServicePointSerializer(service_points, many=True).data
+
+    body, etag, last_modified = public_listing(build)
+    not_modified = get_conditional_response(request, etag=etag, last_modified=int(last_modified))
+    if not_modified is not None:
+        return not_modified
+
+    response = HttpResponse(body, content_type='application/json')
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    response['Cache-Control'] = 'public, max-age=0, must-revalidate'
+    return response
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
@@ -43,31 +70,23 @@ def dismiss_customer(request):
         if queue_entry.service_point.creator != request.user:
             return Response({'error': 'You can only dismiss customers from your service points.'}, status=status.HTTP_403_FORBIDDEN)
 
-        # Mark as served
-        queue_entry.status = 'served'
-        queue_entry.served_at = timezone.now()
-        queue_entry.save()
-
-        # Update positions of remaining customers
-        QueueEntry.objects.filter(
-            service_point=queue_entry.service_point,
-            position__gt=queue_entry.position,
-            status='waiting'
-        ).update(position=F('position') - 1)
-
-        # Send notification to the dismissed customer
-        Notification.objects.create(
-            user=queue_entry.user,
-            message='Your service has been completed. Thank you for your patience!'
-        )
+        with transaction.atomic():
+            # Mark as served and move the rest of the queue up
+            get_queue_engine().serve(queue_entry)
 
-        # Send email notification
-        send_queue_notification_email(
-            queue_entry.user.email,
-            'Your service has been completed. Thank you for your patience!'
-        )
+            # Send notification to the dismissed customer
+            notification = Notification.objects.create(
+                user=queue_entry.user,
+                message='Your service has been completed. Thank you for your patience!'
+            )
+            enqueue_notifications([notification])
 
-        send_queue_update(queue_entry.service_point.id)
+            # Email and queue update are delivered by the outbox relay
+            enqueue_email(
+                queue_entry.user.email,
+                'Your service has been completed. Thank you for your patience!'
+            )
+            enqueue_queue_update(queue_entry.service_point_id)
 
         return Response({'message': f'Customer {queue_entry.user.username} has been dismissed.'})
 
@@ -100,33 +119,30 @@ def join_queue(request):
     if existing_entry:
         return Response({'error': 'You are already in a queue.'}, status=status.HTTP_400_BAD_REQUEST)
 
-    # Get the next position
-    last_position = QueueEntry.objects.filter(
-        service_point=service_point,
-        status__in=['waiting', 'called']
-    ).aggregate(max_pos=Max('position'))['max_pos'] or 0
-
-    position = last_position + 1
+    with transaction.atomic():
+        # Create queue entry at the back of the queue
+        queue_entry = get_queue_engine().join(service_point, request.user)
+        position = queue_entry.position
 
-    # Create queue entry
-    queue_entry = QueueEntry.objects.create(
-        service_point=service_point,
-        user=request.user,
-        position=position
-    )
+        # The new entry's foreign key locks the service point against a
+        # concurrent closure (see close_service_points), which may have
+        # committed since the point was read above
+        if not ServicePoint.objects.filter(pk=service_point.id, is_active=True).exists():
+            transaction.set_rollback(True)
+            return Response({'error': 'Service point not found or inactive.'}, status=status.HTTP_404_NOT_FOUND)
 
-    # Send notification
-    Notification.objects.create(
-        user=request.user,
-        message=f'You have joined the queue for {service_point.name}. Your position is {position}.'
-    )
-
-    send_queue_notification_email(
-        request.user.email,
-        f'You have joined the queue for {service_point.name}. Your position is {position}.'
-    )
+        # Send notification
+        notification = Notification.objects.create(
+            user=request.user,
+            message=f'You have joined the queue for {service_point.name}. Your position is {position}.'
+        )
+        enqueue_notifications([notification])
 
-    send_queue_update(service_point.id)
+        enqueue_email(
+            request.user.email,
+            f'You have joined the queue for {service_point.name}. Your position is {position}.'
+        )
+        enqueue_queue_update(service_point.id)
 
     return Response({
         'message': f'Successfully joined queue for {service_point.name}.',
@@ -146,6 +162,10 @@ def my_queue_position(request):
     ).order_by('-joined_at').first()
     if not queue_entry:
         return Response({'error': 'You are not in any queue.'}, status=status.HTTP_404_NOT_FOUND)
+    queue_entry.position = get_queue_engine().position(queue_entry)
+    if queue_entry.estimated_wait_time is None:
+        # Not refreshed by a queue update yet
+        queue_entry.estimated_wait_time = queue_etas(queue_entry.service_point_id).get(queue_entry.id)
     serializer = QueueEntrySerializer(queue_entry)
     return Response(serializer.data)
 
@@ -160,6 +180,7 @@ def service_points(request):
         service_points = ServicePoint.objects.filter(is_active=True, creator=request.user)
     else:
         service_points = ServicePoint.objects.filter(is_active=True)
+    service_points = service_points.prefetch_related('service_types')
     serializer = ServicePointSerializer(service_points, many=True)
     return Response(serializer.data)
 
@@ -194,26 +215,13 @@ def delete_service_point(request, service_point_id):
     except ServicePoint.DoesNotExist:
         return Response({'error': 'Service point not found or you do not own it.'}, status=status.HTTP_404_NOT_FOUND)
 
-    # Mark all active queue entries as abandoned before deleting
-    QueueEntry.objects.filter(
-        service_point=service_point,
-        status__in=['joined', 'waiting', 'called']
-    ).update(status='abandoned')
-
-    # Send notifications to users in the queue
-    active_entries = QueueEntry.objects.filter(service_point=service_point, status='abandoned')
-    for entry in active_entries:
-        Notification.objects.create(
-            user=entry.user,
-            message=f'The service point {service_point.name} has been closed. Your queue entry has been cancelled.'
-        )
-        send_queue_notification_email(
-            entry.user.email,
-            f'The service point {service_point.name} has been closed. Your queue entry has been cancelled.'
-        )
-
-    service_point.delete()
-    return Response({'message': 'Service point deleted successfully.'})
+    # Close now; the rows are deleted in the background
+    job = close_service_points(request.user, [service_point.id])
+    return Response({
+        'message': 'Service point deleted successfully.',
+        'job_id': job.id,
+        'status_url': reverse('closure_job_status', args=[job.id]),
+    })
 
 
 @api_view(['DELETE'])
@@ -221,50 +229,87 @@ def delete_service_point(request, service_point_id):
 def delete_all_service_points(request):
     """
     Staff can delete all their service points, regardless of queue status.
+    With ``?mode=bulk`` they are closed at once and deleted in the background.
     """
     if request.user.role != 'staff':
         return Response({'error': 'Only staff can delete service points.'}, status=status.HTTP_403_FORBIDDEN)
 
+    if request.query_params.get('mode') == 'bulk':
+        # Close every point now and delete them in the background
+        service_point_ids = list(ServicePoint.objects.filter(creator=request.user).values_list('id', flat=True))
+        job = close_service_points(request.user, service_point_ids)
+        return Response({
+            'message': f'Successfully deleted {len(job.service_point_ids)} service points.',
+            'job_id': job.id,
+            'status_url': reverse('closure_job_status', args=[job.id]),
+        })
+
     deleted_count, _ = ServicePoint.objects.filter(creator=request.user).delete()
     return Response({'message': f'Successfully deleted {deleted_count} service points.'})
 
 
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def closure_job_status(request, job_id):
+    """
+    Progress of a background service point closure started by the user.
+    """
+    try:
+        job = ClosureJob.objects.get(id=job_id, created_by=request.user)
+    except ClosureJob.DoesNotExist:
+        return Response({'error': 'Closure job not found.'}, status=status.HTTP_404_NOT_FOUND)
+    return Response(ClosureJobSerializer(job).data)
+
+
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def call_next(request):
     """
-    Staff call next customer in queue.
+    Staff call next customer in queue, from one ``service_point_id`` or
+    from any of their service points, to an optional ``counter``. Several
+    tellers can call from the same queue at once; each gets a different
+    customer.
     """
     if request.user.role != 'staff':
         return Response({'error': 'Only staff can call next customer.'}, status=status.HTTP_403_FORBIDDEN)
 
-    # Find the next waiting customer for any of the staff's service points
-    try:
-        queue_entry = QueueEntry.objects.filter(
-            service_point__creator=request.user,
-            status='joined'
-        ).order_by('position').first()
-
-        if not queue_entry:
-            return Response({'error': 'No customers waiting in your queues.'}, status=status.HTTP_404_NOT_FOUND)
-
-        # Mark as called
-        queue_entry.status = 'called'
-        queue_entry.called_at = timezone.now()
-        queue_entry.save()
-
-        # Send notification
-        Notification.objects.create(
-            user=queue_entry.user,
-            message=f'Your turn! Please proceed to {queue_entry.service_point.name}.'
-        )
+    counter = str(request.data.get('counter') or '')[:20]
+    service_points = ServicePoint.objects.filter(creator=request.user)
+    service_point_id = request.data.get('service_point_id')
+    if service_point_id:
+        try:
+            service_points = service_points.filter(pk=int(service_point_id))
+        except (TypeError, ValueError):
+            return Response({'error': 'service_point_id must be an id.'}, status=status.HTTP_400_BAD_REQUEST)
 
-        send_queue_notification_email(
-            queue_entry.user.email,
-            f'Your turn! Please proceed to {queue_entry.service_point.name}.'
-        )
+    # Find the next waiting customer for the chosen or any of the staff's service points
+    try:
+        service_point_ids = list(service_points.values_list('id', flat=True))
+        if service_point_id and not service_point_ids:
+            return Response({'error': 'Service point not found or you do not own it.'}, status=status.HTTP_404_NOT_FOUND)
+
+        with transaction.atomic():
+            # Take the customer off the queue and mark as called
+            queue_entry = get_queue_engine().call_next(service_point_ids, counter)
+
+            if not queue_entry:
+                return Response({'error': 'No customers waiting in your queues.'}, status=status.HTTP_404_NOT_FOUND)
+
+            # Send notification
+            destination = queue_entry.service_point.name
+            if counter:
+                destination += f', counter {counter}'
+            notification = Notification.objects.create(
+                user=queue_entry.user,
+                message=f'Your turn! Please proceed to {destination}.'
+            )
+            enqueue_notifications([notification])
 
-        send_queue_update(queue_entry.service_point.id)
+            enqueue_email(
+                queue_entry.user.email,
+                f'Your turn! Please proceed to {destination}.'
+            )
+            enqueue_queue_update(queue_entry.service_point_id)
 
         serializer = QueueEntrySerializer(queue_entry)
         return Response(serializer.data)
@@ -277,44 +322,128 @@ def call_next(request):
 @permission_classes([IsAuthenticated])
 def analytics(request):
     """
-    Provide queue analytics.
+    Provide queue analytics, optionally between the ``start`` and ``end``
+    dates (inclusive, YYYY-MM-DD) and for some ``service_points`` (comma
+    separated ids). Read from the hourly rollups and daily sketches, so the
+    cost does not grow with the number of queue entries.
     """
     if request.user.role != 'staff':
         return Response({'error': 'Only staff can view analytics.'}, status=status.HTTP_403_FORBIDDEN)
 
-    # Get analytics for staff's service points
-    service_points = ServicePoint.objects.filter(creator=request.user)
+    rollups = HourlyRollup.objects.filter(service_point__creator=request.user)
+    sketches = DailySketch.objects.filter(service_point__creator=request.user)
 
-    # Total queues (all entries)
-    total_queues = QueueEntry.objects.filter(service_point__in=service_points).count()
+    service_point_ids = request.query_params.get('service_points')
+    if service_point_ids:
+        try:
+            service_point_ids = [int(pk) for pk in service_point_ids.split(',')]
+        except ValueError:
+            return Response({'error': 'service_points must be comma separated ids.'}, status=status.HTTP_400_BAD_REQUEST)
+        rollups = rollups.filter(service_point_id__in=service_point_ids)
+        sketches = sketches.filter(service_point_id__in=service_point_ids)
+
+    for param, lookup, days in (('start', 'gte', 0), ('end', 'lt', 1)):
+        value = request.query_params.get(param)
+        if not value:
+            continue
+        try:
+            day = parse_date(value)
+        except ValueError:
+            day = None
+        if day is None:
+            return Response({'error': f'Invalid {param} date, expected YYYY-MM-DD.'}, status=status.HTTP_400_BAD_REQUEST)
+        day += timedelta(days=days)
+        rollups = rollups.filter(**{f'hour__{lookup}': timezone.make_aware(datetime.combine(day, time.min))})
+        sketches = sketches.filter(**{f'day__{lookup}': day})
+
+    totals = rollups.aggregate(
+        joins=Sum('joins'),
+        served=Sum('served'),
+        abandoned=Sum('abandoned'),
+        wait_seconds_sum=Sum('wait_seconds_sum'),
+        wait_count=Sum('wait_count')
+    )
 
     # Average wait time in minutes
-    avg_wait_time_delta = QueueEntry.objects.filter(
-        service_point__in=service_points,
-        status='served',
-        served_at__isnull=False
-    ).aggregate(
-        avg_wait=Avg(F('served_at') - F('joined_at'))
-    )['avg_wait']
-    average_wait_time = round(avg_wait_time_delta.total_seconds() / 60, 2) if avg_wait_time_delta else 0
-
-    # Busiest hour
-    busiest_hour_data = QueueEntry.objects.filter(
-        service_point__in=service_points
-    ).annotate(hour=ExtractHour('joined_at')).values('hour').annotate(count=Count('id')).order_by('-count').first()
-    busiest_hour = busiest_hour_data['hour'] if busiest_hour_data else None
-
-    # Abandoned queues
-    abandoned_queues = QueueEntry.objects.filter(
-        service_point__in=service_points,
-        status='abandoned'
-    ).count()
+    average_wait_time = 0
+    if totals['wait_count']:
+        average_wait_time = round(totals['wait_seconds_sum'] / totals['wait_count'] / 60, 2)
+
+    # Busiest hour of the day by joins
+    busiest_hour_data = rollups.annotate(
+        hour_of_day=ExtractHour('hour')
+    ).values('hour_of_day').annotate(count=Sum('joins')).order_by('-count', 'hour_of_day').first()
+    busiest_hour = busiest_hour_data['hour_of_day'] if busiest_hour_data and busiest_hour_data['count'] else None
+
+    # Wait and service time percentiles in minutes
+    percentiles = {}
+    for metric in ('wait', 'service'):
+        percentiles[metric] = {
+            p: round(seconds / 60, 2) if seconds is not None else None
+            for p, seconds in rollup_percentiles(sketches, metric).items()
+        }
 
     return Response({
-        'total_queues': total_queues,
+        'total_queues': totals['joins'] or 0,
+        'total_served': totals['served'] or 0,
         'average_wait_time': f"{average_wait_time} minutes",
+        'wait_time_percentiles': percentiles['wait'],
+        'service_time_percentiles': percentiles['service'],
         'busiest_hour': busiest_hour,
-        'abandoned_queues': abandoned_queues
+        'abandoned_queues': totals['abandoned'] or 0
+    })
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def staffing_forecast(request, service_point_id):
+    """
+    Forecast how many counters a service point needs in each hour of the
+    week to keep the mean wait within ``target_wait`` minutes, learnt from
+    the last ``weeks`` weeks of its queue history.
+    """
+    if request.user.role != 'staff':
+        return Response({'error': 'Only staff can view staffing forecasts.'}, status=status.HTTP_403_FORBIDDEN)
+
+    if not ServicePoint.objects.filter(id=service_point_id, creator=request.user).exists():
+        return Response({'error': 'Service point not found or you do not own it.'}, status=status.HTTP_404_NOT_FOUND)
+
+    try:
+        target_wait = float(request.query_params.get('target_wait', settings.STAFFING_TARGET_WAIT))
+        weeks = int(request.query_params.get('weeks', settings.STAFFING_HISTORY_WEEKS))
+    except ValueError:
+        return Response({'error': 'target_wait and weeks must be numbers.'}, status=status.HTTP_400_BAD_REQUEST)
+    if not 0 < target_wait < float('inf') or not 0 < weeks <= MAX_WEEKS:
+        return Response(
+            {'error': f'target_wait must be positive and weeks between 1 and {MAX_WEEKS}.'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    return Response({
+        'service_point_id': service_point_id,
+        'target_wait_minutes': target_wait,
+        'weeks': weeks,
+        'hours': forecast(service_point_id, target_wait=target_wait, weeks=weeks),
+    })
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def service_point_presence(request, service_point_id):
+    """
+    List the users with a live WebSocket on one of the staff's service points.
+    """
+    if request.user.role != 'staff':
+        return Response({'error': 'Only staff can view who is connected.'}, status=status.HTTP_403_FORBIDDEN)
+
+    if not ServicePoint.objects.filter(id=service_point_id, creator=request.user).exists():
+        return Response({'error': 'Service point not found or you do not own it.'}, status=status.HTTP_404_NOT_FOUND)
+
+    user_ids = get_presence().connected(service_point_id)
+    return Response({
+        'service_point_id': service_point_id,
+        'connected_count': len(user_ids),
+        'user_ids': user_ids,
     })
 
 
@@ -345,18 +474,10 @@ def leave_queue(request):
         if not queue_entry:
             return Response({'error': 'You are not in any queue.'}, status=status.HTTP_404_NOT_FOUND)
 
-    # Mark as abandoned
-    queue_entry.status = 'abandoned'
-    queue_entry.save()
-
-    # Update positions of remaining customers
-    QueueEntry.objects.filter(
-        service_point=queue_entry.service_point,
-        position__gt=queue_entry.position,
-        status__in=['waiting', 'called']
-    ).update(position=F('position') - 1)
-
-    send_queue_update(queue_entry.service_point.id)
+    with transaction.atomic():
+        # Mark as abandoned and move the rest of the queue up
+        get_queue_engine().abandon(queue_entry)
+        enqueue_queue_update(queue_entry.service_point_id)
 
     return Response({'message': 'Successfully left the queue.'})
 
@@ -365,11 +486,12 @@ def leave_queue(request):
 @permission_classes([IsAuthenticated])
 def notifications(request):
     """
-    Get user's notifications.
+    Get user's notifications, newest first, one cursor page at a time.
     """
-    notifications = Notification.objects.filter(user=request.user)
+    paginator = KeysetPagination('created_at')
+    notifications = paginator.paginate_queryset(Notification.objects.filter(user=request.user), request)
     serializer = NotificationSerializer(notifications, many=True)
-    return Response(serializer.data)
+    return paginator.get_paginated_response(serializer.data)
 
 
 @api_view(['POST'])
@@ -405,8 +527,15 @@ def delete_notification(request, notification_id):
 @permission_classes([IsAuthenticated])
 def my_queues(request):
     """
-    Get all queue entries for the user (historical and active).
+    Get the user's queue entries (historical and active), newest first, one
+    cursor page at a time.
     """
-    queue_entries = QueueEntry.objects.filter(user=request.user).order_by('-joined_at')
+    paginator = KeysetPagination('joined_at')
+    queue_entries = paginator.paginate_queryset(
+        QueueEntry.objects.filter(user=request.user).select_related(
+            'user', 'service_point', 'service_type'
+        ).prefetch_related('service_point__service_types'),
+        request
+    )
     serializer = QueueEntrySerializer(queue_entries, many=True)
-    return Response(serializer.data)
+    return paginator.get_paginated_response(serializer.data)
@@ -24,20 +24,29 @@ const UserDashboard = ({ user }) => {
     if (userQueue && userQueue.service_point?.id) {
       const ws = new WebSocket(`${WS_BASE_URL}/ws/queues/${userQueue.service_point.id}/`);
       ws.onmessage = (event) => {
-        const data = JSON.parse(event.data);
-        if (data.position !== undefined) {
-          setUserQueue(prev => ({ ...prev, position: data.position }));
+        const message = JSON.parse(event.data);
+        if (message.type === 'queue_update' && message.data.position !== undefined) {
+          setUserQueue(prev => ({ ...prev, position: message.data.position, eta_seconds: message.data.eta_seconds }));
+        } else if (message.type === 'notification') {
+          setNotifications(prev => [message.data, ...prev.filter(n => n.id !== message.data.id)]);
         }
       };
+      // Keeps this socket in the server's presence registry
+      const heartbeat = setInterval(() => {
+        if (ws.readyState === WebSocket.OPEN) {
+          ws.send(JSON.stringify({ type: 'heartbeat' }));
+        }
+      }, 30000);
       wsRef.current = ws;
 
       return () => {
+        clearInterval(heartbeat);
         if (wsRef.current) {
           wsRef.current.close();
         }
       };
     }
-  }, [userQueue]);
+  }, [userQueue?.service_point?.id]);
 
   const fetchServicePoints = async () => {
     try {
@@ -62,7 +71,7 @@ const UserDashboard = ({ user }) => {
   const fetchNotifications = async () => {
     try {
       const response = await axios.get(`${API_BASE_URL}/api/queues/notifications/`);
-      setNotifications(response.data);
+      setNotifications(response.data.results);
     } catch (err) {
       console.error(err);
     }
@@ -71,7 +80,7 @@ const UserDashboard = ({ user }) => {
   const fetchMyQueues = async () => {
     try {
       const response = await axios.get(`${API_BASE_URL}/api/queues/my-queues/`);
-      setMyQueues(response.data);
+      setMyQueues(response.data.results);
     } catch (err) {
       console.error(err);
     }
@@ -162,7 +171,7 @@ const UserDashboard = ({ user }) => {
             <p><strong>Ticket Number:</strong> {userQueue.ticket_number || "N/A"}</p>
             <p><strong>Position:</strong> {userQueue.position}</p>
             <p><strong>Status:</strong> {userQueue.status}</p>
-            <p><strong>Estimated Wait Time:</strong> {userQueue.estimated_wait_time ? `${Math.floor(userQueue.estimated_wait_time / 60)} minutes` : "Calculating..."}</p>
+            <p><strong>Estimated Wait Time:</strong> {userQueue.eta_seconds != null ? `${Math.floor(userQueue.eta_seconds / 60)} minutes` : "Calculating..."}</p>
             <p><strong>Joined At:</strong> {new Date(userQueue.joined_at).toLocaleString()}</p>
             {userQueue.service_type && <p><strong>Service Type:</strong> {userQueue.service_type.name}</p>}
             {userQueue.service_point?.latitude && userQueue.service_point?.longitude && (